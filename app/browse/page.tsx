@@ -2,42 +2,57 @@
 
 import { useState, useEffect } from "react"
 import { CourseCard } from "@/components/ui/course-card"
-import { supabase } from "@/utils/supabase"
 
 interface Course {
   id: string;
   title: string;
   summary: string;
-  created_at: string;
+  createdAt: string;
 }
 
+const PAGE_SIZE = 24
+
 export default function BrowsePage() {
   const [courses, setCourses] = useState<Course[]>([])
+  const [total, setTotal] = useState(0)
+  const [query, setQuery] = useState("")
   const [loading, setLoading] = useState(true)
 
+  const fetchCourses = async (q: string, offset: number) => {
+    const params = new URLSearchParams({ q, offset: String(offset), limit: String(PAGE_SIZE) })
+    const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'}/api/courses/search?${params}`)
+    if (!res.ok) {
+      throw new Error(`Search failed: ${res.status}`)
+    }
+    return res.json()
+  }
+
+  // Published courses come from the backend search index, a page at a time
   useEffect(() => {
-    const fetchPublishedCourses = async () => {
+    const timer = setTimeout(async () => {
       try {
-        const { data, error } = await supabase
-          .from('courses')
-          .select('*')
-          .eq('is_published', true)
-          .order('created_at', { ascending: false })
-
-        if (error) {
-          console.error('Error fetching courses:', error)
-        } else {
-          setCourses(data || [])
-        }
+        const page = await fetchCourses(query, 0)
+        setCourses(page.results)
+        setTotal(page.total)
       } catch (error) {
         console.error('Error fetching courses:', error)
       } finally {
         setLoading(false)
       }
-    }
+    }, query ? 250 : 0)
+
+    return () => clearTimeout(timer)
+  }, [query])
 
-    fetchPublishedCourses()
-  }, [])
+  const loadMore = async () => {
+    try {
+      const page = await fetchCourses(query, courses.length)
+      setCourses(prev => [...prev, ...page.results])
+      setTotal(page.total)
+    } catch (error) {
+      console.error('Error fetching courses:', error)
+    }
+  }
 
   if (loading) {
     return (
@@ -71,6 +86,17 @@ export default function BrowsePage() {
             </p>
           </div>
 
+          {/* Search */}
+          <div className="max-w-4xl mx-auto mb-8">
+            <input
+              type="search"
+              value={query}
+              onChange={(e) => setQuery(e.target.value)}
+              placeholder="Search courses..."
+              className="w-full rounded-lg border border-slate-300 bg-white px-4 py-3 text-slate-900 focus:outline-none focus:ring-2 focus:ring-slate-400"
+            />
+          </div>
+
           {/* Course Grid */}
           <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6 max-w-4xl mx-auto">
             {courses.map((course) => (
@@ -87,12 +113,23 @@ export default function BrowsePage() {
                     arInstructions: [],
                     metaRayBansIntegration: false
                   },
-                  createdAt: course.created_at
+                  createdAt: course.createdAt
                 }}
               />
             ))}
           </div>
 
+          {courses.length < total && (
+            <div className="text-center mt-8">
+              <button
+                onClick={loadMore}
+                className="rounded-lg border border-slate-300 bg-white px-6 py-2 text-slate-700 hover:bg-slate-50"
+              >
+                Load more
+              </button>
+            </div>
+          )}
+
           {/* Empty State (if no courses) */}
           {courses.length === 0 && (
             <div className="text-center py-12">
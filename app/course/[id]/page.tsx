@@ -10,6 +10,25 @@ import { ActiveView, Module, SubModule } from "@/lib/types"
 import { supabase } from "@/utils/supabase"
 import { getUserId } from "@/lib/user-id"
 
+// Progress and quiz attempts go through the backend's batched ingestion endpoint
+async function postProgressEvents(events: any[]) {
+  try {
+    const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'}/api/progress/events`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ events })
+    })
+    if (!res.ok) {
+      console.error('Error saving progress:', res.status)
+      return null
+    }
+    return await res.json()
+  } catch (error) {
+    console.error('Error saving progress:', error)
+    return null
+  }
+}
+
 export default function CoursePage() {
   const router = useRouter()
   const params = useParams()
@@ -31,104 +50,18 @@ export default function CoursePage() {
       if (!params.id) return
 
       try {
-        // Fetch course basic info
-        const { data: courseData, error: courseError } = await supabase
-          .from('courses')
-          .select('*')
-          .eq('id', params.id)
-          .single()
-
-        if (courseError) {
-          console.error('Error fetching course:', courseError)
-          return
-        }
-
-        setIsPublished(courseData.is_published)
-
-        // Fetch modules
-        const { data: modulesData, error: modulesError } = await supabase
-          .from('modules')
-          .select('*')
-          .eq('course_id', params.id)
-          .order('idx')
+        // Fetch the whole course tree (modules, lessons, quizzes) in one request
+        const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'}/api/course/${params.id}/tree`)
 
-        if (modulesError) {
-          console.error('Error fetching modules:', modulesError)
+        if (!res.ok) {
+          console.error('Error fetching course:', res.status)
           return
         }
 
-        // Fetch submodules and quiz questions for each module
-        const modulesWithContent = await Promise.all(
-          modulesData.map(async (module) => {
-            // Fetch submodules
-            const { data: submodulesData, error: submodulesError } = await supabase
-              .from('submodules')
-              .select('*')
-              .eq('module_id', module.id)
-              .order('idx')
+        const courseObject = await res.json()
+        const modulesWithContent = courseObject.modules
 
-            if (submodulesError) {
-              console.error('Error fetching submodules:', submodulesError)
-              return { ...module, subModules: [], quiz: null }
-            }
-
-            // Separate instruction submodules from quiz submodules
-            const instructionSubmodules = submodulesData.filter(sm => sm.kind === 'instruction')
-            const quizSubmodules = submodulesData.filter(sm => sm.kind === 'quiz')
-
-            // Fetch quiz questions for quiz submodules
-            let quizData = null
-            if (quizSubmodules.length > 0) {
-              const { data: questionsData, error: questionsError } = await supabase
-                .from('quiz_questions')
-                .select('*') 
-                .eq('submodule_id', quizSubmodules[0].id)
-                .order('idx')
-
-              if (!questionsError && questionsData && questionsData.length > 0) {
-                quizData = {
-                  id: quizSubmodules[0].id,
-                  questions: questionsData.map(q => ({
-                    id: q.id,
-                    question: q.prompt,
-                    options: q.options,
-                    correctAnswer: parseInt(q.answer)
-                  }))
-                }
-              }
-            }
-
-            return {
-              id: module.id,
-              title: module.title,
-              isSafetyCheck: false, // We can add this field later if needed
-              subModules: instructionSubmodules.map(sm => ({
-                id: sm.id,
-                title: sm.title,
-                content: {
-                  text: sm.body,
-                  aiGeneratedImage: sm.image_url || "https://via.placeholder.com/400x200/4F46E5/FFFFFF?text=" + encodeURIComponent(sm.title)
-                }
-              })),
-              quiz: quizData
-            }
-          })
-        )
-
-        // Create course object in the expected format
-        const courseObject = {
-          id: courseData.id,
-          name: courseData.title,
-          learningObjectives: courseData.meta?.learningObjectives || [],
-          modules: modulesWithContent,
-          finalAssessment: courseData.meta?.finalAssessment || {
-            title: "Final Assessment",
-            description: "Complete the final assessment to finish this course.",
-            arInstructions: [],
-            metaRayBansIntegration: false
-          },
-          createdAt: courseData.created_at
-        }
+        setIsPublished(courseObject.isPublished)
 
         setCourse(courseObject)
         
@@ -246,14 +179,13 @@ export default function CoursePage() {
         // Save progress to database
         const userId = getUserId()
         if (userId) {
-          await supabase.from('question_progress').upsert({
-            user_id: userId,
-            submodule_id: subModuleId,
-            is_completed: true,
+          await postProgressEvents([{
+            type: 'progress',
+            userId,
+            submoduleId: subModuleId,
+            isCompleted: true,
             tries: 0
-          }, {
-            onConflict: 'user_id,submodule_id'
-          })
+          }])
         }
       }
     }
@@ -282,17 +214,21 @@ export default function CoursePage() {
         }
       })
       
-      const passed = correctAnswers / currentQuiz.quiz.questions.length >= 0.7
+      let passed = correctAnswers / currentQuiz.quiz.questions.length >= 0.7
       
-      // Save quiz completion to database
+      // Save quiz attempt; the backend grades it and records progress
       const userId = getUserId()
       if (userId && currentQuiz.quiz) {
-        await supabase.from('question_progress').upsert({
-          user_id: userId,
-          submodule_id: currentQuiz.quiz.id,
-          is_completed: passed,
+        const result = await postProgressEvents([{
+          type: 'attempt',
+          userId,
+          submoduleId: currentQuiz.quiz.id,
+          answers,
           tries: 1
-        })
+        }])
+        if (result?.results?.[0]) {
+          passed = result.results[0].passed
+        }
         
         // If quiz passed, mark it as completed submodule
         if (passed && !completedSubModules.includes(currentQuiz.quiz.id)) {
@@ -2,6 +2,7 @@ import json
 import os
 import asyncio
 import base64
+import time
 from dotenv import load_dotenv
 from typing import Optional
 from enum import Enum
@@ -28,6 +29,8 @@ from livekit.plugins import deepgram
 from livekit.plugins import google
 from livekit.plugins import noise_cancellation
 
+from scene_change import SceneChangeDetector, luma_thumbnail
+
 # Load .env/.env.local
 load_dotenv(".env")
 
@@ -35,6 +38,17 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 if not GOOGLE_API_KEY:
     raise RuntimeError("GOOGLE_API_KEY must be set in .env")
 
+# Step checks run when the learner's view changes and then settles, instead of on a fixed
+# timer: frames are sampled SCENE_SAMPLE_FPS times a second, and a check runs once the view
+# differs from the last checked one by SCENE_CHANGE_THRESHOLD (0..1) and has held still for
+# SCENE_DEBOUNCE seconds. Checks are at least SCENE_MIN_INTERVAL apart and at most
+# SCENE_MAX_INTERVAL apart (also the fallback when there is no video track).
+SCENE_SAMPLE_FPS = float(os.getenv("SCENE_SAMPLE_FPS", "2"))
+SCENE_CHANGE_THRESHOLD = float(os.getenv("SCENE_CHANGE_THRESHOLD", "0.18"))
+SCENE_DEBOUNCE = float(os.getenv("SCENE_DEBOUNCE", "1.5"))
+SCENE_MIN_INTERVAL = float(os.getenv("SCENE_MIN_INTERVAL", "4"))
+SCENE_MAX_INTERVAL = float(os.getenv("SCENE_MAX_INTERVAL", "30"))
+
 # ---------------------------------------
 # Course setup (can be overridden)
 # ---------------------------------------
@@ -124,7 +138,17 @@ class TeachingAssistant(Agent):
             ),
         )
         self.session_data = TeachingSession(course_title, steps)
-        self.periodic_task = None
+        self.scene = SceneChangeDetector(
+            threshold=SCENE_CHANGE_THRESHOLD,
+            debounce=SCENE_DEBOUNCE,
+            min_interval=SCENE_MIN_INTERVAL,
+            now=time.monotonic(),
+        )
+        self.scene_changed = asyncio.Event()
+        self.checks = {"scene": 0, "timer": 0}
+        self.started_at = time.monotonic()
+        self.check_task = None
+        self.video_task = None
 
     async def on_enter(self):
         print(f"[TeachingAssistant] Agent entering room for course: {self.session_data.course_title}")
@@ -136,8 +160,21 @@ class TeachingAssistant(Agent):
         await self.session.generate_reply(instructions=initial_prompt)
         print(f"[TeachingAssistant] Speaking current step...")
         await self.speak_current_step()
-        print(f"[TeachingAssistant] Starting periodic check...")
-        self.periodic_task = asyncio.create_task(self.periodic_check(10))
+        print(f"[TeachingAssistant] Starting scene-driven step checks...")
+        self.scene.mark_checked(time.monotonic())
+        self.video_task = asyncio.create_task(self.watch_video())
+        self.check_task = asyncio.create_task(self.step_check_loop())
+
+    async def on_exit(self):
+        for task in (self.check_task, self.video_task):
+            if task is not None:
+                task.cancel()
+        minutes = max((time.monotonic() - self.started_at) / 60, 1 / 60)
+        total = self.checks["scene"] + self.checks["timer"]
+        print(
+            f"[TeachingAssistant] {total} step checks ({self.checks['scene']} on scene change, "
+            f"{self.checks['timer']} on timer), {total / minutes:.1f} per minute"
+        )
 
     async def speak_current_step(self):
         step = self.session_data.get_current_step()
@@ -150,37 +187,93 @@ class TeachingAssistant(Agent):
         print(new_message.text_content)
             
 
-    async def periodic_check(self, interval_sec):
+    async def wait_for_video_track(self, room: rtc.Room) -> rtc.Track:
+        """The learner's camera track, waiting for it to be subscribed if need be."""
+        subscribed = asyncio.get_running_loop().create_future()
+
+        def on_track_subscribed(track: rtc.Track, publication, participant):
+            if track.kind == rtc.TrackKind.KIND_VIDEO and not subscribed.done():
+                subscribed.set_result(track)
+
+        room.on("track_subscribed", on_track_subscribed)
+        try:
+            for participant in room.remote_participants.values():
+                for publication in participant.track_publications.values():
+                    if publication.track is not None and publication.kind == rtc.TrackKind.KIND_VIDEO:
+                        return publication.track
+            return await subscribed
+        finally:
+            room.off("track_subscribed", on_track_subscribed)
+
+    async def watch_video(self):
+        """Sample the learner's video and wake the step checker when the scene changes."""
+        room = get_job_context().room
+        interval = 1 / SCENE_SAMPLE_FPS
         while not self.session_data.is_done():
-            step = self.session_data.get_current_step()
-            user_check = f"""
-            I am currently on step {self.session_data.current_step + 1}: "{step['title']}".
-            Assume that the video feed is exactly what I am seeing from my perspective, 
-            check if I am where I should be to start the first step. 
-            You must check the video feed in determining whether I am done or not.
-
-            If I am done, respond clearly with "Awesome, step complete".
-            If not, encourage me briefly (e.g., 'Almost there, make sure you tighten the screws.').
-            If I am doing something unsafe, warn me.
-            """
-            
-
-            response = await self.session.generate_reply(user_input=user_check)
-            response_text = response.chat_items[-1].content
-            print(f"[LLM Check Response] {response_text}")
-
-            status = StepEvaluator.evaluate_llm_response(response_text)
-            if status == StepStatus.COMPLETE:
-                self.session_data.mark_complete()
-                if not self.session_data.is_done():
-                    await self.speak_current_step()
-            elif status == StepStatus.NEEDS_ATTENTION:
-                await self.session.generate_reply(user_input="I am doing something wrong or dangerous. Warn me.")
-            else:
-                pass
-
-
-            await asyncio.sleep(interval_sec)
+            track = await self.wait_for_video_track(room)
+            stream = rtc.VideoStream(track)
+            last_sample = 0.0
+            try:
+                async for event in stream:
+                    if self.session_data.is_done():
+                        # The last step is complete; stop decoding frames
+                        return
+                    now = time.monotonic()
+                    if now - last_sample < interval:
+                        continue
+                    last_sample = now
+                    # The Y plane of an I420 frame is its grayscale image
+                    frame = event.frame.convert(rtc.VideoBufferType.I420)
+                    thumbnail = luma_thumbnail(frame.data, frame.width, frame.height)
+                    if self.scene.observe(thumbnail, now):
+                        self.scene_changed.set()
+            finally:
+                await stream.aclose()
+            # The track went away (unpublished, reconnecting); pick up the next one
+            await asyncio.sleep(1)
+
+    async def step_check_loop(self):
+        """Check the current step on a scene change, or after SCENE_MAX_INTERVAL without one."""
+        while not self.session_data.is_done():
+            timeout = max(0.0, self.scene.last_check + SCENE_MAX_INTERVAL - time.monotonic())
+            try:
+                await asyncio.wait_for(self.scene_changed.wait(), timeout=timeout)
+                trigger = "scene"
+            except asyncio.TimeoutError:
+                trigger = "timer"
+                self.scene.mark_checked(time.monotonic())
+            self.scene_changed.clear()
+            self.checks[trigger] += 1
+            print(f"[Step Check] Triggered by {trigger}")
+            await self.check_step()
+
+    async def check_step(self):
+        step = self.session_data.get_current_step()
+        user_check = f"""
+        I am currently on step {self.session_data.current_step + 1}: "{step['title']}".
+        Assume that the video feed is exactly what I am seeing from my perspective, 
+        check if I am where I should be to start the first step. 
+        You must check the video feed in determining whether I am done or not.
+
+        If I am done, respond clearly with "Awesome, step complete".
+        If not, encourage me briefly (e.g., 'Almost there, make sure you tighten the screws.').
+        If I am doing something unsafe, warn me.
+        """
+        
+
+        response = await self.session.generate_reply(user_input=user_check)
+        response_text = response.chat_items[-1].content
+        print(f"[LLM Check Response] {response_text}")
+
+        status = StepEvaluator.evaluate_llm_response(response_text)
+        if status == StepStatus.COMPLETE:
+            self.session_data.mark_complete()
+            if not self.session_data.is_done():
+                await self.speak_current_step()
+        elif status == StepStatus.NEEDS_ATTENTION:
+            await self.session.generate_reply(user_input="I am doing something wrong or dangerous. Warn me.")
+        else:
+            pass
 
 
 # ---------------------------------------
@@ -0,0 +1,59 @@
+from typing import Optional
+
+
+def _ratio(numerator, denominator) -> Optional[float]:
+    return round(numerator / denominator, 4) if denominator else None
+
+
+def fetch_course_stats(supabase, course_id: str) -> tuple:
+    """
+    Read a course's precomputed rows from submodule_stats and question_stats. Both
+    tables are maintained by database triggers, so this never touches the progress
+    or attempt tables.
+    """
+    submodules = supabase.table("submodule_stats").select("*").eq("course_id", course_id).execute()
+    questions = supabase.table("question_stats").select("*").eq("course_id", course_id).execute()
+    return submodules.data or [], questions.data or []
+
+
+def build_course_analytics(course_id: str, submodule_rows: list, question_rows: list) -> dict:
+    questions_by_submodule = {}
+    for row in sorted(question_rows, key=lambda row: row["idx"]):
+        questions_by_submodule.setdefault(row["submodule_id"], []).append({
+            "idx": row["idx"],
+            "answered": row["answered"],
+            "correct": row["correct"],
+            "accuracy": _ratio(row["correct"], row["answered"]),
+        })
+
+    submodules = []
+    totals = {"learners": 0, "completed": 0, "tries": 0, "attempts": 0, "correct": 0}
+    for row in submodule_rows:
+        totals["learners"] += row["learners"]
+        totals["completed"] += row["completed"]
+        totals["tries"] += row["total_tries"]
+        totals["attempts"] += row["attempts"]
+        totals["correct"] += row["correct_attempts"]
+        submodules.append({
+            "submoduleId": row["submodule_id"],
+            "learners": row["learners"],
+            "completed": row["completed"],
+            "completionRate": _ratio(row["completed"], row["learners"]),
+            "averageTries": _ratio(row["total_tries"], row["learners"]),
+            "attempts": row["attempts"],
+            "correctAttempts": row["correct_attempts"],
+            "accuracy": _ratio(row["correct_attempts"], row["attempts"]),
+            "questions": questions_by_submodule.get(row["submodule_id"], []),
+        })
+
+    return {
+        "courseId": course_id,
+        # Busiest submodule's learner count; per-course distinct learners are not tracked
+        "peakLearners": max((row["learners"] for row in submodule_rows), default=0),
+        # Share of started lessons/quizzes that were completed
+        "completionRate": _ratio(totals["completed"], totals["learners"]),
+        "averageTries": _ratio(totals["tries"], totals["learners"]),
+        "attempts": totals["attempts"],
+        "accuracy": _ratio(totals["correct"], totals["attempts"]),
+        "submodules": submodules,
+    }
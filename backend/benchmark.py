@@ -0,0 +1,352 @@
+"""
+End-to-end benchmark of the backend against local fakes, so regressions in the hot
+paths show up without spending API credits:
+
+    python benchmark.py --concurrency 16 --requests 200 --output bench.json
+    python benchmark.py --baseline bench.json   # exits 1 if p95 or throughput regressed
+
+fake_upstream (Anthropic Messages + Gemini) and fake_supabase (PostgREST) run as
+uvicorn subprocesses. main.app runs in a uvicorn server thread of this process, so
+the event-loop lag monitor sits on the backend's own loop, and every scenario is
+driven over real HTTP.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+import httpx
+import uvicorn
+
+from fake_upstream import fake_course
+from loop_monitor import LoopLagMonitor
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCENARIOS = ("course", "read", "voice", "claude")
+
+# Any three dot-separated segments pass the Supabase client's key format check
+FAKE_SERVICE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.YmVuY2g"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_fake(module: str, port: int, env: Dict[str, str]) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{module}:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env={**os.environ, **env},
+    )
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/stats", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"{module} did not start on port {port}")
+
+
+class BackendServer(uvicorn.Server):
+    """uvicorn server that runs the loop lag monitor on the backend's event loop."""
+
+    def __init__(self, config: uvicorn.Config, monitor: LoopLagMonitor):
+        super().__init__(config)
+        self.monitor = monitor
+
+    async def serve(self, sockets=None):
+        self.monitor.start()
+        try:
+            await super().serve(sockets)
+        finally:
+            await self.monitor.stop()
+
+
+def summarize(latencies: List[float]) -> dict:
+    values = sorted(latencies)
+    if not values:
+        return {"p50Ms": None, "p95Ms": None, "p99Ms": None, "meanMs": None, "maxMs": None}
+
+    def percentile(p: float) -> float:
+        return round(values[min(len(values) - 1, max(0, math.ceil(len(values) * p / 100) - 1))] * 1000, 2)
+
+    return {
+        "p50Ms": percentile(50),
+        "p95Ms": percentile(95),
+        "p99Ms": percentile(99),
+        "meanMs": round(sum(values) / len(values) * 1000, 2),
+        "maxMs": round(values[-1] * 1000, 2),
+    }
+
+
+class Benchmark:
+    def __init__(self, args, upstream_url: str, database_url: str, monitor: LoopLagMonitor):
+        self.args = args
+        self.upstream_url = upstream_url
+        self.database_url = database_url
+        self.monitor = monitor
+        self.run_id = uuid.uuid4().hex[:8]
+        self.course_ids: List[str] = []
+
+    async def upstream_counts(self, client: httpx.AsyncClient) -> dict:
+        upstream = (await client.get(f"{self.upstream_url}/stats")).json()
+        database = (await client.get(f"{self.database_url}/stats")).json()
+        return {
+            "anthropic": upstream["requests"],
+            "geminiText": upstream["gemini_requests"] - upstream["gemini_images"],
+            "geminiImages": upstream["gemini_images"],
+            "supabase": database["requests"],
+            "supabaseByCall": database["by_table"],
+        }
+
+    @staticmethod
+    def count_delta(before: dict, after: dict) -> dict:
+        delta = {}
+        for key, value in after.items():
+            if isinstance(value, dict):
+                nested = {k: v - before.get(key, {}).get(k, 0) for k, v in value.items()}
+                delta[key] = {k: v for k, v in nested.items() if v}
+            else:
+                delta[key] = value - before.get(key, 0)
+        return delta
+
+    async def run_scenario(self, client: httpx.AsyncClient, name: str,
+                           make_request: Callable[[httpx.AsyncClient, int], "asyncio.Future"], total: int) -> dict:
+        latencies: List[float] = []
+        statuses: Counter = Counter()
+        indexes = iter(range(total))
+
+        async def worker():
+            for i in indexes:
+                started = time.perf_counter()
+                try:
+                    response = await make_request(client, i)
+                    statuses[str(response.status_code)] += 1
+                except httpx.HTTPError as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - started)
+
+        before = await self.upstream_counts(client)
+        self.monitor.reset()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(min(self.args.concurrency, total))))
+        elapsed = time.perf_counter() - started
+        lag = self.monitor.stats()
+        after = await self.upstream_counts(client)
+
+        errors = sum(count for status, count in statuses.items() if not status.startswith("2"))
+        result = {
+            "requests": total,
+            "concurrency": self.args.concurrency,
+            "seconds": round(elapsed, 3),
+            "throughput": round(total / elapsed, 2) if elapsed else None,
+            "latency": summarize(latencies),
+            "statuses": dict(statuses),
+            "errors": errors,
+            "loopLag": lag,
+            "upstreamCalls": self.count_delta(before, after),
+        }
+        print(f"{name:>7}: {result['throughput']} req/s, p50 {result['latency']['p50Ms']}ms, "
+              f"p95 {result['latency']['p95Ms']}ms, p99 {result['latency']['p99Ms']}ms, "
+              f"loop lag max {lag['maxMs']}ms, errors {errors}")
+        return result
+
+    async def store_course(self, client: httpx.AsyncClient, i: int) -> httpx.Response:
+        course = fake_course(f"benchmark: Course {self.run_id} {i}")
+        response = await client.post("/api/course", json={"course": course})
+        if response.status_code == 200:
+            self.course_ids.append(response.json()["courseId"])
+        return response
+
+    async def read_course(self, client: httpx.AsyncClient, i: int) -> httpx.Response:
+        return await client.get(f"/api/course/{self.course_ids[i % len(self.course_ids)]}/tree")
+
+    async def voice_session(self, client: httpx.AsyncClient, i: int) -> httpx.Response:
+        return await client.post(f"/api/course/{self.course_ids[i % len(self.course_ids)]}/voice-session")
+
+    async def generate_course(self, client: httpx.AsyncClient, i: int) -> httpx.Response:
+        return await client.post("/api/claude", json={"prompt": f"benchmark: Topic {self.run_id} {i}", "cache": False})
+
+    async def run(self, backend_url: str) -> Dict[str, dict]:
+        results = {}
+        timeout = httpx.Timeout(self.args.timeout)
+        limits = httpx.Limits(max_connections=self.args.concurrency * 2, max_keepalive_connections=self.args.concurrency * 2)
+        async with httpx.AsyncClient(base_url=backend_url, timeout=timeout, limits=limits) as client:
+            for name in self.args.scenarios:
+                if name in ("read", "voice") and not self.course_ids:
+                    # Read paths need stored courses to read
+                    for i in range(10):
+                        await self.store_course(client, -1 - i)
+                if name == "course":
+                    results[name] = await self.run_scenario(client, name, self.store_course, self.args.requests)
+                elif name == "read":
+                    results[name] = await self.run_scenario(client, name, self.read_course, self.args.requests)
+                elif name == "voice":
+                    results[name] = await self.run_scenario(client, name, self.voice_session, self.args.requests)
+                elif name == "claude":
+                    results[name] = await self.run_scenario(client, name, self.generate_course, self.args.generate_requests)
+        return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Regressions against a previous results file: slower p95, lower throughput, more errors."""
+    regressions = []
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        old_p95, new_p95 = previous["latency"]["p95Ms"], current["latency"]["p95Ms"]
+        if old_p95 and new_p95 and new_p95 > old_p95 * (1 + tolerance):
+            regressions.append(f"{name}: p95 {old_p95}ms -> {new_p95}ms")
+        old_rps, new_rps = previous["throughput"], current["throughput"]
+        if old_rps and new_rps and new_rps < old_rps * (1 - tolerance):
+            regressions.append(f"{name}: throughput {old_rps} -> {new_rps} req/s")
+        if current["errors"] > previous["errors"]:
+            regressions.append(f"{name}: errors {previous['errors']} -> {current['errors']}")
+    return regressions
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the backend against local fake upstreams.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma-separated, run in order (default: {','.join(SCENARIOS)})")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--generate-requests", type=int, default=20, help="requests for the claude scenario")
+    parser.add_argument("--anthropic-latency", type=float, default=0.5, help="fake Claude time to first token (s)")
+    parser.add_argument("--chunk-delay", type=float, default=0.005, help="fake Claude delay between stream chunks (s)")
+    parser.add_argument("--gemini-latency", type=float, default=0.5, help="fake Gemini response time (s)")
+    parser.add_argument("--db-latency", type=float, default=0.005, help="fake Supabase response time (s)")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of fake Claude calls answered 429")
+    parser.add_argument("--timeout", type=float, default=180.0)
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--baseline", help="previous results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="foundry-bench-")
+    upstream_port, database_port, backend_port = free_port(), free_port(), free_port()
+    upstream_url = f"http://127.0.0.1:{upstream_port}"
+    database_url = f"http://127.0.0.1:{database_port}"
+
+    fakes = [
+        start_fake("fake_upstream", upstream_port, {
+            "FAKE_LATENCY": str(args.anthropic_latency),
+            "FAKE_CHUNK_DELAY": str(args.chunk_delay),
+            "FAKE_GEMINI_LATENCY": str(args.gemini_latency),
+            "FAKE_THROTTLE_RATE": str(args.throttle_rate),
+            "FAKE_OVERLOAD_RATE": "0",
+            "FAKE_MAX_CONCURRENCY": "100000",
+        }),
+        start_fake("fake_supabase", database_port, {"FAKE_DB_LATENCY": str(args.db_latency)}),
+    ]
+
+    # main reads its configuration at import time
+    os.environ.update({
+        "ANTHROPIC_API_KEY": "benchmark",
+        "ANTHROPIC_API_URL": f"{upstream_url}/v1/messages",
+        "GEMINI_API_KEY": "benchmark",
+        "GEMINI_API_ENDPOINT": upstream_url,
+        "NEXT_PUBLIC_SUPABASE_URL": database_url,
+        "SUPABASE_SERVICE_ROLE_KEY": FAKE_SERVICE_KEY,
+        "LIVEKIT_URL": "wss://benchmark.invalid",
+        "LIVEKIT_API_KEY": "benchmark",
+        "LIVEKIT_API_SECRET": "benchmark-secret",
+        "IMAGE_STORE_BACKEND": "local",
+        "IMAGE_STORE_DIR": os.path.join(workdir, "images"),
+        "IMAGE_CACHE_DIR": os.path.join(workdir, "image-cache"),
+        "JOB_STORE_PATH": os.path.join(workdir, "jobs.db"),
+        "INGEST_SPILL_DIR": os.path.join(workdir, "ingest"),
+        "SEARCH_SNAPSHOT_PATH": os.path.join(workdir, "search-index.json"),
+        "PUBLIC_API_URL": f"http://127.0.0.1:{backend_port}",
+        # Every generation should reach the fake upstream
+        "GENERATION_CACHE_ENABLED": "false",
+        # The voice scenario issues far more sessions for one course than a real classroom
+        "VOICE_MAX_SESSIONS": "0",
+        "VOICE_MAX_SESSIONS_PER_COURSE": "0",
+    })
+    sys.path.insert(0, BACKEND_DIR)
+    import main as backend
+
+    monitor = LoopLagMonitor()
+    server = BackendServer(
+        uvicorn.Config(backend.app, host="127.0.0.1", port=backend_port, log_level="warning"),
+        monitor,
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    try:
+        while not server.started:
+            if not thread.is_alive():
+                raise RuntimeError("backend failed to start")
+            time.sleep(0.05)
+
+        benchmark = Benchmark(args, upstream_url, database_url, monitor)
+        started = time.time()
+        scenarios = asyncio.run(benchmark.run(f"http://127.0.0.1:{backend_port}"))
+        results = {
+            "createdAt": datetime.now(timezone.utc).isoformat(),
+            "revision": git_revision(),
+            "durationSeconds": round(time.time() - started, 2),
+            "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+            "scenarios": scenarios,
+            "backend": {
+                "httpRequests": backend.clients.http_requests,
+                "upstreams": {"anthropic": backend.anthropic_governor.stats(), "gemini": backend.gemini_governor.stats()},
+            },
+        }
+    finally:
+        server.should_exit = True
+        thread.join(timeout=30)
+        for process in fakes:
+            process.terminate()
+            process.wait(timeout=10)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import asyncio
+import os
+from typing import Callable, Dict, Iterable, List, Optional
+
+import httpx
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class ClientRegistry:
+    """
+    Process-wide upstream clients, created once and shared by every handler.
+
+    All of them are built by start() from the app lifespan: the pooled httpx client,
+    the Supabase client and the Gemini models named there. The SDK imports and client
+    setup are slow and blocking, so they run in a worker thread before the first
+    request rather than on the event loop inside it. Tests can swap any of them for
+    local stand-ins with override().
+    """
+
+    def __init__(self):
+        self.max_connections = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "100"))
+        self.max_keepalive = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "20"))
+        self.keepalive_expiry = float(os.getenv("HTTP_POOL_KEEPALIVE_EXPIRY", "30"))
+        self.http2 = os.getenv("HTTP_POOL_HTTP2", "true").lower() == "true" and _http2_available()
+
+        self._http: Optional[httpx.AsyncClient] = None
+        self._owns_http = True
+        self._supabase = None
+        self._supabase_factory: Optional[Callable] = None
+        self._gemini_model_names: List[str] = []
+        self._gemini_models: Dict[str, object] = {}
+        self._gemini_model_factory: Optional[Callable[[str], object]] = None
+        self._started = False
+        self.http_requests = 0
+
+    async def start(self, gemini_models: Iterable[str] = ()):
+        """Open the HTTP pool and build the Supabase client and the named Gemini models."""
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                http2=self.http2,
+                timeout=httpx.Timeout(120.0, connect=10.0),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+                event_hooks={"request": [self._count_request]},
+            )
+            self._owns_http = True
+
+        self._gemini_model_names = list(dict.fromkeys(gemini_models))
+        if self._supabase is None:
+            self._supabase = await asyncio.to_thread(self._build_supabase)
+        self._gemini_models = await asyncio.to_thread(self._build_gemini_models)
+        self._started = True
+
+    async def close(self):
+        if self._http is not None and self._owns_http:
+            await self._http.aclose()
+        self._http = None
+        self._started = False
+
+    async def _count_request(self, request: httpx.Request):
+        self.http_requests += 1
+
+    def _build_supabase(self):
+        if self._supabase_factory is not None:
+            return self._supabase_factory()
+        url = os.getenv("NEXT_PUBLIC_SUPABASE_URL")
+        key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+        if not url or not key:
+            return None
+        from supabase import create_client
+        return create_client(url, key)
+
+    def _build_gemini_models(self) -> Dict[str, object]:
+        if self._gemini_model_factory is not None:
+            return {name: self._gemini_model_factory(name) for name in self._gemini_model_names}
+        gemini_api_key = os.getenv("GEMINI_API_KEY")
+        if not gemini_api_key or not self._gemini_model_names:
+            return {}
+        import google.generativeai as genai
+        endpoint = os.getenv("GEMINI_API_ENDPOINT")
+        if endpoint:
+            # e.g. the local fake_upstream server; only the REST transport takes a URL
+            genai.configure(api_key=gemini_api_key, transport="rest",
+                            client_options={"api_endpoint": endpoint})
+        else:
+            genai.configure(api_key=gemini_api_key)
+        return {name: genai.GenerativeModel(name) for name in self._gemini_model_names}
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        if self._http is None:
+            raise RuntimeError("HTTP client pool is not running; is the app lifespan active?")
+        return self._http
+
+    def supabase(self):
+        if self._supabase is None:
+            if not self._started:
+                raise RuntimeError("Supabase client is not built; is the app lifespan active?")
+            raise RuntimeError("NEXT_PUBLIC_SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set")
+        return self._supabase
+
+    def gemini_model(self, model_name: str):
+        """Return a shared Gemini model, or None when GEMINI_API_KEY isn't configured."""
+        if model_name not in self._gemini_model_names:
+            raise RuntimeError(f"Gemini model {model_name} was not built at startup")
+        return self._gemini_models.get(model_name)
+
+    def override(self, http: Optional[httpx.AsyncClient] = None, supabase=None,
+                 supabase_factory: Optional[Callable] = None,
+                 gemini_model_factory: Optional[Callable[[str], object]] = None):
+        """
+        Inject stand-in clients (e.g. an httpx client pointed at a fake server). Factories
+        are used by start(), or right away once the registry is running.
+        """
+        if http is not None:
+            self._http = http
+            self._owns_http = False
+        if supabase is not None:
+            self._supabase = supabase
+        if supabase_factory is not None:
+            self._supabase_factory = supabase_factory
+            self._supabase = supabase_factory() if self._started else None
+        if gemini_model_factory is not None:
+            self._gemini_model_factory = gemini_model_factory
+            self._gemini_models = self._build_gemini_models() if self._started else {}
+
+    def stats(self) -> dict:
+        pool = {"connections": None, "idle": None, "active": None}
+        try:
+            connections = self._http._transport._pool.connections
+            idle = sum(1 for c in connections if c.is_idle())
+            pool = {"connections": len(connections), "idle": idle, "active": len(connections) - idle}
+        except AttributeError:
+            # Injected clients may not use the default httpcore transport
+            pass
+
+        return {
+            "http": {
+                "running": self._http is not None,
+                "http2": self.http2,
+                "maxConnections": self.max_connections,
+                "maxKeepalive": self.max_keepalive,
+                "requests": self.http_requests,
+                **pool,
+            },
+            "supabase": {"initialized": self._supabase is not None},
+            "gemini": {"models": sorted(self._gemini_models.keys())},
+        }
@@ -0,0 +1,147 @@
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Already compressed, or (event streams) must reach the client chunk by chunk unbuffered
+SKIP_CONTENT_TYPES = ("text/event-stream", "image/", "video/", "audio/", "application/zip", "application/gzip")
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick "br" or "gzip" from an Accept-Encoding header, honouring q=0; None for identity."""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+
+    def allowed(encoding: str) -> bool:
+        return accepted.get(encoding, accepted.get("*", 0.0)) > 0
+
+    if brotli is not None and allowed("br"):
+        return "br"
+    if allowed("gzip"):
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def chunk(self, data: bytes) -> bytes:
+        """Compress data and flush it, so a streamed chunk reaches the client whole."""
+        if self.encoding == "br":
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self._brotli.process(data) + self._brotli.finish()
+        return self._zlib.compress(data) + self._zlib.flush()
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing responses with brotli (when installed) or gzip,
+    whichever the client accepts. Small bodies, responses that already have a
+    Content-Encoding, event streams and media are sent as they are. Streamed bodies
+    are compressed chunk by chunk. When the client accepts an encoding, a strong
+    ETag becomes weak on every response that could be compressed (304s and small
+    bodies included), since a compressed body's bytes differ from the identity
+    representation.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is None:
+                headers = MutableHeaders(raw=list(start.get("headers", [])))
+                content_type = headers.get("content-type", "")
+                if (
+                    start["status"] in (204, 206)
+                    or "content-encoding" in headers
+                    or content_type.startswith(SKIP_CONTENT_TYPES)
+                ):
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+
+                # Tagged the same whether or not this one is compressed, so a 304 or a small
+                # body carries the ETag a compressed 200 for the same content would
+                headers.add_vary_header("Accept-Encoding")
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["etag"] = f"W/{etag}"
+                if start["status"] == 304 or (not more_body and len(body) < self.minimum_size):
+                    passthrough = True
+                    await send({**start, "headers": headers.raw})
+                    await send(message)
+                    return
+
+                compressor = _Compressor(encoding, self.gzip_level, self.brotli_quality)
+                headers["content-encoding"] = encoding
+                if more_body:
+                    del headers["content-length"]
+                    await send({**start, "headers": headers.raw})
+                    await send({**message, "body": compressor.chunk(body)})
+                else:
+                    compressed = compressor.finish(body)
+                    headers["content-length"] = str(len(compressed))
+                    await send({**start, "headers": headers.raw})
+                    await send({**message, "body": compressed})
+                return
+
+            data = compressor.chunk(body) if more_body else compressor.finish(body)
+            await send({**message, "body": data})
+
+        await self.app(scope, receive, send_compressed)
+        # A response with headers but no body message (rare) still needs its start
+        if start is not None and compressor is None and not passthrough:
+            await send(start)
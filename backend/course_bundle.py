@@ -0,0 +1,140 @@
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+from io import BytesIO
+from typing import Dict, Iterator, Optional, Tuple
+
+from course_document import dumps_bytes
+
+BUNDLE_FORMAT = 1
+MANIFEST_NAME = "manifest.json"
+IMAGE_DIR = "images/"
+
+# Magic bytes -> (extension, content type)
+IMAGE_TYPES = (
+    (b"RIFF", ".webp", "image/webp"),
+    (b"\x89PNG", ".png", "image/png"),
+    (b"\xff\xd8\xff", ".jpg", "image/jpeg"),
+)
+
+
+class BundleError(ValueError):
+    """An archive that isn't a readable course bundle."""
+
+
+def image_type(data: bytes) -> Tuple[str, str]:
+    for magic, extension, content_type in IMAGE_TYPES:
+        if data.startswith(magic):
+            return extension, content_type
+    return ".bin", "application/octet-stream"
+
+
+def bundle_image_name(data: bytes) -> str:
+    """Content-addressed, so a picture shared by several lessons is stored once."""
+    return f"{hashlib.sha256(data).hexdigest()}{image_type(data)[0]}"
+
+
+def lesson_contents(course: dict) -> Iterator[dict]:
+    for module in course.get("modules", []):
+        for submodule in module.get("subModules", []):
+            yield submodule.setdefault("content", {})
+
+
+def image_urls(course: dict) -> set:
+    return {content["aiGeneratedImage"] for content in lesson_contents(course) if content.get("aiGeneratedImage")}
+
+
+def write_bundle(path: str, course: dict, images: Dict[str, bytes]):
+    """
+    Write a course bundle: manifest.json holds the course in the frontend's Course shape,
+    with each lesson image whose bytes are in images (keyed by URL) pointing at a file
+    under images/. Other image URLs (placeholders) are left as they are. The file is
+    written to a temporary file of its own next to path and moved into place, so readers
+    never see a partial bundle and concurrent builders (other processes) don't collide.
+    """
+    manifest = copy.deepcopy(course)
+    files = {}
+    for content in lesson_contents(manifest):
+        data = images.get(content.get("aiGeneratedImage"))
+        if data:
+            name = IMAGE_DIR + bundle_image_name(data)
+            files[name] = data
+            content["aiGeneratedImage"] = name
+            content.pop("thumbnailUrl", None)
+
+    directory, filename = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory or ".", prefix=f".{filename}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f, zipfile.ZipFile(f, "w") as archive:
+            archive.writestr(
+                zipfile.ZipInfo(MANIFEST_NAME),
+                dumps_bytes({"format": BUNDLE_FORMAT, "course": manifest}),
+                compress_type=zipfile.ZIP_DEFLATED,
+            )
+            # Images are already compressed; stored entries keep extraction cheap on devices
+            for name, data in sorted(files.items()):
+                archive.writestr(zipfile.ZipInfo(name), data, compress_type=zipfile.ZIP_STORED)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def read_bundle(data: bytes, max_unpacked: int = 512 * 1024 * 1024) -> Tuple[dict, Dict[str, bytes]]:
+    """(course, {archive path: image bytes}) from bundle bytes; image fields keep their archive paths."""
+    try:
+        with zipfile.ZipFile(BytesIO(data)) as archive:
+            if sum(info.file_size for info in archive.infolist()) > max_unpacked:
+                raise BundleError(f"Bundle unpacks to more than {max_unpacked} bytes")
+            try:
+                manifest = json.loads(archive.read(MANIFEST_NAME))
+            except KeyError:
+                raise BundleError(f"Bundle has no {MANIFEST_NAME}")
+            images = {
+                name: archive.read(name)
+                for name in archive.namelist()
+                if name.startswith(IMAGE_DIR) and not name.endswith("/")
+            }
+    except zipfile.BadZipFile as e:
+        raise BundleError(f"Not a zip archive: {str(e)}")
+    except json.JSONDecodeError as e:
+        raise BundleError(f"Invalid {MANIFEST_NAME}: {str(e)}")
+
+    if not isinstance(manifest, dict) or manifest.get("format") != BUNDLE_FORMAT:
+        raise BundleError(f"Unsupported bundle format: {manifest.get('format') if isinstance(manifest, dict) else None}")
+    course = manifest.get("course")
+    if not isinstance(course, dict):
+        raise BundleError("Bundle manifest has no course")
+    return course, images
+
+
+class BundleStore:
+    """Built bundles on the local filesystem, one zip per course."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path_for(self, course_id: str) -> Optional[str]:
+        # Course IDs arrive from the URL path, so refuse anything that isn't a plain name
+        if not course_id or os.path.basename(course_id) != course_id or course_id.startswith("."):
+            return None
+        return os.path.join(self.directory, f"{course_id}.zip")
+
+    def exists(self, course_id: str) -> bool:
+        path = self.path_for(course_id)
+        return path is not None and os.path.isfile(path)
+
+    def write(self, course_id: str, course: dict, images: Dict[str, bytes]) -> str:
+        path = self.path_for(course_id)
+        if path is None:
+            raise ValueError(f"Invalid course id: {course_id}")
+        write_bundle(path, course, images)
+        return path
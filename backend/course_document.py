@@ -0,0 +1,254 @@
+import json
+import re
+from typing import Any, List, Optional, Tuple
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, model_validator
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class CourseDocumentError(ValueError):
+    """Model output that holds no usable course, even after repair."""
+
+
+class CourseModel(BaseModel):
+    # Unknown fields ride along untouched, so newer prompts don't lose data here
+    model_config = ConfigDict(extra="allow")
+
+
+class LessonContent(CourseModel):
+    text: str = ""
+    aiGeneratedImage: Optional[str] = None
+    thumbnailUrl: Optional[str] = None
+
+
+class SubModule(CourseModel):
+    id: Optional[str] = None
+    title: str
+    content: LessonContent = Field(default_factory=LessonContent)
+
+
+class QuizQuestion(CourseModel):
+    id: Optional[str] = None
+    question: str
+    options: List[str] = Field(min_length=2)
+    correctAnswer: int
+
+    @model_validator(mode="after")
+    def answer_in_range(self):
+        if not 0 <= self.correctAnswer < len(self.options):
+            raise ValueError(f"correctAnswer {self.correctAnswer} is not an option index")
+        return self
+
+
+class Quiz(CourseModel):
+    id: Optional[str] = None
+    questions: List[QuizQuestion] = Field(default_factory=list)
+
+
+class Module(CourseModel):
+    id: Optional[str] = None
+    title: str
+    isSafetyCheck: bool = False
+    subModules: List[SubModule] = Field(default_factory=list)
+    quiz: Optional[Quiz] = None
+
+
+class FinalAssessment(CourseModel):
+    title: str = ""
+    description: str = ""
+    arInstructions: List[str] = Field(default_factory=list)
+    metaRayBansIntegration: bool = False
+
+
+class Course(CourseModel):
+    id: Optional[str] = None
+    name: str
+    learningObjectives: List[str] = Field(default_factory=list)
+    modules: List[Module] = Field(min_length=1)
+    finalAssessment: Optional[FinalAssessment] = None
+    createdAt: Optional[str] = None
+
+
+def dumps(value: Any, pretty: bool = False) -> str:
+    """JSON text for value, via orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_INDENT_2 if pretty else 0).decode()
+    return json.dumps(value, indent=2 if pretty else None, separators=None if pretty else (",", ":"))
+
+
+def dumps_bytes(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+TOKEN_RE = re.compile(
+    r'(?P<string>"(?:[^"\\]|\\.)*")'
+    r'|(?P<partial>"(?:[^"\\]|\\.)*\\?\Z)'  # a string cut off by the end of the text
+    r'|(?P<punct>[{}\[\],:])'
+    r'|(?P<literal>[^\s{}\[\],:"]+)'
+    r'|(?P<space>\s+)',
+    re.DOTALL,
+)
+
+CLOSERS = {"{": "}", "[": "]"}
+
+
+def repair_json(text: str, start: int = 0) -> Tuple[str, bool]:
+    """
+    Scan the JSON object starting at text[start] in one pass, dropping trailing commas
+    and ignoring whatever follows the top-level object (code fences, prose). If the
+    text ends before the object closes (output cut off at max_tokens), it is cut back
+    to the last complete value and the open containers are closed.
+    Returns (json_text, truncated).
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    # Output length and open containers at the last point where the document could end
+    safe: Tuple[int, Tuple[str, ...]] = (0, ())
+    previous = None
+
+    for match in TOKEN_RE.finditer(text, start):
+        kind = match.lastgroup
+        if kind == "space":
+            continue
+        if kind == "partial":
+            break
+        token = match.group()
+        first = token[0]
+
+        if first in "{[":
+            stack.append(first)
+            out.append(token)
+            safe = (len(out), tuple(stack))
+        elif first in "}]":
+            while out and out[-1] == ",":
+                out.pop()
+            if not stack or CLOSERS[stack[-1]] != token:
+                raise CourseDocumentError(f"Unbalanced '{token}' at offset {match.start()}")
+            stack.pop()
+            out.append(token)
+            if not stack:
+                return "".join(out), False
+            safe = (len(out), tuple(stack))
+        elif kind == "string":
+            out.append(token)
+            is_key = stack and stack[-1] == "{" and previous in ("{", ",")
+            if not is_key:
+                safe = (len(out), tuple(stack))
+        elif first in ",:":
+            out.append(token)
+        else:
+            out.append(token)
+            # A bare literal is only known to be whole once something follows it
+            if match.end() < len(text):
+                safe = (len(out), tuple(stack))
+        previous = first if first in "{[,:" else token
+
+    if not out:
+        raise CourseDocumentError("No JSON object found in model output")
+    # Safe points follow a value or an opener, so a dangling key or comma is cut too
+    length, open_containers = safe
+    out = out[:length]
+    out.extend(CLOSERS[container] for container in reversed(open_containers))
+    return "".join(out), True
+
+
+def parse_json_object(text: str) -> Optional[dict]:
+    """The first JSON object in model output, repaired if need be; None if there isn't one."""
+    start = text.find("{")
+    if start < 0:
+        return None
+    end = text.rfind("}")
+    try:
+        value = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        try:
+            value = json.loads(repair_json(text, start)[0])
+        except (CourseDocumentError, json.JSONDecodeError):
+            return None
+    return value if isinstance(value, dict) else None
+
+
+def describe_errors(error: ValidationError, limit: int = 5) -> str:
+    parts = [
+        f"{'.'.join(str(part) for part in detail['loc']) or 'course'}: {detail['msg']}"
+        for detail in error.errors()[:limit]
+    ]
+    return "; ".join(parts)
+
+
+def _prune_invalid(data: Any, error: ValidationError) -> bool:
+    """
+    Drop the list items that failed validation (a truncated document's last lesson,
+    question or module is usually incomplete); False if nothing could be dropped.
+    """
+    targets = set()
+    for detail in error.errors():
+        loc = detail["loc"]
+        cut = max((i for i, part in enumerate(loc) if isinstance(part, int)), default=None)
+        if cut is not None:
+            targets.add(tuple(loc[:cut + 1]))
+
+    # An item inside one that is dropped anyway needn't be dropped separately
+    targets = {loc for loc in targets if not any(loc[:i] in targets for i in range(1, len(loc)))}
+    pruned = False
+    # Highest index first, so earlier deletions don't shift later ones
+    for loc in sorted(targets, reverse=True):
+        parent = data
+        try:
+            for part in loc[:-1]:
+                parent = parent[part]
+            del parent[loc[-1]]
+            pruned = True
+        except (KeyError, IndexError, TypeError):
+            continue
+    return pruned
+
+
+def validate_course(data: Any, prune: bool = False) -> dict:
+    """
+    Validate a decoded course against the Course schema and return it normalized
+    (defaults filled in, nulls dropped). With prune, invalid list items (the unfinished
+    last lesson of truncated output, a question whose answer isn't one of its options)
+    are dropped and validation retried, rather than rejecting the whole course.
+    """
+    for _ in range(4 if prune else 1):
+        try:
+            return Course.model_validate(data).model_dump(exclude_none=True)
+        except ValidationError as e:
+            error = e
+            if not prune or not _prune_invalid(data, e):
+                break
+    raise CourseDocumentError(f"Course failed validation: {describe_errors(error)}")
+
+
+def parse_course_document(text: str) -> Tuple[dict, bool]:
+    """
+    Extract, repair and validate the course JSON in raw model output.
+    Returns (course, repaired), where repaired means something had to be fixed or
+    dropped; raises CourseDocumentError if nothing usable remains.
+    """
+    start = text.find("{")
+    if start < 0:
+        raise CourseDocumentError("No JSON object found in model output")
+
+    # Well-formed output (the usual case) is decoded and validated in a single pass
+    end = text.rfind("}")
+    if end > start:
+        try:
+            return Course.model_validate_json(text[start:end + 1]).model_dump(exclude_none=True), False
+        except ValidationError as e:
+            if not any(detail["type"] == "json_invalid" for detail in e.errors()):
+                return validate_course(json.loads(text[start:end + 1]), prune=True), True
+
+    repaired, _ = repair_json(text, start)
+    try:
+        data = json.loads(repaired)
+    except json.JSONDecodeError as e:
+        raise CourseDocumentError(f"Invalid JSON in model output: {str(e)}")
+    return validate_course(data, prune=True), True
@@ -0,0 +1,122 @@
+import logging
+import uuid
+from contextlib import nullcontext
+
+logger = logging.getLogger(__name__)
+
+
+def build_course_rows(course_data: dict) -> dict:
+    """
+    Flatten a generated course into rows for each table, with IDs assigned
+    client-side so every level can be inserted in a single bulk request.
+    """
+    if "name" not in course_data:
+        raise ValueError("Course data missing 'name' field")
+    if "modules" not in course_data or not course_data["modules"]:
+        raise ValueError("Course data missing 'modules' field or modules array is empty")
+
+    course_id = str(uuid.uuid4())
+    course_row = {
+        "id": course_id,
+        "title": course_data["name"],
+        "summary": f"Generated course: {course_data['name']}",
+        "is_published": False,
+        "meta": {
+            "learningObjectives": course_data.get("learningObjectives", []),
+            "finalAssessment": course_data.get("finalAssessment", {})
+        }
+    }
+
+    module_rows = []
+    submodule_rows = []
+    question_rows = []
+
+    for module_idx, module in enumerate(course_data["modules"]):
+        if "title" not in module:
+            raise ValueError(f"Module {module_idx} missing 'title' field")
+
+        module_id = str(uuid.uuid4())
+        module_rows.append({
+            "id": module_id,
+            "course_id": course_id,
+            "idx": module_idx,
+            "title": module["title"],
+            "summary": f"Module {module_idx + 1}: {module['title']}",
+        })
+
+        for sub_idx, submodule in enumerate(module.get("subModules", [])):
+            if not submodule.get("title"):
+                raise ValueError(f"Submodule {sub_idx} in module {module_idx} missing 'title' field")
+
+            content = submodule.get("content", {})
+            submodule_rows.append({
+                "id": str(uuid.uuid4()),
+                "module_id": module_id,
+                "idx": sub_idx,
+                "kind": "instruction",
+                "title": submodule["title"],
+                "body": content.get("text", ""),
+                "image_url": content.get("aiGeneratedImage", None)
+            })
+
+        # The quiz is stored as one more submodule after the lessons
+        if module.get("quiz") and module["quiz"].get("questions"):
+            quiz_id = str(uuid.uuid4())
+            submodule_rows.append({
+                "id": quiz_id,
+                "module_id": module_id,
+                "idx": len(module.get("subModules", [])),
+                "kind": "quiz",
+                "title": f"Quiz: {module['title']}",
+                "body": f"Quiz for {module['title']}",
+                "image_url": None
+            })
+
+            for q_idx, question in enumerate(module["quiz"]["questions"]):
+                question_rows.append({
+                    "id": str(uuid.uuid4()),
+                    "submodule_id": quiz_id,
+                    "idx": q_idx,
+                    "type": "multiple_choice",
+                    "prompt": question.get("question", ""),
+                    "options": question.get("options", []),
+                    "answer": str(question.get("correctAnswer", 0))
+                })
+
+    return {
+        "course": course_row,
+        "modules": module_rows,
+        "submodules": submodule_rows,
+        "quiz_questions": question_rows,
+    }
+
+
+def insert_course_rows(supabase, rows: dict, timed=None) -> dict:
+    """
+    Insert a flattened course with one request per table, regardless of course size.
+    If a later level fails, the course row is deleted so the cascade removes the
+    partial tree instead of leaving a half-written course behind.
+    timed(name), if given, returns a context manager timing each write (e.g. a metrics stage).
+    """
+    timed = timed or (lambda name: nullcontext())
+    with timed("db.courses"):
+        course_response = supabase.table("courses").insert(rows["course"]).execute()
+    if not course_response.data:
+        raise Exception(f"Supabase returned no data when creating course. Response: {course_response}")
+
+    course = course_response.data[0]
+    try:
+        for table in ("modules", "submodules", "quiz_questions"):
+            if rows[table]:
+                logger.info(f"Inserting {len(rows[table])} rows into {table}")
+                with timed(f"db.{table}"):
+                    supabase.table(table).insert(rows[table]).execute()
+    except Exception:
+        logger.error(f"Rolling back partially stored course {course['id']}")
+        try:
+            supabase.table("courses").delete().eq("id", course["id"]).execute()
+        except Exception as cleanup_error:
+            logger.error(f"Failed to roll back course {course['id']}: {str(cleanup_error)}")
+        raise
+
+    return course
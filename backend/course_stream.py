@@ -0,0 +1,202 @@
+import json
+import re
+from typing import Any, Callable, List, Optional, Tuple
+
+from course_document import CourseDocumentError, parse_course_document
+
+Path = Tuple[Any, ...]
+
+STRING_SPECIAL_RE = re.compile(r'[\\"]')
+LITERAL_END = frozenset(" \t\r\n,}]")
+
+
+class _Frame:
+    __slots__ = ("kind", "value", "path", "key", "index", "expecting_key")
+
+    def __init__(self, kind: str, path: Path):
+        self.kind = kind
+        self.value = {} if kind == "object" else []
+        self.path = path
+        self.key = None
+        self.index = 0
+        self.expecting_key = kind == "object"
+
+
+class CourseStreamParser:
+    """
+    Incremental JSON scanner for course text as it streams from the model.
+
+    feed() takes the next chunk of text and returns (path, value) pairs for every
+    object, array and string that completed within it, e.g.
+    (("modules", 0, "subModules", 2), {...lesson...}). Text before the first "{"
+    (such as a code fence) is skipped. Once the top-level object closes, result()
+    returns the whole decoded course.
+
+    Every character is decoded once: values are built up as they complete and
+    attached to their parent container, so the emitted objects are the same ones
+    that make up result(), not re-parsed copies.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._stack: List[_Frame] = []
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._literal_start: Optional[int] = None
+        self._result: Optional[dict] = None
+
+    @property
+    def done(self) -> bool:
+        return self._result is not None
+
+    @property
+    def text(self) -> str:
+        return self._buffer
+
+    def result(self) -> Optional[dict]:
+        return self._result
+
+    def _child_path(self) -> Path:
+        if not self._stack:
+            return ()
+        parent = self._stack[-1]
+        if parent.kind == "object":
+            return parent.path + (parent.key,)
+        return parent.path + (parent.index,)
+
+    def _attach(self, value: Any):
+        parent = self._stack[-1]
+        if parent.kind == "object":
+            parent.value[parent.key] = value
+        else:
+            parent.value.append(value)
+
+    def feed(self, chunk: str) -> List[Tuple[Path, Any]]:
+        self._buffer += chunk
+        completed = []
+        buf = self._buffer
+        end = len(buf)
+        pos = self._pos
+
+        while pos < end and not self.done:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    pos += 1
+                    continue
+                # Jump straight to the next quote or backslash
+                match = STRING_SPECIAL_RE.search(buf, pos)
+                if match is None:
+                    pos = end
+                    break
+                pos = match.start()
+                if buf[pos] == "\\":
+                    self._escape = True
+                    pos += 1
+                    continue
+                self._in_string = False
+                value = json.loads(buf[self._string_start:pos + 1])
+                top = self._stack[-1]
+                if top.kind == "object" and top.expecting_key:
+                    top.key = value
+                else:
+                    completed.append((self._child_path(), value))
+                    self._attach(value)
+                pos += 1
+                continue
+
+            ch = buf[pos]
+
+            if self._literal_start is not None:
+                # Numbers, true, false and null end at the next delimiter
+                if ch not in LITERAL_END:
+                    pos += 1
+                    continue
+                self._attach(json.loads(buf[self._literal_start:pos]))
+                self._literal_start = None
+
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                else:
+                    pos += 1
+                    continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif ch == "{" or ch == "[":
+                kind = "object" if ch == "{" else "array"
+                self._stack.append(_Frame(kind, self._child_path()))
+            elif ch == "}" or ch == "]":
+                frame = self._stack.pop()
+                completed.append((frame.path, frame.value))
+                if self._stack:
+                    self._attach(frame.value)
+                else:
+                    self._result = frame.value
+            elif ch == ":":
+                self._stack[-1].expecting_key = False
+            elif ch == ",":
+                top = self._stack[-1]
+                if top.kind == "object":
+                    top.expecting_key = True
+                else:
+                    top.index += 1
+            elif not ch.isspace():
+                self._literal_start = pos
+            pos += 1
+
+        self._pos = pos
+        return completed
+
+
+def course_event(path: Path, value: Any) -> Optional[Tuple[str, dict]]:
+    """Map a completed piece of the course document to a client-facing stream event."""
+    if path == ("name",):
+        return "course", {"name": value}
+    if path == ("learningObjectives",):
+        return "objectives", {"learningObjectives": value}
+    if path == ("finalAssessment",):
+        return "finalAssessment", {"finalAssessment": value}
+    if len(path) == 3 and path[0] == "modules" and path[2] == "title":
+        return "module", {"moduleIndex": path[1], "title": value}
+    if len(path) == 3 and path[0] == "modules" and path[2] == "quiz" and isinstance(value, dict):
+        return "quiz", {"moduleIndex": path[1], "quiz": value}
+    if len(path) == 4 and path[0] == "modules" and path[2] == "subModules" and isinstance(value, dict):
+        return "lesson", {"moduleIndex": path[1], "lessonIndex": path[3], "lesson": value}
+    return None
+
+
+# Text a model may write before the JSON starts (a code fence, a sentence) before it counts as not a course
+COURSE_PREFIX_LIMIT = 2000
+
+
+def course_output_check(prefix_limit: int = COURSE_PREFIX_LIMIT) -> Callable[[str, bool], Optional[bool]]:
+    """
+    An output check for ModelRouter.stream: accepts a model's stream once the course
+    "name" has completed as a string in the top-level object (nothing has reached the
+    client before that), and rejects one with no JSON object within prefix_limit
+    characters. A stream that ends undecided is accepted only if parse_course_document
+    can make a course of it.
+    """
+    parser = CourseStreamParser()
+
+    def check(chunk: str, finished: bool) -> Optional[bool]:
+        for path, value in parser.feed(chunk):
+            if path == ("name",) and isinstance(value, str):
+                return True
+        if finished:
+            try:
+                parse_course_document(parser.text)
+                return True
+            except CourseDocumentError:
+                return False
+        if len(parser.text) > prefix_limit and "{" not in parser.text:
+            return False
+        return None
+
+    return check
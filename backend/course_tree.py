@@ -0,0 +1,96 @@
+import hashlib
+from typing import Optional
+
+from course_document import dumps_bytes
+
+# One PostgREST request for the whole hierarchy via embedded resources
+COURSE_TREE_SELECT = "id, title, summary, meta, is_published, created_at, modules(*, submodules(*, quiz_questions(*)))"
+
+
+def fetch_course_row(supabase, course_id: str) -> Optional[dict]:
+    response = supabase.table("courses").select(COURSE_TREE_SELECT).eq("id", course_id).execute()
+    return response.data[0] if response.data else None
+
+
+def _by_idx(rows) -> list:
+    return sorted(rows or [], key=lambda row: row.get("idx", 0))
+
+
+def _answer_index(answer) -> Optional[int]:
+    try:
+        return int(answer)
+    except (TypeError, ValueError):
+        return None
+
+
+def build_course_tree(row: dict, placeholder_image) -> dict:
+    """Turn the nested course row into the Course shape the frontend renders (lib/types.ts)."""
+    meta = row.get("meta") or {}
+    modules = []
+
+    for module in _by_idx(row.get("modules")):
+        submodules = _by_idx(module.get("submodules"))
+        lessons = [sm for sm in submodules if sm.get("kind") == "instruction"]
+        quizzes = [sm for sm in submodules if sm.get("kind") == "quiz"]
+
+        quiz = None
+        if quizzes:
+            questions = _by_idx(quizzes[0].get("quiz_questions"))
+            if questions:
+                quiz = {
+                    "id": quizzes[0]["id"],
+                    "questions": [{
+                        "id": q["id"],
+                        "question": q.get("prompt", ""),
+                        "options": q.get("options") or [],
+                        "correctAnswer": _answer_index(q.get("answer")),
+                    } for q in questions],
+                }
+
+        modules.append({
+            "id": module["id"],
+            "title": module.get("title", ""),
+            "isSafetyCheck": False,
+            "subModules": [{
+                "id": sm["id"],
+                "title": sm.get("title", ""),
+                "content": {
+                    "text": sm.get("body") or "",
+                    "aiGeneratedImage": sm.get("image_url") or placeholder_image(sm.get("title", "")),
+                },
+            } for sm in lessons],
+            "quiz": quiz,
+        })
+
+    return {
+        "id": row["id"],
+        "name": row.get("title", ""),
+        "summary": row.get("summary"),
+        "isPublished": bool(row.get("is_published")),
+        "learningObjectives": meta.get("learningObjectives", []),
+        "modules": modules,
+        "finalAssessment": meta.get("finalAssessment") or {
+            "title": "Final Assessment",
+            "description": "Complete the final assessment to finish this course.",
+            "arInstructions": [],
+            "metaRayBansIntegration": False,
+        },
+        "createdAt": row.get("created_at"),
+    }
+
+
+def entity_tag(body: bytes) -> str:
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def serialize_course_tree(tree: dict) -> dict:
+    """Encode the tree once; the cached entry holds the bytes and their ETag."""
+    body = dumps_bytes(tree)
+    return {"body": body, "etag": entity_tag(body)}
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
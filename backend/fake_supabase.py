@@ -0,0 +1,236 @@
+"""
+In-memory stand-in for Supabase's PostgREST API, for benchmarks and local runs
+without a database:
+
+    FAKE_DB_LATENCY=0.005 uvicorn fake_supabase:app --port 8003
+    NEXT_PUBLIC_SUPABASE_URL=http://localhost:8003 SUPABASE_SERVICE_ROLE_KEY=x.y.z uvicorn main:app
+
+Covers what the backend uses: select with embedded child tables (linked by a
+<parent>_id column), eq/neq/in/is/not filters, order, limit/offset, insert, upsert
+(merge or ignore duplicates on on_conflict columns), update and delete, with
+deletes cascading to child tables like the real foreign keys.
+"""
+import asyncio
+import os
+import re
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+LATENCY = float(os.getenv("FAKE_DB_LATENCY", "0.005"))   # seconds per request
+
+app = FastAPI(title="Fake Supabase")
+
+tables: Dict[str, List[dict]] = {}
+state = {"requests": 0, "by_table": {}}
+
+# Query parameters that aren't column filters
+RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+EMBED_RE = re.compile(r"^(?:(\w+):)?(\w+)(?:!\w+)?\((.*)\)$", re.DOTALL)
+
+
+def foreign_key(table: str) -> str:
+    # courses -> course_id, quiz_questions -> quiz_question_id
+    return f"{table[:-1] if table.endswith('s') else table}_id"
+
+
+def split_top_level(text: str) -> List[str]:
+    parts, depth, current = [], 0, ""
+    for ch in text:
+        if ch == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+            continue
+        depth += ch == "("
+        depth -= ch == ")"
+        current += ch
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def parse_select(select: str) -> Tuple[List[str], List[Tuple[str, str, str]]]:
+    """(columns, [(alias, child_table, child_select)])"""
+    columns, embeds = [], []
+    for part in split_top_level(select or "*"):
+        match = EMBED_RE.match(part)
+        if match:
+            alias, table, inner = match.groups()
+            embeds.append((alias or table, table, inner))
+        else:
+            columns.append(part.split(":")[-1].split("::")[0])
+    return columns, embeds
+
+
+def unquote(value: str) -> str:
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1].replace('\\"', '"')
+    return value
+
+
+def matches(row: dict, column: str, expression: str) -> bool:
+    negate = expression.startswith("not.")
+    if negate:
+        expression = expression[4:]
+    operator, _, operand = expression.partition(".")
+    value = row.get(column)
+
+    if operator == "is":
+        result = value is None if operand == "null" else str(value).lower() == operand
+    elif operator == "in":
+        options = [unquote(option) for option in split_top_level(operand.strip("()"))]
+        result = _text(value) in options
+    elif operator in ("eq", "neq"):
+        result = _text(value) == unquote(operand)
+        if operator == "neq":
+            result = not result
+    else:
+        raise ValueError(f"Unsupported filter operator: {operator}")
+    return not result if negate else result
+
+
+def _text(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return "" if value is None else str(value)
+
+
+def project(table: str, row: dict, select: str) -> dict:
+    columns, embeds = parse_select(select)
+    if "*" in columns:
+        result = dict(row)
+    else:
+        result = {column: row.get(column) for column in columns}
+    for alias, child_table, child_select in embeds:
+        key = foreign_key(table)
+        result[alias] = [
+            project(child_table, child, child_select)
+            for child in tables.get(child_table, [])
+            if child.get(key) == row.get("id")
+        ]
+    return result
+
+
+def filtered(table: str, params) -> List[dict]:
+    rows = tables.get(table, [])
+    for column, expression in params.multi_items():
+        if column in RESERVED_PARAMS or "." in column:
+            continue
+        rows = [row for row in rows if matches(row, column, expression)]
+    return rows
+
+
+def prefer(request: Request) -> Dict[str, str]:
+    return dict(
+        item.strip().split("=", 1)
+        for item in request.headers.get("prefer", "").split(",")
+        if "=" in item
+    )
+
+
+def with_defaults(row: dict) -> dict:
+    row = dict(row)
+    row.setdefault("id", str(uuid.uuid4()))
+    row.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+    return row
+
+
+def cascade_delete(table: str, ids: set):
+    key = foreign_key(table)
+    for child_table, rows in tables.items():
+        if rows and key in rows[0]:
+            doomed = {row["id"] for row in rows if row.get(key) in ids and "id" in row}
+            tables[child_table] = [row for row in rows if row.get(key) not in ids]
+            if doomed:
+                cascade_delete(child_table, doomed)
+
+
+def reply(request: Request, rows: List[dict], status: int = 200) -> Response:
+    if prefer(request).get("return") == "minimal":
+        return Response(status_code=204 if status == 200 else status)
+    return JSONResponse(rows, status_code=status, headers={"content-range": f"0-{max(0, len(rows) - 1)}/*"})
+
+
+async def count(request: Request, table: str):
+    state["requests"] += 1
+    key = f"{request.method} {table}"
+    state["by_table"][key] = state["by_table"].get(key, 0) + 1
+    if LATENCY:
+        await asyncio.sleep(LATENCY)
+
+
+@app.get("/rest/v1/{table}")
+async def select_rows(table: str, request: Request):
+    await count(request, table)
+    params = request.query_params
+    rows = filtered(table, params)
+
+    order = params.get("order")
+    if order:
+        for term in reversed(order.split(",")):
+            column, _, direction = term.partition(".")
+            rows = sorted(rows, key=lambda row: (row.get(column) is None, _text(row.get(column))),
+                          reverse=direction.startswith("desc"))
+    offset = int(params.get("offset", 0))
+    limit: Optional[int] = int(params["limit"]) if "limit" in params else None
+    rows = rows[offset:offset + limit if limit is not None else None]
+
+    select = params.get("select", "*")
+    return reply(request, [project(table, row, select) for row in rows])
+
+
+@app.post("/rest/v1/{table}")
+async def insert_rows(table: str, request: Request):
+    await count(request, table)
+    body = await request.json()
+    incoming = body if isinstance(body, list) else [body]
+    existing = tables.setdefault(table, [])
+    preferences = prefer(request)
+    resolution = preferences.get("resolution")
+    conflict_columns = [c for c in (request.query_params.get("on_conflict") or "id").split(",") if c]
+
+    written = []
+    for row in incoming:
+        duplicate = None
+        if resolution:
+            duplicate = next(
+                (other for other in existing if all(other.get(c) == row.get(c) for c in conflict_columns)),
+                None,
+            )
+        if duplicate is None:
+            row = with_defaults(row)
+            existing.append(row)
+            written.append(row)
+        elif resolution == "merge-duplicates":
+            duplicate.update(row)
+            written.append(duplicate)
+    return reply(request, written, status=201)
+
+
+@app.patch("/rest/v1/{table}")
+async def update_rows(table: str, request: Request):
+    await count(request, table)
+    changes = await request.json()
+    rows = filtered(table, request.query_params)
+    for row in rows:
+        row.update(changes)
+    return reply(request, rows)
+
+
+@app.delete("/rest/v1/{table}")
+async def delete_rows(table: str, request: Request):
+    await count(request, table)
+    rows = filtered(table, request.query_params)
+    ids = {id(row) for row in rows}
+    tables[table] = [row for row in tables.get(table, []) if id(row) not in ids]
+    cascade_delete(table, {row["id"] for row in rows if "id" in row})
+    return reply(request, rows)
+
+
+@app.get("/stats")
+async def stats():
+    return {**state, "rows": {table: len(rows) for table, rows in tables.items()}}
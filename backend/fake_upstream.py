@@ -0,0 +1,182 @@
+"""
+Local stand-in for the Anthropic Messages API that injects throttling, for exercising
+the upstream governor without spending real quota:
+
+    FAKE_THROTTLE_RATE=0.3 FAKE_MAX_CONCURRENCY=4 uvicorn fake_upstream:app --port 8001
+    ANTHROPIC_API_URL=http://localhost:8001/v1/messages uvicorn main:app --reload
+
+Requests beyond FAKE_MAX_CONCURRENCY get a 429, like a provider concurrency cap.
+
+It also answers Gemini generateContent/streamGenerateContent calls: image models get
+a PNG, text models a course. Point the SDK at it with GEMINI_API_ENDPOINT=http://localhost:8001.
+"""
+import asyncio
+import base64
+import json
+import os
+import random
+from io import BytesIO
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from PIL import Image
+
+THROTTLE_RATE = float(os.getenv("FAKE_THROTTLE_RATE", "0.2"))    # share of requests answered 429
+OVERLOAD_RATE = float(os.getenv("FAKE_OVERLOAD_RATE", "0.05"))   # share answered 529
+ERROR_RATE = float(os.getenv("FAKE_ERROR_RATE", "0.0"))          # share answered 500
+RETRY_AFTER = os.getenv("FAKE_RETRY_AFTER", "1")
+MAX_CONCURRENCY = int(os.getenv("FAKE_MAX_CONCURRENCY", "8"))
+LATENCY = float(os.getenv("FAKE_LATENCY", "0.5"))                 # seconds per response
+CHUNK_DELAY = float(os.getenv("FAKE_CHUNK_DELAY", "0.01"))        # seconds between stream chunks
+GEMINI_LATENCY = float(os.getenv("FAKE_GEMINI_LATENCY", "1.0"))   # seconds per Gemini response
+IMAGE_SIZE = int(os.getenv("FAKE_IMAGE_SIZE", "512"))             # generated PNGs are IMAGE_SIZE square
+
+app = FastAPI(title="Fake upstream")
+
+state = {"in_flight": 0, "requests": 0, "throttled": 0, "overloaded": 0, "errors": 0,
+         "gemini_requests": 0, "gemini_images": 0}
+
+
+def fake_png(size: int) -> bytes:
+    # A gradient rather than a flat color, so the PNG is a realistic size to store and thumbnail
+    image = Image.linear_gradient("L").resize((size, size)).convert("RGB")
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+PNG_BASE64 = base64.b64encode(fake_png(IMAGE_SIZE)).decode()
+
+
+def fake_course(prompt: str) -> dict:
+    topic = prompt.rsplit(":", 1)[-1].strip()[:60] or "Fake Topic"
+    return {
+        "id": "fake-course",
+        "name": topic,
+        "learningObjectives": ["Understand the basics", "Practice safely"],
+        "modules": [{
+            "id": f"module-{m}",
+            "title": f"{topic} module {m + 1}",
+            "isSafetyCheck": False,
+            "subModules": [{
+                "id": f"lesson-{m}-{l}",
+                "title": f"{topic} lesson {m + 1}.{l + 1}",
+                "content": {"text": f"Lesson {m + 1}.{l + 1} about {topic}. " * 5, "aiGeneratedImage": "placeholder"},
+            } for l in range(3)],
+            "quiz": {
+                "id": f"quiz-{m}",
+                "questions": [{"id": f"q{q}", "question": f"Question {q + 1}?", "options": ["A", "B", "C", "D"], "correctAnswer": q % 4} for q in range(2)],
+            },
+        } for m in range(3)],
+        "finalAssessment": {
+            "title": "Final Project",
+            "description": f"Build something with {topic}",
+            "arInstructions": ["Step 1", "Step 2", "Step 3"],
+            "metaRayBansIntegration": True,
+        },
+        "createdAt": "2024-01-01T00:00:00.000Z",
+    }
+
+
+def error_response(status: int, error_type: str):
+    return JSONResponse(
+        status_code=status,
+        content={"type": "error", "error": {"type": error_type, "message": "injected by fake upstream"}},
+        headers={"retry-after": RETRY_AFTER} if status == 429 else None,
+    )
+
+
+def sse(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+@app.post("/v1/messages")
+async def messages(request: Request):
+    body = await request.json()
+    state["requests"] += 1
+
+    if state["in_flight"] >= MAX_CONCURRENCY or random.random() < THROTTLE_RATE:
+        state["throttled"] += 1
+        return error_response(429, "rate_limit_error")
+    roll = random.random()
+    if roll < OVERLOAD_RATE:
+        state["overloaded"] += 1
+        return error_response(529, "overloaded_error")
+    if roll < OVERLOAD_RATE + ERROR_RATE:
+        state["errors"] += 1
+        return error_response(500, "api_error")
+
+    prompt = body["messages"][0]["content"][0]["text"]
+    text = json.dumps(fake_course(prompt), indent=2)
+    usage = {"input_tokens": len(prompt) // 4, "output_tokens": len(text) // 4}
+
+    state["in_flight"] += 1
+    if not body.get("stream"):
+        try:
+            await asyncio.sleep(LATENCY)
+            return {"type": "message", "role": "assistant", "content": [{"type": "text", "text": text}], "usage": usage}
+        finally:
+            state["in_flight"] -= 1
+
+    async def events():
+        try:
+            yield sse({"type": "message_start", "message": {"usage": {"input_tokens": usage["input_tokens"]}}})
+            await asyncio.sleep(LATENCY)
+            for start in range(0, len(text), 64):
+                yield sse({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": text[start:start + 64]}})
+                await asyncio.sleep(CHUNK_DELAY)
+            yield sse({"type": "message_delta", "usage": {"output_tokens": usage["output_tokens"]}})
+            yield sse({"type": "message_stop"})
+        finally:
+            state["in_flight"] -= 1
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def gemini_candidate(part: dict) -> dict:
+    return {"content": {"role": "model", "parts": [part]}, "finishReason": "STOP", "index": 0}
+
+
+@app.post("/v1beta/models/{model_action}")
+async def gemini(model_action: str, request: Request):
+    model, _, action = model_action.partition(":")
+    body = await request.json()
+    state["gemini_requests"] += 1
+    prompt = " ".join(
+        part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", [])
+    )
+    usage = {"promptTokenCount": len(prompt) // 4}
+
+    if "image" in model:
+        state["gemini_images"] += 1
+        await asyncio.sleep(GEMINI_LATENCY)
+        return {
+            "candidates": [gemini_candidate({"inlineData": {"mimeType": "image/png", "data": PNG_BASE64}})],
+            "usageMetadata": {**usage, "candidatesTokenCount": 1290},
+        }
+
+    text = json.dumps(fake_course(prompt), indent=2)
+    usage["candidatesTokenCount"] = len(text) // 4
+    if action != "streamGenerateContent":
+        await asyncio.sleep(GEMINI_LATENCY)
+        return {"candidates": [gemini_candidate({"text": text})], "usageMetadata": usage}
+
+    async def chunks():
+        # The REST transport reads a streamed JSON array of responses
+        await asyncio.sleep(GEMINI_LATENCY)
+        pieces = [text[start:start + 256] for start in range(0, len(text), 256)]
+        yield "["
+        for idx, piece in enumerate(pieces):
+            response = {"candidates": [gemini_candidate({"text": piece})]}
+            if idx == len(pieces) - 1:
+                response["usageMetadata"] = usage
+            yield ("," if idx else "") + json.dumps(response)
+            await asyncio.sleep(CHUNK_DELAY)
+        yield "]"
+
+    return StreamingResponse(chunks(), media_type="application/json")
+
+
+@app.get("/stats")
+async def stats():
+    return state
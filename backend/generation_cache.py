@@ -0,0 +1,178 @@
+import asyncio
+import copy
+import hashlib
+import inspect
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from image_cache import normalize_prompt
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationCache:
+    """
+    In-memory LRU cache of finished course generations with a TTL.
+
+    Identical concurrent requests coalesce onto a single upstream generation, and
+    the token usage of every hit is counted as saved so the cache's value is visible.
+    The generation runs in a task the cache owns, so a caller going away (a closed
+    stream) doesn't fail the others; it is only cancelled once every caller has left.
+    Callers each get their own deep copy of the value, never the cached object.
+
+    Progress events the generation reports through publish(key, ...) reach every
+    caller's on_event while they wait; a caller joining mid-flight first gets the
+    events it missed, in order.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        # key -> {"task", "waiters" (callers waiting on it), "events" (published so far), "listeners"}
+        self._inflight: Dict[str, dict] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.saved_input_tokens = 0
+        self.saved_output_tokens = 0
+
+    @staticmethod
+    def make_key(prompt: str, model: str, template: str, options: Optional[dict] = None) -> str:
+        template_version = hashlib.sha256(template.encode()).hexdigest()[:16]
+        options_part = json.dumps(options or {}, sort_keys=True)
+        raw = f"{model}\n{template_version}\n{options_part}\n{normalize_prompt(prompt)}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: Any):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: str):
+        self._entries.pop(key, None)
+
+    def _count_saved(self, value: Any):
+        usage = value[2] if isinstance(value, tuple) and len(value) > 2 else None
+        if isinstance(usage, dict):
+            self.saved_input_tokens += usage.get("input_tokens", 0) or 0
+            self.saved_output_tokens += usage.get("output_tokens", 0) or 0
+
+    async def _generate(self, key: str, generate: Callable[[], Awaitable[Any]],
+                        should_cache: Callable[[Any], bool]) -> Any:
+        value = await generate()
+        if should_cache(value):
+            self.put(key, value)
+        return value
+
+    @staticmethod
+    async def _deliver(flight: dict, listener: Callable, event: str, data: Any):
+        try:
+            result = listener(event, data)
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            # One caller's failing handler mustn't fail the generation the others share
+            logger.warning(f"Dropping generation event listener after it failed: {str(e)}")
+            if listener in flight["listeners"]:
+                flight["listeners"].remove(listener)
+
+    async def publish(self, key: str, event: str, data: Any):
+        """Pass a progress event of key's in-flight generation to every caller waiting on it."""
+        flight = self._inflight.get(key)
+        if flight is None:
+            return
+        flight["events"].append((event, data))
+        for listener in list(flight["listeners"]):
+            await self._deliver(flight, listener, event, data)
+
+    async def get_or_generate(self, key: str, generate: Callable[[], Awaitable[Any]],
+                              should_cache: Callable[[Any], bool] = lambda value: True,
+                              on_event: Optional[Callable[[str, Any], Any]] = None) -> Tuple[Any, str]:
+        """
+        Return (value, source) where source is "hit", "coalesced" or "miss".
+        Only the "miss" caller's generate() runs; values failing should_cache are
+        returned but not stored. While waiting, on_event(event, data) (sync or async)
+        receives what the generation publishes; a hit gets no events.
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            self._count_saved(value)
+            return copy.deepcopy(value), "hit"
+
+        flight = self._inflight.get(key)
+        if flight is None:
+            self.misses += 1
+            source = "miss"
+            flight = self._inflight[key] = {"task": None, "waiters": 0, "events": [], "listeners": []}
+            task = flight["task"] = asyncio.create_task(self._generate(key, generate, should_cache))
+
+            def finished(task: asyncio.Task):
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+                if not task.cancelled():
+                    task.exception()  # retrieved here, so a failure nobody awaited isn't logged as lost
+
+            task.add_done_callback(finished)
+        else:
+            source = "coalesced"
+
+        task = flight["task"]
+        flight["waiters"] += 1
+        try:
+            if on_event is not None:
+                # Catch up on what was published before this caller joined; listening starts
+                # with no await after the last replayed event, so nothing is missed or reordered
+                delivered = 0
+                while delivered < len(flight["events"]):
+                    await self._deliver(flight, on_event, *flight["events"][delivered])
+                    delivered += 1
+                flight["listeners"].append(on_event)
+            value = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and flight["waiters"] == 1:
+                # The last caller left; nobody wants the result
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+                task.cancel()
+            raise
+        finally:
+            flight["waiters"] -= 1
+            if on_event in flight["listeners"]:
+                flight["listeners"].remove(on_event)
+
+        if source == "coalesced":
+            self.coalesced += 1
+            self._count_saved(value)
+        return copy.deepcopy(value), source
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.coalesced + self.misses
+        return {
+            "entries": len(self._entries),
+            "maxEntries": self.max_entries,
+            "ttlSeconds": self.ttl_seconds,
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hitRatio": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            "inflight": len(self._inflight),
+            "savedInputTokens": self.saved_input_tokens,
+            "savedOutputTokens": self.saved_output_tokens,
+        }
@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Optional, Tuple
+
+WEBP_QUALITY = 82
+THUMBNAIL_SIZE = (320, 320)
+
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Every object we write is named by the sha256 of its bytes (see ImagePipeline.save and
+# bundle_image_name), which keeps names from URLs safe to use as paths
+STORED_NAME = re.compile(r"[0-9a-f]{64}(_thumb)?\.(webp|png|jpg|bin)")
+
+
+def transcode_image(data: bytes) -> Tuple[bytes, bytes]:
+    """
+    Convert raw generated image bytes into a full-size WebP and a small WebP thumbnail.
+    Runs in a worker process, so it must stay a module-level function.
+    """
+    from PIL import Image
+
+    with Image.open(BytesIO(data)) as img:
+        img = img.convert("RGBA" if img.mode in ("RGBA", "LA", "P") else "RGB")
+
+        full = BytesIO()
+        img.save(full, format="WEBP", quality=WEBP_QUALITY, method=4)
+
+        img.thumbnail(THUMBNAIL_SIZE)
+        thumb = BytesIO()
+        img.save(thumb, format="WEBP", quality=WEBP_QUALITY, method=4)
+
+    return full.getvalue(), thumb.getvalue()
+
+
+class ImageStore(ABC):
+    """Base class for content-addressed image storage backends."""
+
+    @abstractmethod
+    def exists(self, name: str) -> bool:
+        ...
+
+    @abstractmethod
+    def put(self, name: str, data: bytes, content_type: str):
+        ...
+
+    @abstractmethod
+    def url_for(self, name: str) -> str:
+        ...
+
+    @abstractmethod
+    def url_prefix(self) -> str:
+        """What every URL from url_for() starts with."""
+
+    @abstractmethod
+    def read(self, name: str) -> Optional[bytes]:
+        ...
+
+    def name_for(self, url: Optional[str]) -> Optional[str]:
+        """The object name if url is one this store issued, otherwise None."""
+        prefix = self.url_prefix()
+        if not url or not url.startswith(prefix):
+            return None
+        name = url[len(prefix):]
+        return name if STORED_NAME.fullmatch(name) else None
+
+
+class LocalImageStore(ImageStore):
+    """Stores images on the local filesystem; served by the /api/images endpoint."""
+
+    def __init__(self, directory: str, base_url: str):
+        self.directory = directory
+        self.base_url = base_url.rstrip("/")
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path_for(self, name: str) -> Optional[str]:
+        # Names are generated by us, but they also arrive from the URL path, so refuse anything odd
+        if not name or os.path.basename(name) != name or name.startswith("."):
+            return None
+        return os.path.join(self.directory, name)
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(os.path.join(self.directory, name))
+
+    def put(self, name: str, data: bytes, content_type: str):
+        path = os.path.join(self.directory, name)
+        # The same bytes are often saved by several requests at once (duplicate prompts share
+        # cached image bytes), so each writer needs its own temporary file; the last rename wins
+        # with identical content. Dot-prefixed, so path_for never serves a partial file.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f".{name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def url_for(self, name: str) -> str:
+        return f"{self.base_url}/{name}"
+
+    def url_prefix(self) -> str:
+        return f"{self.base_url}/"
+
+    def read(self, name: str) -> Optional[bytes]:
+        path = self.path_for(name)
+        if path is None or not os.path.isfile(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+
+class SupabaseImageStore(ImageStore):
+    """Stores images in a public Supabase Storage bucket."""
+
+    def __init__(self, client_factory, bucket: str, public_url: str):
+        self.client_factory = client_factory
+        self.bucket = bucket
+        # <project URL>/storage/v1/object/public/<bucket>, the prefix of get_public_url()
+        self.public_url = public_url.rstrip("/")
+        self._known = set()
+
+    def exists(self, name: str) -> bool:
+        # Objects are content-addressed, so an upload we've already done never needs repeating
+        return name in self._known
+
+    def put(self, name: str, data: bytes, content_type: str):
+        self.client_factory().storage.from_(self.bucket).upload(
+            name,
+            data,
+            {"content-type": content_type, "cache-control": "31536000", "upsert": "true"},
+        )
+        self._known.add(name)
+
+    def url_for(self, name: str) -> str:
+        return self.client_factory().storage.from_(self.bucket).get_public_url(name)
+
+    def url_prefix(self) -> str:
+        return f"{self.public_url}/"
+
+    def read(self, name: str) -> Optional[bytes]:
+        return self.client_factory().storage.from_(self.bucket).download(name)
+
+
+class ImagePipeline:
+    """
+    Transcodes generated images in a process pool and writes them to an ImageStore,
+    returning short URLs for the course tree instead of inline base64.
+    """
+
+    def __init__(self, store: ImageStore, max_workers: int):
+        self.store = store
+        self.max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def _write(self, files: dict):
+        for name, (data, content_type) in files.items():
+            if not self.store.exists(name):
+                self.store.put(name, data, content_type)
+
+    async def save(self, data: bytes) -> dict:
+        """Store one generated image, returning {"url": ..., "thumbnailUrl": ...}."""
+        key = hashlib.sha256(data).hexdigest()
+        full_name = f"{key}.webp"
+        thumb_name = f"{key}_thumb.webp"
+
+        if self.store.exists(full_name) and self.store.exists(thumb_name):
+            return {"url": self.store.url_for(full_name), "thumbnailUrl": self.store.url_for(thumb_name)}
+
+        loop = asyncio.get_running_loop()
+        try:
+            full, thumb = await loop.run_in_executor(self._get_executor(), transcode_image, data)
+            files = {full_name: (full, "image/webp"), thumb_name: (thumb, "image/webp")}
+        except Exception as e:
+            # Keep the original bytes if Pillow can't handle them
+            print(f"Image transcode failed, storing original: {str(e)}")
+            full_name = thumb_name = f"{key}.png"
+            files = {full_name: (data, "image/png")}
+
+        await asyncio.to_thread(self._write, files)
+        return {"url": self.store.url_for(full_name), "thumbnailUrl": self.store.url_for(thumb_name)}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from typing import Awaitable, Callable, Dict, Optional
+
+from image_cache import normalize_prompt
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("queued", "running")
+
+# Rough share of the pipeline each stage represents, for progress reporting
+STAGE_PROGRESS = {
+    "queued": 0.0,
+    "generating_text": 0.1,
+    "generating_images": 0.5,
+    "storing": 0.9,
+    "completed": 1.0,
+}
+
+
+def prompt_key(prompt: str) -> str:
+    return hashlib.sha256(normalize_prompt(prompt).encode()).hexdigest()
+
+
+class JobStore:
+    """SQLite-backed record of course generation jobs, so they survive a restart."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, prompt_key TEXT NOT NULL, prompt TEXT NOT NULL, "
+            "status TEXT NOT NULL, stage TEXT NOT NULL, progress REAL NOT NULL, "
+            "course_id TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_prompt_key ON jobs(prompt_key, status)")
+        self._db.commit()
+
+    def create(self, prompt: str) -> dict:
+        now = time.time()
+        job = {
+            "id": str(uuid.uuid4()),
+            "prompt_key": prompt_key(prompt),
+            "prompt": prompt,
+            "status": "queued",
+            "stage": "queued",
+            "progress": 0.0,
+            "course_id": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, prompt_key, prompt, status, stage, progress, course_id, error, created_at, updated_at) "
+                "VALUES (:id, :prompt_key, :prompt, :status, :stage, :progress, :course_id, :error, :created_at, :updated_at)",
+                job,
+            )
+            self._db.commit()
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def find_active(self, prompt: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT * FROM jobs WHERE prompt_key = ? AND status IN (?, ?) ORDER BY created_at LIMIT 1",
+                (prompt_key(prompt), *ACTIVE_STATUSES),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def list_active(self) -> list:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?) ORDER BY created_at", ACTIVE_STATUSES
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def update(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = :{name}" for name in fields)
+        with self._lock:
+            self._db.execute(f"UPDATE jobs SET {assignments} WHERE id = :id", {**fields, "id": job_id})
+            self._db.commit()
+
+
+class JobManager:
+    """
+    Runs course generation jobs on a bounded pool of background workers.
+
+    run_job(job, report_stage) performs the pipeline and returns the stored course ID;
+    report_stage(stage) records progress as the job moves through the pipeline.
+    """
+
+    def __init__(self, store: JobStore, run_job: Callable[[dict, Callable[[str], Awaitable[None]]], Awaitable[str]],
+                 concurrency: int):
+        self.store = store
+        self.run_job = run_job
+        self.concurrency = max(1, concurrency)
+        self._queue: Optional[asyncio.Queue] = None
+        self._submit_lock: Optional[asyncio.Lock] = None
+        self._workers = []
+        self._running = 0
+        self.resumed = 0
+        self.interrupted = 0
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._submit_lock = asyncio.Lock()
+
+        for job in await asyncio.to_thread(self.store.list_active):
+            # The course may already be stored, and running it again would store a second copy
+            if job["status"] == "running" and job["stage"] == "storing":
+                logger.warning(f"Job {job['id']} was interrupted while storing its course; marking it failed")
+                await asyncio.to_thread(self.store.update, job["id"], status="failed",
+                                        error="Interrupted by a restart while storing the course")
+                self.interrupted += 1
+                continue
+            # Anything earlier stored nothing yet, so it starts over
+            logger.info(f"Resuming job {job['id']} from before restart")
+            self.resumed += 1
+            await asyncio.to_thread(self.store.update, job["id"], status="queued", stage="queued",
+                                    progress=STAGE_PROGRESS["queued"])
+            self._queue.put_nowait(job["id"])
+
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.concurrency)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, prompt: str) -> dict:
+        """Queue a job for prompt, or return the job already working on the same prompt."""
+        async with self._submit_lock:
+            existing = await asyncio.to_thread(self.store.find_active, prompt)
+            if existing:
+                return {**existing, "deduplicated": True}
+            job = await asyncio.to_thread(self.store.create, prompt)
+
+        self._queue.put_nowait(job["id"])
+        return {**job, "deduplicated": False}
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "running": self._running,
+            "workers": len(self._workers),
+            "resumed": self.resumed,
+            "interrupted": self.interrupted,
+        }
+
+    async def _worker(self, worker_idx: int):
+        while True:
+            job_id = await self._queue.get()
+            self._running += 1
+            try:
+                await self._run(job_id)
+            finally:
+                self._running -= 1
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None or job["status"] not in ACTIVE_STATUSES:
+            return
+
+        async def report_stage(stage: str):
+            await asyncio.to_thread(self.store.update, job_id, stage=stage,
+                                    progress=STAGE_PROGRESS.get(stage, job["progress"]))
+
+        logger.info(f"Starting job {job_id}")
+        await asyncio.to_thread(self.store.update, job_id, status="running")
+        try:
+            course_id = await self.run_job(job, report_stage)
+            await asyncio.to_thread(self.store.update, job_id, status="completed", stage="completed",
+                                    progress=STAGE_PROGRESS["completed"], course_id=course_id)
+            logger.info(f"Job {job_id} completed with course {course_id}")
+        except asyncio.CancelledError:
+            # Shutting down: leave the job active so it is picked up again on restart
+            raise
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            logger.error(traceback.format_exc())
+            await asyncio.to_thread(self.store.update, job_id, status="failed", error=str(e))
@@ -0,0 +1,161 @@
+import hashlib
+import logging
+import random
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+LESSONS_SELECT = "title, body, image_url"
+
+
+def shingles(text: str, size: int = 3) -> Set[int]:
+    """Hashed word n-grams of the normalized text (single words for very short text)."""
+    words = WORD_RE.findall((text or "").lower())
+    if len(words) < size:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return {int.from_bytes(hashlib.blake2b(gram.encode(), digest_size=8).digest(), "big") for gram in grams}
+
+
+def choose_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """(bands, rows) with bands * rows <= num_perm whose LSH S-curve midpoint is nearest the threshold."""
+    best = (num_perm, 1)
+    best_error = float("inf")
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+class LessonSimilarityIndex:
+    """
+    MinHash signatures of lesson title + body, bucketed with LSH so a new lesson is
+    compared only against likely near-duplicates. Each entry carries the image URL
+    it can lend; find() returns the closest entry whose estimated Jaccard similarity
+    reaches the threshold.
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, seed: int = 1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands, self.rows = choose_bands(num_perm, threshold)
+
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME)) for _ in range(num_perm)]
+
+        self._entries: Dict[str, dict] = {}
+        self._buckets: Dict[Tuple[int, int], Set[str]] = {}
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.matches = 0
+
+    def signature(self, title: str, body: str) -> Optional[List[int]]:
+        hashed = shingles(f"{title} {body}")
+        if not hashed:
+            return None
+        return [min((a * x + b) % MERSENNE_PRIME for x in hashed) for a, b in self._perms]
+
+    def _band_keys(self, signature: List[int]) -> List[Tuple[int, int]]:
+        return [
+            (band, hash(tuple(signature[band * self.rows:(band + 1) * self.rows])))
+            for band in range(self.bands)
+        ]
+
+    def add(self, title: str, body: str, image_url: str, thumbnail_url: Optional[str] = None) -> bool:
+        """
+        Index a lesson's text under its image; lessons sharing an image share one entry.
+        False if nothing was added (the image is already indexed, or the text has no words).
+        """
+        signature = self.signature(title, body)
+        if signature is None:
+            return False
+        entry = {"signature": signature, "imageUrl": image_url, "thumbnailUrl": thumbnail_url}
+        with self._lock:
+            if image_url in self._entries:
+                return False
+            self._entries[image_url] = entry
+            for key in self._band_keys(signature):
+                self._buckets.setdefault(key, set()).add(image_url)
+        return True
+
+    def find(self, title: str, body: str) -> Optional[dict]:
+        """Best near-duplicate as {"imageUrl", "thumbnailUrl", "similarity"}, or None."""
+        signature = self.signature(title, body)
+        with self._lock:
+            self.lookups += 1
+            if signature is None:
+                return None
+
+            candidates = set()
+            for key in self._band_keys(signature):
+                candidates.update(self._buckets.get(key, ()))
+
+            best, best_similarity = None, 0.0
+            for image_url in candidates:
+                entry = self._entries[image_url]
+                agreeing = sum(1 for mine, theirs in zip(signature, entry["signature"]) if mine == theirs)
+                similarity = agreeing / self.num_perm
+                if similarity > best_similarity:
+                    best, best_similarity = entry, similarity
+
+            if best is None or best_similarity < self.threshold:
+                return None
+            self.matches += 1
+            return {
+                "imageUrl": best["imageUrl"],
+                "thumbnailUrl": best["thumbnailUrl"],
+                "similarity": round(best_similarity, 4),
+            }
+
+    def build(self, fetch_page: Callable[[int, int], list], is_reusable: Callable[[str], bool],
+              page_size: int = 500) -> int:
+        """Bulk-load stored lessons page by page; returns how many were indexed."""
+        added = 0
+        start = 0
+        while True:
+            rows = fetch_page(start, start + page_size - 1)
+            for row in rows:
+                if not is_reusable(row.get("image_url")):
+                    continue
+                if self.add(row.get("title") or "", row.get("body") or "", row["image_url"]):
+                    added += 1
+            if len(rows) < page_size:
+                return added
+            start += page_size
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = len(self._entries)
+        return {
+            "entries": entries,
+            "threshold": self.threshold,
+            "numPerm": self.num_perm,
+            "bands": self.bands,
+            "rows": self.rows,
+            "lookups": self.lookups,
+            "matches": self.matches,
+            "matchRatio": self.matches / self.lookups if self.lookups else 0.0,
+        }
+
+
+def fetch_lesson_page(supabase, start: int, end: int) -> list:
+    response = (
+        supabase.table("submodules")
+        .select(LESSONS_SELECT)
+        .eq("kind", "instruction")
+        .not_.is_("image_url", "null")
+        .order("id")
+        .range(start, end)
+        .execute()
+    )
+    return response.data or []
@@ -0,0 +1,66 @@
+import asyncio
+import math
+from collections import deque
+from typing import Callable, Optional
+
+
+class LoopLagMonitor:
+    """
+    Measures event-loop lag: a task sleeps for interval and records how much later
+    than that it woke up. Blocking work on the loop thread (sync I/O, CPU-heavy
+    parsing) shows up directly as lag.
+    """
+
+    def __init__(self, interval: float = 0.01, max_samples: int = 100000,
+                 on_sample: Optional[Callable[[float], None]] = None):
+        self.interval = interval
+        # Also called with each lag in seconds, e.g. to feed a metrics histogram
+        self.on_sample = on_sample
+        self.samples = deque(maxlen=max_samples)
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if self.on_sample is not None:
+                self.on_sample(lag)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def reset(self):
+        self.samples.clear()
+        self.max_lag = 0.0
+
+    def stats(self) -> dict:
+        """Lag in milliseconds over the samples since the last reset."""
+        samples = sorted(self.samples)
+        if not samples:
+            return {"samples": 0, "meanMs": None, "p50Ms": None, "p99Ms": None, "maxMs": None}
+
+        def percentile(p: float) -> float:
+            return round(samples[min(len(samples) - 1, max(0, math.ceil(len(samples) * p / 100) - 1))] * 1000, 2)
+
+        return {
+            "samples": len(samples),
+            "meanMs": round(sum(samples) / len(samples) * 1000, 2),
+            "p50Ms": percentile(50),
+            "p99Ms": percentile(99),
+            "maxMs": round(self.max_lag * 1000, 2),
+        }
@@ -1,18 +1,95 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-import httpx
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 import json
 import os
 from dotenv import load_dotenv
-from supabase import create_client
-import google.generativeai as genai
 import base64
+import asyncio
+import hashlib
+import inspect
+import math
+import threading
 from io import BytesIO
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 import jwt
+import httpx
 from typing import Optional
 import logging
 import traceback
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+from analytics import build_course_analytics, fetch_course_stats
+from clients import ClientRegistry
+from compression import CompressionMiddleware
+from course_bundle import (
+    IMAGE_DIR as BUNDLE_IMAGE_DIR,
+    BundleError,
+    BundleStore,
+    bundle_image_name,
+    image_type,
+    image_urls,
+    lesson_contents,
+    read_bundle,
+)
+from course_document import (
+    CourseDocumentError,
+    dumps,
+    dumps_bytes,
+    parse_course_document,
+    parse_json_object,
+    validate_course,
+)
+from course_store import build_course_rows, insert_course_rows
+from course_stream import CourseStreamParser, course_event, course_output_check
+from course_tree import (
+    build_course_tree,
+    entity_tag,
+    etag_matches,
+    fetch_course_row,
+    serialize_course_tree,
+)
+from generation_cache import GenerationCache
+from image_cache import ImageCache
+from image_store import (
+    IMAGE_CACHE_CONTROL,
+    ImagePipeline,
+    LocalImageStore,
+    SupabaseImageStore,
+)
+from jobs import JobManager, JobStore
+from lesson_similarity import LessonSimilarityIndex, fetch_lesson_page
+from loop_monitor import LoopLagMonitor
+from memory_cache import MemoryCache
+from metrics import MetricsMiddleware, MetricsRegistry, span
+from model_router import InvalidOutputError, ModelRouter
+from progress_ingest import (
+    IngestBackpressure,
+    ProgressIngestor,
+    SubmoduleIndex,
+    attempt_row,
+    grade_attempt,
+    is_uuid,
+    progress_row,
+)
+from search_index import (
+    SearchIndex,
+    course_document,
+    course_document_from_tree_row,
+    fetch_course_states,
+    fetch_documents,
+    fetch_published_documents,
+)
+from upstream_governor import (
+    THROTTLE_STATUSES,
+    CircuitOpenError,
+    UpstreamError,
+    UpstreamGovernor,
+    parse_retry_after,
+)
+from voice_payload import build_voice_payload
+from voice_sessions import TokenSigner, VoiceSessionLimitError, VoiceSessionRegistry
 
 load_dotenv()
 
@@ -20,7 +97,88 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Foundry Course Builder API")
+clients = ClientRegistry()
+
+# Prometheus metrics, served at /metrics. With METRICS_TIMING_HEADER=true every response
+# also carries a Server-Timing header breaking its latency down by stage.
+METRICS_TIMING_HEADER = os.getenv("METRICS_TIMING_HEADER", "false").lower() == "true"
+metrics = MetricsRegistry()
+http_request_seconds = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route", "status"),
+)
+stage_seconds = metrics.histogram(
+    "pipeline_stage_duration_seconds", "Time spent in each stage of request handling", ("stage",),
+)
+llm_request_seconds = metrics.histogram(
+    "llm_request_duration_seconds", "Text model calls by model, mode (stream/complete) and outcome",
+    ("model", "mode", "outcome"),
+)
+llm_tokens = metrics.counter("llm_tokens_total", "Tokens reported by text model usage", ("model", "type"))
+lesson_images = metrics.counter(
+    "lesson_images_total", "Lesson image outcomes (generated, cached, reused, placeholder, timeout, failed, deadline)",
+    ("outcome",),
+)
+loop_lag_seconds = metrics.histogram(
+    "event_loop_lag_seconds", "How late the event loop woke a 10ms sleep",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+upstream_concurrency = metrics.gauge("upstream_concurrency_limit", "Adaptive concurrency limit per upstream", ("upstream",))
+upstream_in_flight = metrics.gauge("upstream_in_flight", "Calls currently in flight per upstream", ("upstream",))
+upstream_circuit_open = metrics.gauge("upstream_circuit_open", "1 while the upstream's circuit breaker is open", ("upstream",))
+voice_sessions_live = metrics.gauge("voice_sessions_live", "Voice sessions issued and not yet ended or expired")
+
+def collect_upstream_gauges():
+    for name, governor in (("anthropic", anthropic_governor), ("gemini", gemini_governor)):
+        upstream_concurrency.set(governor.limiter.limit, upstream=name)
+        upstream_in_flight.set(governor.limiter.in_flight, upstream=name)
+        upstream_circuit_open.set(1 if governor.breaker.state == "open" else 0, upstream=name)
+    voice_sessions_live.set(voice_sessions.live_count())
+
+metrics.on_collect(collect_upstream_gauges)
+
+loop_monitor = LoopLagMonitor(interval=0.01, max_samples=1000, on_sample=loop_lag_seconds.observe)
+
+
+def stage(name: str):
+    """Time a block as pipeline stage name (and into the request's Server-Timing)."""
+    return span(stage_seconds, name, stage=name)
+
+
+def record_llm_usage(model: str, usage: Optional[dict]):
+    for key, value in (usage or {}).items():
+        if key.endswith("_tokens") and isinstance(value, (int, float)) and value:
+            llm_tokens.inc(value, model=model, type=key[:-len("_tokens")])
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loop_monitor.start()
+    await clients.start(gemini_models=[IMAGE_MODEL_NAME] + [model for model in TEXT_MODELS if is_gemini_model(model)])
+    await job_manager.start()
+    await progress_ingestor.start()
+    search_tasks = await start_search_index()
+    lesson_index_task = asyncio.create_task(build_lesson_index())
+    try:
+        yield
+    finally:
+        lesson_index_task.cancel()
+        await stop_search_index(search_tasks)
+        await progress_ingestor.stop()
+        await job_manager.stop()
+        await clients.close()
+        if image_pipeline is not None:
+            image_pipeline.shutdown()
+        await loop_monitor.stop()
+
+
+class CompactJSONResponse(JSONResponse):
+    """JSON responses encoded compactly with orjson (when installed)."""
+
+    def render(self, content) -> bytes:
+        return dumps_bytes(content)
+
+
+app = FastAPI(title="Foundry Course Builder API", lifespan=lifespan, default_response_class=CompactJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -29,13 +187,30 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+# gzip, or brotli when the brotli package is installed, for responses the client accepts it for
+if os.getenv("COMPRESSION_ENABLED", "true").lower() == "true":
+    app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")))
+# Outermost, so its latency covers CORS handling too
+app.add_middleware(MetricsMiddleware, histogram=http_request_seconds, timing_header=METRICS_TIMING_HEADER)
 
 def get_supabase_client():
-    url = os.getenv("NEXT_PUBLIC_SUPABASE_URL")
-    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+    return clients.supabase()
+
 
-    return create_client(url, key)
+def json_response(payload, status_code: int = 200) -> Response:
+    """Encode payload straight to compact JSON bytes, skipping FastAPI's response encoding pass."""
+    return Response(content=dumps_bytes(payload), status_code=status_code, media_type="application/json")
+
+
+def conditional_response(request: Request, body: bytes, etag: Optional[str] = None) -> Response:
+    """A JSON body tagged with an ETag; clients revalidating with a matching If-None-Match get 304."""
+    etag = etag or entity_tag(body)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 initial_prompt = """Create a course with this JSON structure:
@@ -85,10 +260,668 @@ Requirements: 3 modules, 3 lessons each, 2 quiz questions per module. Use kebab-
 
 Create a course about: """
 
+# Fan-out mode: a compact outline first, then each module written by its own call
+outline_prompt = """Create a course outline with this JSON structure:
+
+{
+  "id": "course-slug",
+  "name": "Course Name",
+  "learningObjectives": ["Goal 1", "Goal 2", "Goal 3", "Goal 4"],
+  "modules": [
+    {
+      "id": "module-slug",
+      "title": "Module Title",
+      "lessons": ["Lesson Title", "Lesson Title"]
+    }
+  ],
+  "finalAssessment": {
+    "title": "Final Project",
+    "description": "Project description",
+    "arInstructions": ["Step 1", "Step 2", "Step 3"],
+    "metaRayBansIntegration": true
+  }
+}
+
+Requirements: {module_count} modules, {lesson_count} lessons each. Use kebab-case IDs. Generate ONLY valid JSON.
+
+Create a course about: """
+
+module_prompt = """You are writing one module of the course "{course_name}".
+Module: "{module_title}"
+Lessons, in order: {lesson_titles}
+
+Write the module with this JSON structure:
+
+{
+  "subModules": [
+    {
+      "id": "lesson-slug",
+      "title": "Lesson Title",
+      "content": {
+        "text": "5-6 sentences worth of lesson content",
+        "aiGeneratedImage": "placeholder"
+      }
+    }
+  ],
+  "quiz": {
+    "id": "quiz-slug",
+    "questions": [
+      {
+        "id": "q1",
+        "question": "Question text?",
+        "options": ["A", "B", "C", "D"],
+        "correctAnswer": 0
+      }
+    ]
+  }
+}
+
+Requirements: one subModule per lesson above, using those titles. 2 quiz questions. Use kebab-case IDs. Generate ONLY valid JSON."""
+
+# "single" asks Claude for the whole course in one streamed call; "fanout" writes an
+# outline first and then every module in parallel. Requests can override with "mode".
+GENERATION_MODE = os.getenv("GENERATION_MODE", "single")
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", "6"))
+FANOUT_MAX_MODULES = int(os.getenv("FANOUT_MAX_MODULES", "20"))
+FANOUT_OUTLINE_MAX_TOKENS = int(os.getenv("FANOUT_OUTLINE_MAX_TOKENS", "2000"))
+FANOUT_MODULE_MAX_TOKENS = int(os.getenv("FANOUT_MODULE_MAX_TOKENS", "3000"))
+
+CLAUDE_MODEL = "claude-sonnet-4-20250514"
+
+# Text models in order of preference. The first is always tried; if it hasn't produced
+# output by its p95 time-to-first-output a hedged request goes to the next one (first to
+# deliver wins, the other is cancelled), and one that fails falls back to the next.
+# Names starting with "gemini" go to the Gemini API, the rest to Anthropic.
+TEXT_MODELS = [name.strip() for name in os.getenv("TEXT_MODELS", f"{CLAUDE_MODEL},gemini-2.5-flash").split(",") if name.strip()]
+text_router = ModelRouter(
+    TEXT_MODELS,
+    hedge_enabled=os.getenv("HEDGE_ENABLED", "true").lower() == "true",
+    hedge_percentile=float(os.getenv("HEDGE_PERCENTILE", "95")),
+    hedge_min_samples=int(os.getenv("HEDGE_MIN_SAMPLES", "20")),
+    default_hedge_delay=float(os.getenv("HEDGE_DEFAULT_DELAY", "8")),
+    default_complete_delay=float(os.getenv("HEDGE_DEFAULT_COMPLETE_DELAY", "30")),
+)
+
+# Finished generations are cached by normalized prompt, model and prompt template,
+# so popular topics don't pay for Claude and Gemini again. Requests opt out with "cache": false.
+GENERATION_CACHE_ENABLED = os.getenv("GENERATION_CACHE_ENABLED", "true").lower() == "true"
+generation_cache = GenerationCache(
+    float(os.getenv("GENERATION_CACHE_TTL", "86400")),
+    int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "256")),
+) if GENERATION_CACHE_ENABLED else None
+
+# Serialized course trees for GET /api/course/{id}/tree, invalidated on store/publish
+course_tree_cache = MemoryCache(int(os.getenv("COURSE_TREE_CACHE_MAX_ENTRIES", "500")))
+
+# Voice prompt / session payloads, precomputed when a course is stored or published
+voice_payload_cache = MemoryCache(
+    int(os.getenv("VOICE_PAYLOAD_CACHE_MAX_ENTRIES", "1000")),
+    float(os.getenv("VOICE_PAYLOAD_CACHE_TTL", "3600")),
+)
+
+# Course analytics read from trigger-maintained summary tables; a short TTL absorbs dashboard polling
+analytics_cache = MemoryCache(
+    int(os.getenv("ANALYTICS_CACHE_MAX_ENTRIES", "500")),
+    float(os.getenv("ANALYTICS_CACHE_TTL", "30")),
+)
+
+ANTHROPIC_API_URL = os.getenv("ANTHROPIC_API_URL", "https://api.anthropic.com/v1/messages")
+
+# Every Claude and Gemini call goes through its provider's governor: request/token
+# budgets, adaptive concurrency, retries with backoff, and a circuit breaker.
+anthropic_governor = UpstreamGovernor.from_env(
+    "Claude", "ANTHROPIC", initial_concurrency=8, max_concurrency=32, max_retries=3,
+)
+gemini_governor = UpstreamGovernor.from_env(
+    "Gemini", "GEMINI", initial_concurrency=8, max_concurrency=16, max_retries=2,
+)
+
+IMAGE_MODEL_NAME = "gemini-2.5-flash-image"
+
+# Image generation limits: how many Gemini calls run at once, how long a single
+# image may take, and how long the whole batch may take before the remaining
+# lessons fall back to placeholders.
+IMAGE_GEN_CONCURRENCY = int(os.getenv("IMAGE_GEN_CONCURRENCY", "4"))
+IMAGE_GEN_TIMEOUT = float(os.getenv("IMAGE_GEN_TIMEOUT", "60"))
+IMAGE_GEN_TOTAL_TIMEOUT = float(os.getenv("IMAGE_GEN_TOTAL_TIMEOUT", "150"))
+
+FAILED_IMAGE_URL = "https://placehold.co/600x400/ef4444/ffffff?text=Generation+Failed"
+
+# Generated images are cached on disk by prompt + model, so regenerating a
+# familiar course topic doesn't go back to Gemini.
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "true").lower() == "true"
+image_cache = ImageCache(
+    os.getenv("IMAGE_CACHE_DIR", ".cache/images"),
+    int(os.getenv("IMAGE_CACHE_MAX_MB", "512")) * 1024 * 1024,
+) if IMAGE_CACHE_ENABLED else None
+
+# Where generated images end up: "local" writes WebP files served by /api/images,
+# "supabase" uploads them to a Storage bucket, "inline" keeps the old base64 data URIs.
+IMAGE_STORE_BACKEND = os.getenv("IMAGE_STORE_BACKEND", "local")
+PUBLIC_API_URL = os.getenv("PUBLIC_API_URL", "http://localhost:8000").rstrip("/")
+
+if IMAGE_STORE_BACKEND == "supabase":
+    IMAGE_STORE_BUCKET = os.getenv("IMAGE_STORE_BUCKET", "course-images")
+    image_store = SupabaseImageStore(
+        get_supabase_client,
+        IMAGE_STORE_BUCKET,
+        f"{os.getenv('NEXT_PUBLIC_SUPABASE_URL', '').rstrip('/')}/storage/v1/object/public/{IMAGE_STORE_BUCKET}",
+    )
+elif IMAGE_STORE_BACKEND == "local":
+    image_store = LocalImageStore(os.getenv("IMAGE_STORE_DIR", ".data/images"), f"{PUBLIC_API_URL}/api/images")
+else:
+    image_store = None
+
+image_pipeline = ImagePipeline(
+    image_store, int(os.getenv("IMAGE_TRANSCODE_WORKERS", "2"))
+) if image_store is not None else None
+
+
+# Lessons whose text nearly matches an already illustrated lesson reuse its image
+LESSON_DEDUP_ENABLED = os.getenv("LESSON_DEDUP_ENABLED", "true").lower() == "true"
+lesson_index = LessonSimilarityIndex(
+    float(os.getenv("LESSON_DEDUP_THRESHOLD", "0.8")),
+    int(os.getenv("LESSON_DEDUP_NUM_PERM", "128")),
+) if LESSON_DEDUP_ENABLED else None
+
+
+def is_reusable_image(url: Optional[str]) -> bool:
+    """
+    Only images this deployment stored can be shared between lessons. Any other URL
+    came from a user-submitted course and could point anywhere, so it is never put
+    into someone else's course; placeholders and inline data URIs aren't shareable either.
+    """
+    return image_store is not None and image_store.name_for(url) is not None
+
+def lacks_image(url: Optional[str]) -> bool:
+    """No image of the lesson's own: none at all, or a placeholder (including the failed-image one)."""
+    return not url or url.startswith("https://placehold.co/")
+
+
+def placeholder_image_url(lesson_title: str) -> str:
+    return "https://placehold.co/600x400/3b82f6/ffffff?text=" + lesson_title.replace(' ', '+')
+
+
+def build_image_prompt(lesson_title: str, lesson_text: str) -> str:
+    return f"Professional educational illustration for: {lesson_title}. Context: {lesson_text[:150]}. Clean, modern style suitable for online learning."
+
+
+async def store_lesson_image(img_data: bytes, content: dict):
+    """Write a generated image into the lesson content as a short URL (or data URI when inline)."""
+    if image_pipeline is not None:
+        try:
+            stored = await image_pipeline.save(img_data)
+            content["aiGeneratedImage"] = stored["url"]
+            content["thumbnailUrl"] = stored["thumbnailUrl"]
+            return
+        except Exception as e:
+            print(f"Image store error, falling back to inline image: {str(e)}")
+
+    img_base64 = base64.b64encode(img_data).decode()
+    content["aiGeneratedImage"] = f"data:image/png;base64,{img_base64}"
+
+
+def extract_image_bytes(response) -> Optional[bytes]:
+    """Return the first inline image payload in a Gemini response, if any."""
+    if hasattr(response, 'candidates') and response.candidates:
+        for part in response.candidates[0].content.parts:
+            if hasattr(part, 'inline_data') and part.inline_data:
+                return part.inline_data.data
+    return None
+
+
+async def generate_lesson_image(model, submodule: dict, semaphore: asyncio.Semaphore):
+    """
+    Generate the image for a single lesson and write it into the lesson content.
+    A near-duplicate lesson's image is reused if there is one, then the image cache
+    is consulted; on a miss the blocking Gemini SDK call runs in a worker thread so
+    the event loop stays free.
+    """
+    content = submodule.get("content", {})
+    lesson_text = content.get("text", "")
+    lesson_title = submodule.get("title", "")
+    image_prompt = build_image_prompt(lesson_title, lesson_text)
+
+    if lesson_index is not None:
+        match = await asyncio.to_thread(lesson_index.find, lesson_title, lesson_text)
+        if match is not None:
+            content["aiGeneratedImage"] = match["imageUrl"]
+            if match["thumbnailUrl"]:
+                content["thumbnailUrl"] = match["thumbnailUrl"]
+            print(f"Reusing image of a near-duplicate lesson for: {lesson_title} (similarity {match['similarity']})")
+            lesson_images.inc(outcome="reused")
+            return
+
+    generated = False
+
+    async def request_image() -> Optional[bytes]:
+        nonlocal generated
+        generated = True
+        async with semaphore:
+            print(f"Generating image for: {lesson_title}")
+            # The deadline covers the whole governed call, retries included; a timed-out
+            # attempt is not retried (its worker thread can't be stopped and would still bill)
+            response = await asyncio.wait_for(
+                gemini_governor.call(lambda: asyncio.to_thread(model.generate_content, image_prompt)),
+                timeout=IMAGE_GEN_TIMEOUT,
+            )
+            return extract_image_bytes(response)
+
+    try:
+        if image_cache is not None:
+            cache_key = ImageCache.make_key(image_prompt, IMAGE_MODEL_NAME)
+            img_data = await image_cache.get_or_generate(cache_key, request_image)
+        else:
+            img_data = await request_image()
+
+        if img_data:
+            with stage("image_store"):
+                await store_lesson_image(img_data, content)
+            print(f"Image ready for: {lesson_title}")
+            lesson_images.inc(outcome="generated" if generated else "cached")
+            if lesson_index is not None and is_reusable_image(content.get("aiGeneratedImage")):
+                await asyncio.to_thread(
+                    lesson_index.add, lesson_title, lesson_text, content["aiGeneratedImage"], content.get("thumbnailUrl")
+                )
+        else:
+            print(f"No image data returned for: {lesson_title}, using placeholder")
+            content["aiGeneratedImage"] = placeholder_image_url(lesson_title)
+            lesson_images.inc(outcome="placeholder")
+
+    except asyncio.TimeoutError:
+        print(f"Image generation timed out for {lesson_title} after {IMAGE_GEN_TIMEOUT}s")
+        content["aiGeneratedImage"] = FAILED_IMAGE_URL
+        lesson_images.inc(outcome="timeout")
+    except Exception as img_error:
+        print(f"Error generating image for {lesson_title}: {str(img_error)}")
+        content["aiGeneratedImage"] = FAILED_IMAGE_URL
+        lesson_images.inc(outcome="failed")
+
+
+def image_event(module_idx: int, lesson_idx: int, content: dict) -> dict:
+    return {
+        "moduleIndex": module_idx,
+        "lessonIndex": lesson_idx,
+        "aiGeneratedImage": content.get("aiGeneratedImage"),
+        "thumbnailUrl": content.get("thumbnailUrl"),
+    }
+
+
+async def emit_event(on_event, event: str, data: dict):
+    """Deliver a pipeline event to on_event, which may be a plain function or a coroutine function."""
+    if on_event:
+        result = on_event(event, data)
+        if inspect.isawaitable(result):
+            await result
+
+
+class LessonImageBatch:
+    """
+    Lesson images generated concurrently (bounded by IMAGE_GEN_CONCURRENCY).
+    Lessons can be added while the course text is still streaming; wait() then
+    gives the stragglers IMAGE_GEN_TOTAL_TIMEOUT before falling back to the
+    failure placeholder. on_image(module_idx, lesson_idx, content) is called
+    (and awaited, if it returns an awaitable) as each lesson's image settles.
+    """
+
+    def __init__(self, model, on_image=None):
+        self.model = model
+        self.on_image = on_image
+        self.semaphore = asyncio.Semaphore(max(1, IMAGE_GEN_CONCURRENCY))
+        self.tasks = {}
+
+    async def _notify(self, module_idx: int, lesson_idx: int, content: dict):
+        if self.on_image:
+            result = self.on_image(module_idx, lesson_idx, content)
+            if inspect.isawaitable(result):
+                await result
+
+    async def _run(self, module_idx: int, lesson_idx: int, submodule: dict):
+        with stage("image"):
+            await generate_lesson_image(self.model, submodule, self.semaphore)
+        await self._notify(module_idx, lesson_idx, submodule["content"])
+
+    def add(self, module_idx: int, lesson_idx: int, submodule: dict) -> bool:
+        """Start generating an image for the lesson if it still has the "placeholder" marker."""
+        content = submodule.get("content", {})
+        if content.get("aiGeneratedImage") != "placeholder":
+            return False
+        task = asyncio.create_task(self._run(module_idx, lesson_idx, submodule))
+        self.tasks[task] = (module_idx, lesson_idx, submodule)
+        return True
+
+    async def wait(self):
+        if not self.tasks:
+            return
+
+        try:
+            done, pending = await asyncio.wait(self.tasks.keys(), timeout=IMAGE_GEN_TOTAL_TIMEOUT)
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+
+        if pending:
+            print(f"Image generation deadline reached, {len(pending)} of {len(self.tasks)} images unfinished")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for task in pending:
+                module_idx, lesson_idx, submodule = self.tasks[task]
+                submodule["content"]["aiGeneratedImage"] = FAILED_IMAGE_URL
+                lesson_images.inc(outcome="deadline")
+                await self._notify(module_idx, lesson_idx, submodule["content"])
+
+    def cancel(self):
+        for task in self.tasks:
+            if not task.done():
+                task.cancel()
+
+    def apply_to(self, course_data: dict):
+        """Copy finished image fields onto the matching lessons of course_data."""
+        for module_idx, lesson_idx, submodule in self.tasks.values():
+            try:
+                target = course_data["modules"][module_idx]["subModules"][lesson_idx]["content"]
+            except (KeyError, IndexError, TypeError):
+                continue
+            for field in ("aiGeneratedImage", "thumbnailUrl"):
+                if field in submodule["content"]:
+                    target[field] = submodule["content"][field]
+
+
 @app.get("/")
 def read_root():
     return {"message": "Foundry Course Builder API"}
 
+@app.get("/api/images/cache-stats")
+async def image_cache_stats():
+    if image_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **await asyncio.to_thread(image_cache.stats)}
+
+@app.get("/api/images/dedup-stats")
+async def image_dedup_stats():
+    if lesson_index is None:
+        return {"enabled": False}
+    return {"enabled": True, **lesson_index.stats()}
+
+@app.get("/api/claude/cache-stats")
+async def generation_cache_stats():
+    if generation_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **generation_cache.stats()}
+
+@app.get("/api/images/{name}")
+async def get_image(name: str):
+    if not isinstance(image_store, LocalImageStore):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    path = image_store.path_for(name)
+    if path is None or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    media_type = "image/webp" if name.endswith(".webp") else "image/png"
+    return FileResponse(path, media_type=media_type, headers={"Cache-Control": IMAGE_CACHE_CONTROL})
+
+@app.get("/api/health/clients")
+async def client_health():
+    return clients.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/health/models")
+async def model_health():
+    return text_router.stats()
+
+@app.get("/api/health/voice-sessions")
+async def voice_session_health():
+    return voice_sessions.stats()
+
+@app.get("/api/health/upstreams")
+async def upstream_health():
+    return {"anthropic": anthropic_governor.stats(), "gemini": gemini_governor.stats()}
+
+@app.get("/api/health/jobs")
+async def job_health():
+    return job_manager.stats()
+
+@app.get("/api/health/caches")
+async def cache_health():
+    return {
+        "analytics": analytics_cache.stats(),
+        "courseTree": course_tree_cache.stats(),
+        "search": search_index.stats(),
+        "voicePayload": voice_payload_cache.stats(),
+    }
+
+def anthropic_headers() -> dict:
+    return {
+        "x-api-key": os.getenv("ANTHROPIC_API_KEY"),
+        "anthropic-version": "2023-06-01",
+        "content-type": "application/json",
+    }
+
+def claude_request_body(text: str, max_tokens: int = 4000, stream: bool = False, model: str = CLAUDE_MODEL) -> dict:
+    body = {
+        "model": model,
+        "max_tokens": max_tokens,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": text}
+                ],
+            }
+        ],
+    }
+    if stream:
+        body["stream"] = True
+    return body
+
+def claude_error(status: int, headers, detail: str) -> UpstreamError:
+    return UpstreamError("Claude", status, detail, parse_retry_after(headers.get("retry-after")))
+
+def estimate_claude_tokens(text: str, max_tokens: int) -> int:
+    # About four characters per input token, plus the most the reply may use
+    return len(text) // 4 + max_tokens
+
+# Anthropic stream error types and the HTTP statuses they stand for
+CLAUDE_STREAM_ERROR_STATUS = {"overloaded_error": 529, "rate_limit_error": 429, "api_error": 500}
+
+def upstream_http_exception(error: Exception) -> HTTPException:
+    """Map a provider failure that outlived its retries to a status the client can act on."""
+    retry_after = getattr(error, "retry_after", None)
+    headers = {"Retry-After": str(max(1, math.ceil(retry_after)))} if retry_after else None
+    if isinstance(error, CircuitOpenError) or getattr(error, "status", None) in THROTTLE_STATUSES:
+        return HTTPException(status_code=503, detail=str(error), headers=headers)
+    return HTTPException(status_code=502, detail=str(error), headers=headers)
+
+async def request_claude(text: str, max_tokens: int = 4000, model: str = CLAUDE_MODEL) -> dict:
+    """Send a single prompt to Claude and return the raw Messages API response."""
+    async def send() -> dict:
+        response = await clients.http.post(
+            ANTHROPIC_API_URL,
+            headers=anthropic_headers(),
+            json=claude_request_body(text, max_tokens, model=model),
+        )
+        if response.status_code != 200:
+            raise claude_error(response.status_code, response.headers, response.text)
+        return response.json()
+
+    return await anthropic_governor.call(send, estimate_claude_tokens(text, max_tokens))
+
+async def stream_claude_text(model: str, text: str, usage: dict, max_tokens: int = 4000):
+    """
+    Stream a Claude response, yielding text deltas as they arrive.
+    Token usage from the stream's message events is collected into usage.
+    Opening the stream is retried by the governor; closing the generator closes
+    the upstream connection.
+    """
+    body = claude_request_body(text, max_tokens, stream=True, model=model)
+
+    async def open_stream() -> httpx.Response:
+        request = clients.http.build_request("POST", ANTHROPIC_API_URL, headers=anthropic_headers(), json=body)
+        response = await clients.http.send(request, stream=True)
+        if response.status_code != 200:
+            detail = (await response.aread()).decode(errors="replace")
+            await response.aclose()
+            raise claude_error(response.status_code, response.headers, detail)
+        return response
+
+    async with anthropic_governor.hold(open_stream, estimate_claude_tokens(text, body["max_tokens"])) as response:
+        try:
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                event = json.loads(line[5:].strip())
+                event_type = event.get("type")
+
+                if event_type == "content_block_delta" and event["delta"].get("type") == "text_delta":
+                    yield event["delta"]["text"]
+                elif event_type == "message_start":
+                    usage.update(event["message"].get("usage", {}))
+                elif event_type == "message_delta":
+                    usage.update(event.get("usage", {}))
+                elif event_type == "error":
+                    error = event.get("error") or {}
+                    raise UpstreamError("Claude", CLAUDE_STREAM_ERROR_STATUS.get(error.get("type"), 500), f"stream error: {error}")
+        finally:
+            await response.aclose()
+
+def is_gemini_model(model: str) -> bool:
+    return model.startswith("gemini")
+
+def gemini_text_config(max_tokens: int) -> dict:
+    # Every text prompt asks for JSON; JSON mode also keeps code fences out of the reply
+    return {"max_output_tokens": max_tokens, "response_mime_type": "application/json"}
+
+def gemini_usage(response) -> dict:
+    metadata = getattr(response, "usage_metadata", None)
+    if metadata is None:
+        return {}
+    return {
+        "input_tokens": getattr(metadata, "prompt_token_count", 0) or 0,
+        "output_tokens": getattr(metadata, "candidates_token_count", 0) or 0,
+    }
+
+def text_gemini_model(model_name: str):
+    model = clients.gemini_model(model_name)
+    if model is None:
+        raise RuntimeError(f"GEMINI_API_KEY not configured, cannot use {model_name}")
+    return model
+
+async def request_gemini_text(model_name: str, text: str, max_tokens: int = 4000):
+    """Send a single prompt to a Gemini text model; returns (text, usage)."""
+    model = text_gemini_model(model_name)
+    response = await gemini_governor.call(
+        lambda: asyncio.to_thread(model.generate_content, text, generation_config=gemini_text_config(max_tokens)),
+        estimate_claude_tokens(text, max_tokens),
+    )
+    return response.text, gemini_usage(response)
+
+async def stream_gemini_text(model_name: str, text: str, usage: dict, max_tokens: int = 4000):
+    """
+    Stream a Gemini text response. The SDK's stream iterator blocks, so a worker thread
+    drains it and hands chunks to the event loop. The governor retries until the first
+    chunk arrives; closing the generator tells the worker to stop.
+    """
+    model = text_gemini_model(model_name)
+    loop = asyncio.get_running_loop()
+    stop = threading.Event()
+
+    async def open_stream():
+        chunks: asyncio.Queue = asyncio.Queue()
+
+        def put(item):
+            if not stop.is_set():
+                try:
+                    loop.call_soon_threadsafe(chunks.put_nowait, item)
+                except RuntimeError:
+                    # The event loop is gone (shutdown); nobody is listening
+                    stop.set()
+
+        def produce():
+            try:
+                response = model.generate_content(text, generation_config=gemini_text_config(max_tokens), stream=True)
+                for chunk in response:
+                    if stop.is_set():
+                        return
+                    put(("text", chunk.text))
+                put(("end", gemini_usage(response)))
+            except Exception as e:
+                put(("error", e))
+
+        loop.run_in_executor(None, produce)
+        first = await chunks.get()
+        if first[0] == "error":
+            raise first[1]
+        return chunks, first
+
+    async with gemini_governor.hold(open_stream, estimate_claude_tokens(text, max_tokens)) as (chunks, first):
+        try:
+            kind, payload = first
+            while True:
+                if kind == "text":
+                    yield payload
+                elif kind == "end":
+                    usage.update(payload)
+                    return
+                else:
+                    raise payload
+                kind, payload = await chunks.get()
+        finally:
+            stop.set()
+
+async def stream_model_text(model: str, text: str, usage: dict, max_tokens: int = 4000):
+    if is_gemini_model(model):
+        stream = stream_gemini_text(model, text, usage, max_tokens)
+    else:
+        stream = stream_claude_text(model, text, usage, max_tokens)
+
+    # A hedged stream that loses the race is closed early and counts as "cancelled"
+    with span(llm_request_seconds, "llm", model=model, mode="stream", outcome="cancelled") as labels:
+        try:
+            async for chunk in stream:
+                yield chunk
+        except Exception:
+            labels["outcome"] = "error"
+            raise
+        finally:
+            await stream.aclose()
+        labels["outcome"] = "ok"
+    record_llm_usage(model, usage)
+
+async def complete_model_text(model: str, text: str, max_tokens: int = 4000):
+    """Single non-streamed completion from any text model; returns (text, usage)."""
+    with span(llm_request_seconds, "llm", model=model, mode="complete", outcome="cancelled") as labels:
+        try:
+            if is_gemini_model(model):
+                result, usage = await request_gemini_text(model, text, max_tokens)
+            else:
+                response = await request_claude(text, max_tokens, model=model)
+                result, usage = response["content"][0]["text"], response.get("usage")
+        except Exception:
+            labels["outcome"] = "error"
+            raise
+        labels["outcome"] = "ok"
+    record_llm_usage(model, usage)
+    return result, usage
+
+def stream_course_text(prompt: str, usage: dict):
+    """
+    Stream the course text from the first of TEXT_MODELS to produce output that starts
+    as a course document, hedging a slow start and falling back on failure or on output
+    that isn't course JSON. The winning model's usage lands in usage.
+    """
+    text = initial_prompt + prompt
+    return text_router.stream(
+        "course",
+        lambda model, model_usage: stream_model_text(model, text, model_usage),
+        usage,
+        make_check=course_output_check,
+    )
+
 @app.post("/api/claude")
 async def claude_chat(request: dict):
     try:
@@ -96,113 +929,394 @@ async def claude_chat(request: dict):
         if not prompt:
             raise HTTPException(status_code=400, detail="Prompt is required")
         
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
-                "https://api.anthropic.com/v1/messages",
-                headers={
-                    "x-api-key": os.getenv("ANTHROPIC_API_KEY"),
-                    "anthropic-version": "2023-06-01",
-                    "content-type": "application/json",
-                },
-                json={
-                    "model": "claude-sonnet-4-20250514",
-                    "max_tokens": 4000,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": initial_prompt + prompt}
-                            ],
-                        }
-                    ],
-                },
-            )
-
-        if response.status_code != 200:
-            raise HTTPException(status_code=500, detail=f"Claude API error: {response.status_code} - {response.text}")
+        response_format = course_format(request)
+        course_data, text, usage, cached = await generate_course_cached(prompt, **generation_options(request))
+        if course_data is None:
+            return json_response({"content": text, "usage": usage})
+        return json_response(course_payload(course_data, response_format, usage=usage, cached=cached))
 
-        data = response.json()
-        return await image_gen(data)
-        
+    except HTTPException:
+        raise
+    except (UpstreamError, CircuitOpenError) as e:
+        raise upstream_http_exception(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Claude API error: {str(e)}")
-async def image_gen(claude_response: dict):
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {dumps(data)}\n\n"
+
+async def generate_course_single(prompt: str, on_event=None):
+    """
+    Generate a course in one streamed Claude call, with text and images pipelined: Claude's output is parsed as
+    it streams, and each lesson's image job starts as soon as that lesson is
+    complete, so image generation overlaps with the rest of the text.
+
+    on_event(event, data) receives the course_event() stream plus "image" events and
+    may be sync or async. Returns (course_data, raw_text, usage); course_data is None
+    when the model's output isn't a complete JSON document.
+    """
+    usage = {}
+    parser = CourseStreamParser()
+
+    async def emit(event: str, data: dict):
+        await emit_event(on_event, event, data)
+
+    model = clients.gemini_model(IMAGE_MODEL_NAME)
+    if model is None:
+        print("GEMINI_API_KEY not configured, skipping image generation")
+
+    batch = LessonImageBatch(
+        model,
+        on_image=lambda module_idx, lesson_idx, content: emit("image", image_event(module_idx, lesson_idx, content)),
+    )
 
     try:
-        course_content = claude_response["content"][0]["text"]
-        
-        clean_json = course_content
-        if '```json' in clean_json:
-            clean_json = clean_json.replace('```json', '').replace('```', '')
-        if '```' in clean_json:
-            clean_json = clean_json.replace('```', '')
-        
+        async for text in stream_course_text(prompt, usage):
+            with stage("json_stream"):
+                events = parser.feed(text)
+            for path, value in events:
+                event = course_event(path, value)
+                if not event:
+                    continue
+                await emit(*event)
+                if event[0] == "lesson" and model is not None:
+                    batch.add(event[1]["moduleIndex"], event[1]["lessonIndex"], value)
+
+        course_data = parser.result()
+        if course_data is None:
+            # Cut off (e.g. at max_tokens) or malformed: keep whatever is complete
+            try:
+                with stage("json_parse"):
+                    course_data, _ = parse_course_document(parser.text)
+                print("Course output was incomplete, continuing with the repaired document")
+            except CourseDocumentError as e:
+                print(f"Unusable course output: {str(e)}")
+                batch.cancel()
+                return None, parser.text, usage
+
+        await emit("textComplete", {})
+        await batch.wait()
+        batch.apply_to(course_data)
         try:
-            course_data = json.loads(clean_json)
-        except json.JSONDecodeError:
+            with stage("json_parse"):
+                course_data = validate_course(course_data, prune=True)
+        except CourseDocumentError as e:
+            print(f"Unusable course output: {str(e)}")
+            return None, parser.text, usage
+        return course_data, parser.text, usage
 
-            return {"content": course_content, "usage": claude_response.get("usage")}
-        
-        # Configure Gemini
-        gemini_api_key = os.getenv("GEMINI_API_KEY")
-        if not gemini_api_key:
-            print("GEMINI_API_KEY not configured, skipping image generation")
-            return {"content": course_content, "usage": claude_response.get("usage")}
-        
-        genai.configure(api_key=gemini_api_key)
+    finally:
+        batch.cancel()
 
-        model = genai.GenerativeModel('gemini-2.5-flash-image')
-        
+def add_usage(total: dict, usage: Optional[dict]):
+    for key, value in (usage or {}).items():
+        if isinstance(value, (int, float)):
+            total[key] = total.get(key, 0) + value
 
-        for module in course_data.get("modules", []):
-            for submodule in module.get("subModules", []):
-                content = submodule.get("content", {})
-                
+async def generate_course_fanout(prompt: str, on_event=None, module_count: int = 3, lessons_per_module: int = 3):
+    """
+    Generate a course as an outline call followed by one call per module, run in
+    parallel (bounded by FANOUT_CONCURRENCY), then merged into the usual course JSON.
+    Latency tracks the slowest module rather than the whole course, and no single
+    call has to fit the full course under max_tokens. Images start as each module lands.
 
-                if content.get("aiGeneratedImage") == "placeholder":
-
-                    lesson_text = content.get("text", "")
-                    lesson_title = submodule.get("title", "")
-                    
-                    image_prompt = f"Professional educational illustration for: {lesson_title}. Context: {lesson_text[:150]}. Clean, modern style suitable for online learning."
-                    
-                    try:
-                        print(f"Generating image for: {lesson_title}")
-
-                        response = model.generate_content(image_prompt)
-                        
-
-                        image_found = False
-                        if hasattr(response, 'candidates') and response.candidates:
-                            for part in response.candidates[0].content.parts:
-                                if hasattr(part, 'inline_data') and part.inline_data:
-
-                                    img_data = part.inline_data.data
-                                    img_base64 = base64.b64encode(img_data).decode()
-                                    
-
-                                    content["aiGeneratedImage"] = f"data:image/png;base64,{img_base64}"
-                                    image_found = True
-                                    print(f"Image generated for: {lesson_title}")
-                                    break
-                        
-                        if not image_found:
-                            print(f"No image data returned for: {lesson_title}, using placeholder")
-                            content["aiGeneratedImage"] = "https://placehold.co/600x400/3b82f6/ffffff?text=" + lesson_title.replace(' ', '+')
-                    
-                    except Exception as img_error:
-                        print(f"Error generating image for {lesson_title}: {str(img_error)}")
-
-                        content["aiGeneratedImage"] = "https://placehold.co/600x400/ef4444/ffffff?text=Generation+Failed"
-        
+    Same contract as generate_course_single.
+    """
+    usage = {}
 
-        updated_content = json.dumps(course_data, indent=2)
-        return {"content": updated_content, "usage": claude_response.get("usage")}
-        
-    except Exception as e:
-        print(f"Image generation error: {str(e)}")
+    async def emit(event: str, data: dict):
+        await emit_event(on_event, event, data)
+
+    outline_text = (outline_prompt
+                    .replace("{module_count}", str(module_count))
+                    .replace("{lesson_count}", str(lessons_per_module)))
+    try:
+        _, (raw_outline, outline_usage) = await text_router.complete(
+            "outline",
+            lambda model: complete_model_text(model, outline_text + prompt, FANOUT_OUTLINE_MAX_TOKENS),
+            validate=lambda result: bool((parse_json_object(result[0]) or {}).get("modules")),
+        )
+    except InvalidOutputError as e:
+        raw_outline, outline_usage = e.result
+        add_usage(usage, outline_usage)
+        return None, raw_outline, usage
+    add_usage(usage, outline_usage)
+    outline = parse_json_object(raw_outline)
+
+    await emit("course", {"name": outline.get("name")})
+    await emit("objectives", {"learningObjectives": outline.get("learningObjectives", [])})
+    for module_idx, module in enumerate(outline["modules"]):
+        await emit("module", {"moduleIndex": module_idx, "title": module.get("title")})
+
+    model = clients.gemini_model(IMAGE_MODEL_NAME)
+    if model is None:
+        print("GEMINI_API_KEY not configured, skipping image generation")
+
+    batch = LessonImageBatch(
+        model,
+        on_image=lambda module_idx, lesson_idx, content: emit("image", image_event(module_idx, lesson_idx, content)),
+    )
+    semaphore = asyncio.Semaphore(max(1, FANOUT_CONCURRENCY))
+
+    async def write_module(module_idx: int, module: dict) -> dict:
+        text = (module_prompt
+                .replace("{course_name}", outline.get("name", prompt))
+                .replace("{module_title}", module.get("title", ""))
+                .replace("{lesson_titles}", json.dumps(module.get("lessons", []))))
+        async with semaphore:
+            try:
+                _, (raw_module, module_usage) = await text_router.complete(
+                    "module",
+                    lambda model: complete_model_text(model, text, FANOUT_MODULE_MAX_TOKENS),
+                    validate=lambda result: parse_json_object(result[0]) is not None,
+                )
+            except InvalidOutputError as e:
+                raise ValueError(f"{e.model} returned invalid JSON for module '{module.get('title')}'")
+        add_usage(usage, module_usage)
+        body = parse_json_object(raw_module)
+
+        merged = {
+            "id": module.get("id"),
+            "title": module.get("title"),
+            "isSafetyCheck": False,
+            "subModules": body.get("subModules", []),
+            "quiz": body.get("quiz"),
+        }
+        for lesson_idx, lesson in enumerate(merged["subModules"]):
+            await emit("lesson", {"moduleIndex": module_idx, "lessonIndex": lesson_idx, "lesson": lesson})
+            if model is not None:
+                batch.add(module_idx, lesson_idx, lesson)
+        if merged["quiz"]:
+            await emit("quiz", {"moduleIndex": module_idx, "quiz": merged["quiz"]})
+        return merged
+
+    try:
+        modules = await asyncio.gather(*(write_module(i, m) for i, m in enumerate(outline["modules"])))
+
+        final_assessment = outline.get("finalAssessment", {})
+        await emit("finalAssessment", {"finalAssessment": final_assessment})
+
+        course_data = {
+            "id": outline.get("id"),
+            "name": outline.get("name"),
+            "learningObjectives": outline.get("learningObjectives", []),
+            "modules": list(modules),
+            "finalAssessment": final_assessment,
+            "createdAt": datetime.utcnow().isoformat() + "Z",
+        }
+
+        await emit("textComplete", {})
+        # Lessons were added to the batch in place, so course_data already sees the images
+        await batch.wait()
+        with stage("json_parse"):
+            course_data = validate_course(course_data, prune=True)
+        return course_data, dumps(course_data), usage
+
+    finally:
+        batch.cancel()
+
+async def generate_course(prompt: str, on_event=None, mode: Optional[str] = None,
+                          module_count: Optional[int] = None, lessons_per_module: Optional[int] = None):
+    """Generate a course with the requested mode ("single" or "fanout"), defaulting to GENERATION_MODE."""
+    mode = mode or GENERATION_MODE
+    if mode == "fanout":
+        return await generate_course_fanout(
+            prompt,
+            on_event=on_event,
+            module_count=module_count or 3,
+            lessons_per_module=lessons_per_module or 3,
+        )
+    return await generate_course_single(prompt, on_event=on_event)
+
+def generation_cache_key(prompt: str, options: dict) -> str:
+    mode = options.get("mode") or GENERATION_MODE
+    if mode == "fanout":
+        template = outline_prompt + module_prompt
+        key_options = {
+            "mode": mode,
+            "module_count": options.get("module_count") or 3,
+            "lessons_per_module": options.get("lessons_per_module") or 3,
+        }
+    else:
+        template = initial_prompt
+        key_options = {"mode": mode}
+    return GenerationCache.make_key(prompt, ",".join(TEXT_MODELS), template, key_options)
+
+async def replay_course_events(course_data: dict, on_event):
+    """Emit the pipeline events for an already finished course (e.g. a cache hit)."""
+    await emit_event(on_event, "course", {"name": course_data.get("name")})
+    await emit_event(on_event, "objectives", {"learningObjectives": course_data.get("learningObjectives", [])})
+    for module_idx, module in enumerate(course_data.get("modules", [])):
+        await emit_event(on_event, "module", {"moduleIndex": module_idx, "title": module.get("title")})
+        for lesson_idx, lesson in enumerate(module.get("subModules", [])):
+            await emit_event(on_event, "lesson", {"moduleIndex": module_idx, "lessonIndex": lesson_idx, "lesson": lesson})
+        if module.get("quiz"):
+            await emit_event(on_event, "quiz", {"moduleIndex": module_idx, "quiz": module["quiz"]})
+    await emit_event(on_event, "finalAssessment", {"finalAssessment": course_data.get("finalAssessment", {})})
+    await emit_event(on_event, "textComplete", {})
+    for module_idx, module in enumerate(course_data.get("modules", [])):
+        for lesson_idx, lesson in enumerate(module.get("subModules", [])):
+            await emit_event(on_event, "image", image_event(module_idx, lesson_idx, lesson.get("content", {})))
+
+async def generate_course_cached(prompt: str, on_event=None, use_cache: bool = True, **options):
+    """
+    generate_course() behind the generation cache. Identical concurrent requests share
+    one upstream run, and every one of them gets its pipeline events live (a caller that
+    joins late first gets the ones it missed). A cache hit gets the events replayed.
+    Callers that didn't run it get zero usage. Returns (course_data, raw_text, usage, cached).
+    """
+    if generation_cache is None or not use_cache:
+        course_data, text, usage = await generate_course(prompt, on_event=on_event, **options)
+        return course_data, text, usage, False
+
+    key = generation_cache_key(prompt, options)
+    (course_data, text, usage), source = await generation_cache.get_or_generate(
+        key,
+        lambda: generate_course(prompt, on_event=lambda event, data: generation_cache.publish(key, event, data), **options),
+        should_cache=lambda value: value[0] is not None,
+        on_event=on_event,
+    )
+    if source != "miss":
+        logger.info(f"Generation cache {source} for prompt: {prompt[:60]}")
+        # This request spent no tokens; the original run's usage counts as saved in the cache stats
+        usage = {key: 0 if isinstance(value, (int, float)) else value for key, value in (usage or {}).items()}
+        if source == "hit" and course_data is not None:
+            await replay_course_events(course_data, on_event)
+    return course_data, text, usage, source != "miss"
+
+def course_format(request: dict) -> str:
+    """
+    How a finished course is returned: "text" (default) as a JSON string in "content",
+    or "object" as the course itself in "course", which avoids encoding the course
+    twice and can be posted back to /api/course as is.
+    """
+    value = request.get("format") or "text"
+    if value not in ("text", "object"):
+        raise HTTPException(status_code=400, detail=f"Unknown format: {value}")
+    return value
+
+def course_payload(course_data: dict, response_format: str, **fields) -> dict:
+    if response_format == "object":
+        return {"course": course_data, **fields}
+    return {"content": dumps(course_data), **fields}
+
+def generation_options(request: dict) -> dict:
+    """Pull the optional generation mode, course size and cache opt-out out of a request body."""
+    mode = request.get("mode")
+    if mode not in (None, "single", "fanout"):
+        raise HTTPException(status_code=400, detail=f"Unknown generation mode: {mode}")
+
+    options = {"mode": mode, "use_cache": request.get("cache", True) is not False}
+    for field, option in (("moduleCount", "module_count"), ("lessonsPerModule", "lessons_per_module")):
+        value = request.get(field)
+        if value is not None:
+            try:
+                options[option] = max(1, min(int(value), FANOUT_MAX_MODULES if field == "moduleCount" else 10))
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail=f"{field} must be an integer")
+    return options
+
+async def stream_course_events(prompt: str, options: dict, response_format: str = "text"):
+    """
+    Generate a course as a stream of SSE events: course name and objectives first,
+    then each module title, lesson and quiz as Claude writes them, images as they
+    finish, and finally a "done" event with the full course in the /api/claude shape
+    for response_format.
+    """
+    events = asyncio.Queue()
+
+    async def run():
+        try:
+            course_data, text, usage, cached = await generate_course_cached(
+                prompt, on_event=lambda event, data: events.put_nowait((event, data)), **options
+            )
+            if course_data is None:
+                events.put_nowait(("error", {"detail": "Claude returned incomplete course JSON", "content": text}))
+            else:
+                events.put_nowait(("done", course_payload(course_data, response_format, usage=usage, cached=cached)))
+        except Exception as e:
+            print(f"Course stream error: {str(e)}")
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            events.put_nowait(("error", {"detail": detail}))
+        finally:
+            events.put_nowait(None)
+
+    task = asyncio.create_task(run())
+    try:
+        while (item := await events.get()) is not None:
+            yield sse_event(*item)
+    finally:
+        # Runs on client disconnect too, so the upstream Claude and Gemini calls stop with the stream
+        if not task.done():
+            task.cancel()
+
+@app.post("/api/claude/stream")
+async def claude_chat_stream(request: Request):
+    body = await request.json()
+    prompt = body.get("prompt")
+    if not prompt:
+        raise HTTPException(status_code=400, detail="Prompt is required")
+    options = generation_options(body)
+    response_format = course_format(body)
+
+    return StreamingResponse(
+        stream_course_events(prompt, options, response_format),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def run_course_job(job: dict, report_stage) -> str:
+    """Full course pipeline for a background job: Claude and images (pipelined), then storage."""
+    await report_stage("generating_text")
 
-        return {"content": claude_response["content"][0]["text"], "usage": claude_response.get("usage")}
+    async def on_event(event: str, data: dict):
+        # Text and images overlap; once the text is done only images remain
+        if event == "textComplete":
+            await report_stage("generating_images")
+
+    course_data, text, usage, cached = await generate_course_cached(job["prompt"], on_event=on_event)
+    if course_data is None:
+        raise ValueError("Claude returned invalid course JSON")
+
+    await report_stage("storing")
+    course = await parse_and_store_course(course_data)
+    return course["id"]
+
+
+job_manager = JobManager(
+    JobStore(os.getenv("JOB_STORE_PATH", ".data/jobs.db")),
+    run_course_job,
+    int(os.getenv("JOB_WORKERS", "2")),
+)
+
+
+def serialize_job(job: dict) -> dict:
+    return {
+        "jobId": job["id"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "progress": job["progress"],
+        "courseId": job["course_id"],
+        "error": job["error"],
+        "createdAt": job["created_at"],
+        "updatedAt": job["updated_at"],
+    }
+
+@app.post("/api/jobs", status_code=202)
+async def submit_course_job(request: dict):
+    prompt = request.get("prompt")
+    if not prompt:
+        raise HTTPException(status_code=400, detail="Prompt is required")
+
+    job = await job_manager.submit(prompt)
+    return {**serialize_job(job), "deduplicated": job["deduplicated"]}
+
+@app.get("/api/jobs/{jobId}")
+async def get_course_job(jobId: str, request: Request):
+    job = await job_manager.get(jobId)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return conditional_response(request, dumps_bytes(serialize_job(job)))
 
 
 @app.post("/api/course/publish")
@@ -212,14 +1326,7 @@ async def publish_course(request: dict):
         if not course_id:
             raise HTTPException(status_code=400, detail="courseId is required")
         
-        supabase = get_supabase_client()
-        
-
-        response = supabase.table("courses").update({
-            "is_published": True
-        }).eq("id", course_id).execute()
-        
-        if response.data:
+        if await mark_course_published(course_id):
             return {"success": True, "message": "Course published successfully"}
         else:
             raise HTTPException(status_code=404, detail="Course not found")
@@ -227,26 +1334,60 @@ async def publish_course(request: dict):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to publish course: {str(e)}")
 
+async def mark_course_published(course_id: str) -> bool:
+    """
+    Flag a stored course as published, refresh its caches and search entry, and start
+    building its offline bundle. False if there is no such course.
+    """
+    supabase = get_supabase_client()
+
+    with stage("db.courses"):
+        response = await asyncio.to_thread(
+            supabase.table("courses").update({
+                "is_published": True
+            }).eq("id", course_id).execute
+        )
+
+    if not response.data:
+        return False
+
+    invalidate_course_caches(course_id)
+    published = response.data[0]
+    if "meta" in published:
+        voice_payload_cache.put(course_id, build_voice_payload(course_id, published.get("title"), published.get("meta") or {}))
+    if not await asyncio.to_thread(search_index.set_published, course_id, True):
+        # Stored before the index existed (or by another instance): index it now
+        try:
+            row = await asyncio.to_thread(fetch_course_row, supabase, course_id)
+            if row is not None:
+                await asyncio.to_thread(search_index.upsert, course_document_from_tree_row(row))
+        except Exception as e:
+            logger.error(f"Failed to index published course {course_id}: {str(e)}")
+    course_bundle_task(course_id)
+    return True
+
 @app.post("/api/course")
 async def parse_course(request: dict):
     try:
+        # "course" is the already decoded object; "courseJson" is model output text
+        course = request.get("course")
         course_json = request.get("courseJson")
-        if not course_json:
-            raise HTTPException(status_code=400, detail="courseJson is required")
+        if not course and not course_json:
+            raise HTTPException(status_code=400, detail="course or courseJson is required")
         
         logger.info("Parsing course JSON...")
-        clean_json = course_json
-        if '```json' in clean_json:
-            clean_json = clean_json.replace('```json', '').replace('```', '')
-        if '```' in clean_json:
-            clean_json = clean_json.replace('```', '')
-        
         try:
-            course_data = json.loads(clean_json)
+            with stage("json_parse"):
+                if course:
+                    course_data = validate_course(course, prune=True)
+                else:
+                    course_data, repaired = parse_course_document(course_json)
+                    if repaired:
+                        logger.info("Course JSON needed repair before it validated")
             logger.info(f"Course data parsed successfully: {course_data.get('name', 'Unknown')}")
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error: {str(e)}")
-            raise HTTPException(status_code=400, detail=f"Invalid JSON format: {str(e)}")
+        except CourseDocumentError as e:
+            logger.error(f"Invalid course document: {str(e)}")
+            raise HTTPException(status_code=400, detail=f"Invalid course: {str(e)}")
 
         course = await parse_and_store_course(course_data)
         logger.info(f"Course created successfully with ID: {course['id']}")
@@ -260,98 +1401,62 @@ async def parse_course(request: dict):
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Failed to create course: {str(e)}")
 
+def reuse_lesson_images(submodule_rows: list):
+    """Give lessons stored without a real image the image of a near-duplicate lesson."""
+    for row in submodule_rows:
+        if row["kind"] == "instruction" and lacks_image(row.get("image_url")):
+            match = lesson_index.find(row["title"], row.get("body") or "")
+            if match is not None:
+                row["image_url"] = match["imageUrl"]
+
+def index_lesson_images(submodule_rows: list):
+    for row in submodule_rows:
+        if row["kind"] == "instruction" and is_reusable_image(row.get("image_url")):
+            lesson_index.add(row["title"], row.get("body") or "", row["image_url"])
+
+async def build_lesson_index():
+    if lesson_index is None:
+        return
+    try:
+        added = await asyncio.to_thread(
+            lesson_index.build,
+            lambda start, end: fetch_lesson_page(get_supabase_client(), start, end),
+            is_reusable_image,
+        )
+        logger.info(f"Indexed {added} illustrated lessons for near-duplicate image reuse")
+    except Exception as e:
+        logger.error(f"Lesson similarity index build failed: {str(e)}")
+
 async def parse_and_store_course(course_data):
     try:
         logger.info("Connecting to Supabase...")
         supabase = get_supabase_client()
 
-        # Validate required fields
-        if "name" not in course_data:
-            raise ValueError("Course data missing 'name' field")
-        if "modules" not in course_data or not course_data["modules"]:
-            raise ValueError("Course data missing 'modules' field or modules array is empty")
-
-        logger.info(f"Creating course: {course_data['name']}")
-        course_response = supabase.table("courses").insert({
-            "title": course_data["name"],
-            "summary": f"Generated course: {course_data['name']}",
-            "is_published": False,
-            "meta": {
-                "learningObjectives": course_data.get("learningObjectives", []),
-                "finalAssessment": course_data.get("finalAssessment", {})
-            }
-        }).execute()
-        
-        if not course_response.data:
-            raise Exception(f"Supabase returned no data when creating course. Response: {course_response}")
-        
-        course = course_response.data[0]
-        course_id = course["id"]
-        logger.info(f"Course created with ID: {course_id}")
-        
+        # Validates required fields and assigns IDs up front
+        rows = build_course_rows(course_data)
+        if lesson_index is not None:
+            await asyncio.to_thread(reuse_lesson_images, rows["submodules"])
 
-        for module_idx, module in enumerate(course_data["modules"]):
-            logger.info(f"Creating module {module_idx + 1}: {module.get('title', 'Untitled')}")
-            
-            if "title" not in module:
-                raise ValueError(f"Module {module_idx} missing 'title' field")
-            
-            module_response = supabase.table("modules").insert({
-                "course_id": course_id,
-                "idx": module_idx,
-                "title": module["title"],
-                "summary": f"Module {module_idx + 1}: {module['title']}",
-            }).execute()
-            
-            if not module_response.data:
-                raise Exception(f"Failed to create module {module_idx}: {module['title']}")
-            
-            module_id = module_response.data[0]["id"]
+        logger.info(
+            f"Creating course: {course_data['name']} "
+            f"({len(rows['modules'])} modules, {len(rows['submodules'])} submodules, "
+            f"{len(rows['quiz_questions'])} quiz questions)"
+        )
+        course = await asyncio.to_thread(insert_course_rows, supabase, rows, stage)
 
-            for sub_idx, submodule in enumerate(module.get("subModules", [])):
-                logger.info(f"  Creating submodule {sub_idx + 1}: {submodule.get('title', 'Untitled')}")
-                
-                # Get image URL from content if it exists
-                image_url = submodule.get("content", {}).get("aiGeneratedImage", None)
-                content_text = submodule.get("content", {}).get("text", "")
-                
-                if not submodule.get("title"):
-                    raise ValueError(f"Submodule {sub_idx} in module {module_idx} missing 'title' field")
-                
-                supabase.table("submodules").insert({
-                    "module_id": module_id,
-                    "idx": sub_idx,
-                    "kind": "instruction",
-                    "title": submodule["title"],
-                    "body": content_text,
-                    "image_url": image_url
-                }).execute()
-            
-            # Create quiz for the module (outside submodule loop)
-            if module.get("quiz") and module["quiz"].get("questions"):
-                logger.info(f"  Creating quiz for module: {module['title']}")
-                quiz_response = supabase.table("submodules").insert({
-                    "module_id": module_id,
-                    "idx": len(module.get("subModules", [])),
-                    "kind": "quiz",
-                    "title": f"Quiz: {module['title']}",
-                    "body": f"Quiz for {module['title']}",
-                }).execute()
-                
-                if quiz_response.data:
-                    quiz_id = quiz_response.data[0]["id"]
-                    
-                    for q_idx, question in enumerate(module["quiz"]["questions"]):
-                        supabase.table("quiz_questions").insert({
-                            "submodule_id": quiz_id,
-                            "idx": q_idx,
-                            "type": "multiple_choice",
-                            "prompt": question.get("question", ""),
-                            "options": question.get("options", []),
-                            "answer": str(question.get("correctAnswer", 0))
-                        }).execute()
-        
-        logger.info(f"Course {course_id} created successfully with all modules")
+        invalidate_course_caches(course["id"])
+        quiz_answers = {}
+        for question in rows["quiz_questions"]:
+            quiz_answers.setdefault(question["submodule_id"], []).append(question["answer"])
+        for quiz_id, answers in quiz_answers.items():
+            answer_keys.put(quiz_id, answers)
+        for submodule in rows["submodules"]:
+            known_submodules.put(submodule["id"], True)
+        voice_payload_cache.put(course["id"], build_voice_payload(course["id"], rows["course"]["title"], rows["course"]["meta"]))
+        await asyncio.to_thread(search_index.upsert, course_document({**rows["course"], **course}, rows["submodules"]))
+        if lesson_index is not None:
+            await asyncio.to_thread(index_lesson_images, rows["submodules"])
+        logger.info(f"Course {course['id']} created successfully with all modules")
         return course
         
     except KeyError as e:
@@ -365,41 +1470,413 @@ async def parse_and_store_course(course_data):
         logger.error(traceback.format_exc())
         raise Exception(f"Database error while storing course: {str(e)}")
 
-@app.get("/api/course/{courseId}/voice-prompt")
-async def getVoicePrompt(courseId: str):
-    try:
-        supabase = get_supabase_client()
-        response = supabase.table("courses").select("title, meta").eq("id", courseId).execute()
-        
-        if not response.data:
+def invalidate_course_caches(course_id: str):
+    """Drop everything cached for a course after it is written or published."""
+    course_tree_cache.invalidate(course_id)
+    voice_payload_cache.invalidate(course_id)
+
+@app.get("/api/course/{courseId}/tree")
+async def get_course_tree(courseId: str, request: Request):
+    """
+    The whole course (modules, lessons, quizzes) in one response, fetched with a single
+    nested select and cached as serialized bytes. Clients revalidate with If-None-Match.
+    """
+    entry = course_tree_cache.get(courseId)
+    if entry is None:
+        try:
+            with stage("db.read"):
+                row = await asyncio.to_thread(fetch_course_row, get_supabase_client(), courseId)
+        except Exception as e:
+            logger.error(f"Error loading course tree {courseId}: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Failed to load course: {str(e)}")
+
+        if row is None:
             raise HTTPException(status_code=404, detail="Course not found")
-        
-        course = response.data[0]
-        meta = course.get("meta", {})
-        title = course.get("title", "Unknown Course")
-        
-        final_assessment = meta.get("finalAssessment", {})
-        
-        ## optional below, may not affect prompt too much
-        #if learning_objectives: 
-           # objectives_text = "Learning objectives:\n" + "\n".join([f"- {obj}" for obj in learning_objectives]) 
-        
-        assessment_description = final_assessment.get("description", "Complete the final project")
-        ar_instructions = final_assessment.get("arInstructions", [])
 
-        ar_text = ""
-        if ar_instructions:
-            ar_text = "AR Instructions:\n" + "\n".join([f"{i+1}. {instruction}" for i, instruction in enumerate(ar_instructions)])
-        
-        voice_prompt = f"""You are a helpful voice assistant with live video input from your user. The user said the prompt was "{title}", 
-        and then supply the metadata that shows the instructions, and description for this final project.
+        entry = serialize_course_tree(build_course_tree(row, placeholder_image_url))
+        course_tree_cache.put(courseId, entry)
 
-        Final project description: {assessment_description}
+    return conditional_response(request, entry["body"], entry["etag"])
 
-        {ar_text}"""
-        
-        return {"voice_prompt": voice_prompt}
+# Offline course bundles: one zip with a manifest (the course tree) and the lesson images
+# as files, built when a course is published and kept on disk. Downloads support Range
+# requests, so a device on a poor connection can resume an interrupted one.
+bundle_store = BundleStore(os.getenv("BUNDLE_DIR", ".data/bundles"))
+BUNDLE_IMPORT_MAX_MB = int(os.getenv("BUNDLE_IMPORT_MAX_MB", "200"))
+BUNDLE_IMAGE_MAX_MB = int(os.getenv("BUNDLE_IMAGE_MAX_MB", "10"))
+bundle_builds = {}
+
+async def load_bundle_image(url: str) -> Optional[bytes]:
+    """
+    A lesson image's bytes for a bundle: inline data URIs, or objects in this
+    deployment's image store. Any other URL came from user-submitted course JSON
+    and is never fetched (it could point anywhere, internal addresses included),
+    so it stays a remote link in the bundle, like a placeholder.
+    """
+    try:
+        if url.startswith("data:"):
+            data = base64.b64decode(url.split(",", 1)[1])
+        else:
+            name = image_store.name_for(url) if image_store is not None else None
+            if name is None:
+                return None
+            data = await asyncio.to_thread(image_store.read, name)
+        if not data:
+            return None
+        if len(data) > BUNDLE_IMAGE_MAX_MB * 1024 * 1024:
+            logger.warning(f"Skipping bundle image over {BUNDLE_IMAGE_MAX_MB} MB: {url[:80]}")
+            return None
+        if image_type(data)[1] == "application/octet-stream":
+            logger.warning(f"Skipping bundle image that isn't a PNG, JPEG or WebP: {url[:80]}")
+            return None
+        return data
+    except Exception as e:
+        logger.error(f"Failed to load bundle image {url[:80]}: {str(e)}")
+    return None
+
+async def build_course_bundle(course_id: str) -> Optional[str]:
+    """Build and store the bundle of a published course; None if there is no such published course."""
+    with stage("db.read"):
+        row = await asyncio.to_thread(fetch_course_row, get_supabase_client(), course_id)
+    if row is None or not row.get("is_published"):
+        return None
+
+    course = build_course_tree(row, placeholder_image_url)
+    urls = sorted(image_urls(course))
+    loaded = await asyncio.gather(*(load_bundle_image(url) for url in urls))
+    images = {url: data for url, data in zip(urls, loaded) if data}
+    with stage("bundle"):
+        path = await asyncio.to_thread(bundle_store.write, course_id, course, images)
+    logger.info(f"Built bundle for course {course_id} with {len(images)} of {len(urls)} images")
+    return path
+
+def course_bundle_task(course_id: str) -> asyncio.Task:
+    """Start building a course's bundle, or join the build already running for it."""
+    task = bundle_builds.get(course_id)
+    if task is None:
+        task = asyncio.create_task(build_course_bundle(course_id))
+        bundle_builds[course_id] = task
+
+        def finished(task: asyncio.Task):
+            bundle_builds.pop(course_id, None)
+            if not task.cancelled() and task.exception() is not None:
+                logger.error(f"Bundle build failed for course {course_id}: {str(task.exception())}")
+
+        task.add_done_callback(finished)
+    return task
+
+@app.get("/api/course/{courseId}/bundle")
+async def get_course_bundle(courseId: str):
+    """
+    The offline bundle of a published course, built on first request if publishing
+    didn't leave one. Range and If-Range requests resume interrupted downloads.
+    """
+    path = bundle_store.path_for(courseId)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Course not found")
+
+    if not os.path.isfile(path):
+        try:
+            # Shielded: a client giving up shouldn't cancel a build other requests share
+            path = await asyncio.shield(course_bundle_task(courseId))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to build course bundle: {str(e)}")
+        if path is None:
+            raise HTTPException(status_code=404, detail="Course not found or not published")
+
+    return FileResponse(
+        path,
+        media_type="application/zip",
+        filename=f"course-{courseId}.zip",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+async def store_bundle_image(data: bytes) -> str:
+    """Put an imported bundle image into the image store (inline data URI without one); returns its URL."""
+    content_type = image_type(data)[1]
+    if image_store is None:
+        return f"data:{content_type};base64,{base64.b64encode(data).decode()}"
+    name = bundle_image_name(data)
+    if not image_store.exists(name):
+        await asyncio.to_thread(image_store.put, name, data, content_type)
+    return image_store.url_for(name)
+
+@app.post("/api/course/bundle")
+async def import_course_bundle(request: Request):
+    """
+    Load a course bundle (the zip from /api/course/{courseId}/bundle, as the request body)
+    into this deployment: images go to the image store, rows are bulk-inserted with new
+    IDs, and a bundle of a published course is published here too.
+    """
+    limit = BUNDLE_IMPORT_MAX_MB * 1024 * 1024
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(status_code=413, detail=f"Bundle is larger than {BUNDLE_IMPORT_MAX_MB} MB")
+        chunks.append(chunk)
+
+    try:
+        course, images = await asyncio.to_thread(read_bundle, b"".join(chunks))
+    except BundleError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid bundle: {str(e)}")
+
+    try:
+        names = sorted(images)
+        urls = dict(zip(names, await asyncio.gather(*(store_bundle_image(images[name]) for name in names))))
+        for content in lesson_contents(course):
+            image = content.get("aiGeneratedImage")
+            if image in urls:
+                content["aiGeneratedImage"] = urls[image]
+            elif image and image.startswith(BUNDLE_IMAGE_DIR):
+                # Listed in the manifest but missing from the archive
+                content.pop("aiGeneratedImage")
+            content.pop("thumbnailUrl", None)
+
+        try:
+            with stage("json_parse"):
+                course_data = validate_course(course, prune=True)
+        except CourseDocumentError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid course: {str(e)}")
+
+        stored = await parse_and_store_course(course_data)
+        published = bool(course.get("isPublished")) and await mark_course_published(stored["id"])
+        logger.info(f"Imported bundle as course {stored['id']} with {len(urls)} images")
+        return {"success": True, "courseId": stored["id"], "images": len(urls), "published": published}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error importing course bundle: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to import course bundle: {str(e)}")
+
+def load_answer_keys(submodule_ids: list) -> dict:
+    """Answers for the given quiz submodules, in question order, from one query."""
+    supabase = get_supabase_client()
+    response = supabase.table("quiz_questions").select("submodule_id, idx, answer").in_("submodule_id", submodule_ids).execute()
+
+    answer_keys = {}
+    for row in sorted(response.data or [], key=lambda row: row["idx"]):
+        answer_keys.setdefault(row["submodule_id"], []).append(row["answer"])
+    return answer_keys
+
+def load_submodule_ids(submodule_ids: list) -> dict:
+    """{id: True} for the given IDs that are submodules, from one query."""
+    response = get_supabase_client().table("submodules").select("id").in_("id", submodule_ids).execute()
+    return {row["id"]: True for row in response.data or []}
+
+def is_rejected_progress_row(error: Exception) -> bool:
+    # Postgres data exceptions (22xxx, e.g. a malformed UUID) and integrity violations
+    # (23xxx, e.g. a deleted submodule) are about the rows; retrying them can't succeed
+    return str(getattr(error, "code", "") or "").startswith(("22", "23"))
+
+def write_progress_batch(progress_rows: list, attempt_rows: list):
+    supabase = get_supabase_client()
+    if progress_rows:
+        with stage("db.question_progress"):
+            supabase.table("question_progress").upsert(progress_rows, on_conflict="user_id,submodule_id").execute()
+    if attempt_rows:
+        with stage("db.question_attempts"):
+            supabase.table("question_attempts").upsert(attempt_rows, on_conflict="id", ignore_duplicates=True).execute()
+
+answer_keys = SubmoduleIndex(load_answer_keys, int(os.getenv("ANSWER_KEY_INDEX_MAX_ENTRIES", "10000")))
+known_submodules = SubmoduleIndex(load_submodule_ids, int(os.getenv("SUBMODULE_INDEX_MAX_ENTRIES", "100000")))
+
+progress_ingestor = ProgressIngestor(
+    os.getenv("INGEST_SPILL_DIR", ".data/ingest"),
+    write_progress_batch,
+    flush_size=int(os.getenv("INGEST_FLUSH_SIZE", "200")),
+    flush_interval=float(os.getenv("INGEST_FLUSH_INTERVAL", "2")),
+    max_pending=int(os.getenv("INGEST_MAX_PENDING", "50000")),
+    is_rejection=is_rejected_progress_row,
+)
+
+@app.post("/api/progress/events")
+async def ingest_progress_events(request: dict):
+    """
+    Accept lesson progress and quiz attempt events. Attempts are graded here against
+    the answer key index; everything is buffered and written to Supabase in bulk.
+    """
+    events = request.get("events")
+    if not isinstance(events, list) or not events:
+        raise HTTPException(status_code=400, detail="events must be a non-empty list")
+
+    # Checked up front so a bad ID is a 400 here, not a row that fails the bulk write later
+    for idx, event in enumerate(events):
+        if not isinstance(event, dict) or not is_uuid(event.get("submoduleId")):
+            raise HTTPException(status_code=400, detail=f"Event {idx} requires a submoduleId that is a UUID")
+
+    quiz_ids = [event["submoduleId"] for event in events if event.get("type") == "attempt"]
+    lesson_ids = [event["submoduleId"] for event in events if event.get("type") == "progress"]
+    try:
+        keys = await asyncio.to_thread(answer_keys.get_many, quiz_ids) if quiz_ids else {}
+        known = await asyncio.to_thread(known_submodules.get_many, lesson_ids) if lesson_ids else {}
+    except Exception as e:
+        logger.error(f"Error loading submodules: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to look up submodules: {str(e)}")
+
+    progress_rows = []
+    attempt_rows = []
+    results = []
+
+    for idx, event in enumerate(events):
+        user_id = event.get("userId")
+        submodule_id = event.get("submoduleId")
+        if not user_id or not submodule_id:
+            raise HTTPException(status_code=400, detail=f"Event {idx} requires userId and submoduleId")
+
+        try:
+            tries = int(event.get("tries", 0 if event.get("type") == "progress" else 1))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail=f"Event {idx} has a non-integer tries")
+
+        if event.get("type") == "progress":
+            if submodule_id not in known:
+                raise HTTPException(status_code=400, detail=f"Event {idx} refers to an unknown submodule: {submodule_id}")
+            progress_rows.append(progress_row(user_id, submodule_id, event.get("isCompleted", False), tries))
+
+        elif event.get("type") == "attempt":
+            answer_key = keys.get(submodule_id)
+            if answer_key is None:
+                raise HTTPException(status_code=400, detail=f"Event {idx} refers to an unknown quiz: {submodule_id}")
+
+            answers = event.get("answers") or []
+            grade = grade_attempt(answer_key, answers)
+            attempt_rows.append(attempt_row(user_id, submodule_id, answers, grade))
+            progress_rows.append(progress_row(user_id, submodule_id, grade["passed"], tries))
+            results.append({"submoduleId": submodule_id, **grade})
+
+        else:
+            raise HTTPException(status_code=400, detail=f"Event {idx} has unknown type: {event.get('type')}")
+
+    try:
+        await progress_ingestor.submit(progress_rows, attempt_rows)
+    except IngestBackpressure as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+    return {"accepted": len(events), "results": results}
+
+@app.get("/api/health/ingest")
+async def ingest_health():
+    return progress_ingestor.stats()
+
+search_index = SearchIndex(os.getenv("SEARCH_SNAPSHOT_PATH", ".data/search-index.json"))
+SEARCH_SNAPSHOT_INTERVAL = float(os.getenv("SEARCH_SNAPSHOT_INTERVAL", "30"))
+SEARCH_MAX_LIMIT = 100
+
+def upsert_search_documents(documents: list):
+    for document in documents:
+        search_index.upsert(document)
+
+async def rebuild_search_index():
+    try:
+        documents = await asyncio.to_thread(fetch_published_documents, get_supabase_client())
+    except Exception as e:
+        logger.error(f"Search index rebuild failed: {str(e)}")
+        return
+    await asyncio.to_thread(upsert_search_documents, documents)
+    logger.info(f"Indexed {len(documents)} published courses for search")
+
+def reconcile_search_snapshot() -> int:
+    """Catch a restored snapshot up with courses other instances stored, published or deleted meanwhile."""
+    supabase = get_supabase_client()
+    missing = search_index.reconcile(fetch_course_states(supabase))
+    upsert_search_documents(fetch_documents(supabase, missing))
+    return len(missing)
+
+async def reconcile_search_index():
+    try:
+        added = await asyncio.to_thread(reconcile_search_snapshot)
+        logger.info(f"Search snapshot reconciled with the database, {added} courses added")
+    except Exception as e:
+        logger.error(f"Search snapshot reconciliation failed, results may be stale: {str(e)}")
+
+async def snapshot_search_index():
+    while True:
+        await asyncio.sleep(SEARCH_SNAPSHOT_INTERVAL)
+        if search_index.dirty:
+            try:
+                await asyncio.to_thread(search_index.save)
+            except Exception as e:
+                logger.error(f"Search snapshot failed: {str(e)}")
+
+async def start_search_index() -> list:
+    """
+    Restore the index from its snapshot and reconcile it with Supabase in the background,
+    or rebuild it from Supabase when there is no usable snapshot.
+    """
+    tasks = [asyncio.create_task(snapshot_search_index())]
+    if await asyncio.to_thread(search_index.load):
+        tasks.append(asyncio.create_task(reconcile_search_index()))
+    else:
+        tasks.append(asyncio.create_task(rebuild_search_index()))
+    return tasks
+
+async def stop_search_index(tasks: list):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if search_index.dirty:
+        try:
+            await asyncio.to_thread(search_index.save)
+        except Exception as e:
+            logger.error(f"Search snapshot failed: {str(e)}")
+
+@app.get("/api/courses/search")
+async def search_courses(request: Request, q: str = "", offset: int = 0, limit: int = 20):
+    """Published courses ranked by BM25 over titles, summaries, objectives and lessons."""
+    if offset < 0 or limit < 1:
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit >= 1")
+    limit = min(limit, SEARCH_MAX_LIMIT)
+    # Scoring is CPU work under the index lock; keep it off the event loop
+    page = await asyncio.to_thread(search_index.search, q, offset, limit)
+    return conditional_response(request, dumps_bytes({"query": q, "offset": offset, "limit": limit, **page}))
+
+@app.get("/api/course/{courseId}/analytics")
+async def get_course_analytics(courseId: str, request: Request):
+    """Completion, tries and per-question accuracy from precomputed per-submodule rows."""
+    analytics = analytics_cache.get(courseId)
+    if analytics is None:
+        try:
+            submodule_rows, question_rows = await asyncio.to_thread(fetch_course_stats, get_supabase_client(), courseId)
+        except Exception as e:
+            logger.error(f"Error loading analytics for {courseId}: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Failed to load analytics: {str(e)}")
+
+        analytics = build_course_analytics(courseId, submodule_rows, question_rows)
+        analytics_cache.put(courseId, analytics)
+    return conditional_response(request, dumps_bytes(analytics))
+
+async def get_voice_payload(course_id: str) -> dict:
+    """
+    Title, agent steps, description and voice prompt for a course, served from
+    voice_payload_cache (warmed on store/publish) with a read-through on a miss.
+    """
+    payload = voice_payload_cache.get(course_id)
+    if payload is not None:
+        return payload
+
+    supabase = get_supabase_client()
+    response = await asyncio.to_thread(
+        supabase.table("courses").select("title, meta").eq("id", course_id).execute
+    )
+    
+    if not response.data:
+        raise HTTPException(status_code=404, detail="Course not found")
+    
+    course = response.data[0]
+    payload = build_voice_payload(course_id, course.get("title"), course.get("meta") or {})
+    voice_payload_cache.put(course_id, payload)
+    return payload
+
+@app.get("/api/course/{courseId}/voice-prompt")
+async def getVoicePrompt(courseId: str, request: Request):
+    try:
+        payload = await get_voice_payload(courseId)
+        return conditional_response(request, dumps_bytes({"voice_prompt": payload["voicePrompt"]}))
                 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating voice prompt: {str(e)}")
 
@@ -408,27 +1885,46 @@ async def getVoicePrompt(courseId: str):
 # LiveKit Connection Route
 # ---------------------------------------
 
+# Voice sessions: every learner gets their own room, tracked from token issue until the
+# session ends or expires. Live sessions are capped globally and per course (0 = no cap).
+VOICE_TOKEN_TTL = int(os.getenv("VOICE_TOKEN_TTL", "900"))
+VOICE_BATCH_MAX = int(os.getenv("VOICE_BATCH_MAX", "100"))
+voice_sessions = VoiceSessionRegistry(
+    token_ttl=VOICE_TOKEN_TTL,
+    max_duration=int(os.getenv("VOICE_SESSION_MAX_DURATION", "3600")),
+    max_sessions=int(os.getenv("VOICE_MAX_SESSIONS", "500")),
+    max_per_course=int(os.getenv("VOICE_MAX_SESSIONS_PER_COURSE", "100")),
+)
+
+@lru_cache(maxsize=4)
+def token_signer(api_key: str, api_secret: str) -> TokenSigner:
+    return TokenSigner(api_key, api_secret)
+
+def livekit_credentials():
+    api_key = os.getenv("LIVEKIT_API_KEY")
+    api_secret = os.getenv("LIVEKIT_API_SECRET")
+    if not api_key or not api_secret:
+        raise ValueError("LIVEKIT_API_KEY and LIVEKIT_API_SECRET must be set")
+    return api_key, api_secret
+
 def create_participant_token(
     identity: str,
     name: str,
     room_name: str,
-    agent_name: Optional[str] = None
+    agent_name: Optional[str] = None,
+    expires_at: Optional[float] = None,
 ) -> str:
-    """Create a LiveKit access token for a participant"""
-    api_key = os.getenv("LIVEKIT_API_KEY")
-    api_secret = os.getenv("LIVEKIT_API_SECRET")
-    
-    if not api_key or not api_secret:
-        raise ValueError("LIVEKIT_API_KEY and LIVEKIT_API_SECRET must be set")
+    """Create a LiveKit access token for a participant, valid until expires_at (default VOICE_TOKEN_TTL from now)"""
+    api_key, api_secret = livekit_credentials()
     
     # Create JWT token
-    now = datetime.utcnow()
-    exp = now + timedelta(minutes=15)
+    now = datetime.now(timezone.utc).timestamp()
+    exp = expires_at or now + VOICE_TOKEN_TTL
     
     claims = {
-        "exp": int(exp.timestamp()),
+        "exp": int(exp),
         "iss": api_key,
-        "nbf": int(now.timestamp()),
+        "nbf": int(now),
         "sub": identity,
         "name": name,
         "video": {
@@ -446,8 +1942,31 @@ def create_participant_token(
             "agents": [{"agentName": agent_name}]
         }
     
-    token = jwt.encode(claims, api_secret, algorithm="HS256")
-    return token
+    return token_signer(api_key, api_secret).sign(claims)
+
+def iso_timestamp(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat().replace("+00:00", "Z") if timestamp else None
+
+def voice_limit_exception(error: VoiceSessionLimitError) -> HTTPException:
+    headers = {"Retry-After": str(math.ceil(error.retry_after))} if error.retry_after else None
+    return HTTPException(status_code=429, detail=str(error), headers=headers)
+
+def session_connection(session: dict, participant_name: str, agent_name: Optional[str]) -> dict:
+    """Token and room details for one issued session."""
+    return {
+        "sessionId": session["sessionId"],
+        "roomName": session["roomName"],
+        "participantIdentity": session["identity"],
+        "participantToken": create_participant_token(
+            identity=session["identity"],
+            name=participant_name,
+            room_name=session["roomName"],
+            agent_name=agent_name,
+            expires_at=session["expiresAt"],
+        ),
+        "participantName": participant_name,
+        "expiresAt": iso_timestamp(session["expiresAt"]),
+    }
 
 
 @app.post("/api/connection-details")
@@ -460,32 +1979,22 @@ async def connection_details(request: dict):
         livekit_url = os.getenv("LIVEKIT_URL")
         if not livekit_url:
             raise HTTPException(status_code=500, detail="LIVEKIT_URL is not configured")
+        # Checked before a session is issued, so a misconfiguration doesn't use up the caps
+        livekit_credentials()
         
         # Parse agent configuration from request body
         room_config = request.get("room_config", {})
         agents = room_config.get("agents", [])
         agent_name = agents[0].get("agent_name") if agents else None
         
-        # Generate participant details
-        participant_name = "user"
-        participant_identity = f"voice_assistant_user_{int(datetime.utcnow().timestamp() * 1000) % 10000}"
-        room_name = f"voice_assistant_room_{int(datetime.utcnow().timestamp() * 1000) % 10000}"
-        
-        # Create participant token
-        participant_token = create_participant_token(
-            identity=participant_identity,
-            name=participant_name,
-            room_name=room_name,
-            agent_name=agent_name
-        )
-        
-        return {
-            "serverUrl": livekit_url,
-            "roomName": room_name,
-            "participantToken": participant_token,
-            "participantName": participant_name,
-        }
+        # A fresh session (own room and identity) per request
+        session = voice_sessions.issue()[0]
+        return {"serverUrl": livekit_url, **session_connection(session, "user", agent_name)}
         
+    except HTTPException:
+        raise
+    except VoiceSessionLimitError as e:
+        raise voice_limit_exception(e)
     except ValueError as e:
         raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
@@ -502,74 +2011,185 @@ async def create_course_voice_session(courseId: str):
         livekit_url = os.getenv("LIVEKIT_URL")
         if not livekit_url:
             raise HTTPException(status_code=500, detail="LIVEKIT_URL is not configured")
+        livekit_credentials()
         
-        # Fetch course data
-        supabase = get_supabase_client()
-        response = supabase.table("courses").select("title, meta").eq("id", courseId).execute()
-        
-        if not response.data:
-            raise HTTPException(status_code=404, detail="Course not found")
-        
-        course = response.data[0]
-        meta = course.get("meta", {})
-        title = course.get("title", "Unknown Course")
-        final_assessment = meta.get("finalAssessment", {})
-        
-        # Format AR instructions as steps for the agent
-        ar_instructions = final_assessment.get("arInstructions", [])
-        description = final_assessment.get("description", "Complete the final project")
-        
-        # Convert to agent step format
-        steps = []
-        if ar_instructions:
-            for i, instruction in enumerate(ar_instructions):
-                steps.append({
-                    "title": f"Step {i+1}",
-                    "description": instruction
-                })
-        else:
-            # Fallback if no AR instructions
-            steps = [{
-                "title": "Complete Project",
-                "description": description
-            }]
+        # Course title, steps and description are precomputed per course
+        payload = await get_voice_payload(courseId)
+        title = payload["courseTitle"]
+        steps = payload["steps"]
         
         # Generate room metadata with course information
         room_metadata = {
             "courseId": courseId,
             "courseTitle": title,
             "steps": steps,
-            "description": description
+            "description": payload["description"]
         }
         
-        # Generate participant details
-        participant_name = "user"
-        participant_identity = f"course_{courseId}_user_{int(datetime.utcnow().timestamp() * 1000) % 10000}"
-        room_name = f"course_{courseId}_room_{int(datetime.utcnow().timestamp() * 1000) % 10000}"
-        
-        # Create participant token with agent
-        participant_token = create_participant_token(
-            identity=participant_identity,
-            name=participant_name,
-            room_name=room_name,
-            agent_name="teaching-assistant"
-        )
+        # A fresh session (own room and identity) per learner
+        session = voice_sessions.issue(courseId)[0]
         
         return {
             "serverUrl": livekit_url,
-            "roomName": room_name,
-            "participantToken": participant_token,
-            "participantName": participant_name,
+            **session_connection(session, "user", "teaching-assistant"),
             "courseTitle": title,
             "steps": steps,
             "metadata": room_metadata
         }
         
+    except HTTPException:
+        raise
+    except VoiceSessionLimitError as e:
+        raise voice_limit_exception(e)
     except ValueError as e:
         raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create course voice session: {str(e)}")
 
+@app.post("/api/course/{courseId}/voice-sessions")
+async def create_course_voice_sessions(courseId: str, request: dict):
+    """
+    Issue sessions for a whole classroom in one call: one room and token per learner,
+    all or none within the session caps.
+    """
+    names = request.get("names")
+    if names is not None and (not isinstance(names, list) or not all(isinstance(name, str) for name in names)):
+        raise HTTPException(status_code=400, detail="names must be a list of strings")
+    try:
+        count = len(names) if names else int(request.get("count", 0))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="count must be an integer")
+    if not 1 <= count <= VOICE_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"count must be between 1 and {VOICE_BATCH_MAX}")
+
+    try:
+        livekit_url = os.getenv("LIVEKIT_URL")
+        if not livekit_url:
+            raise HTTPException(status_code=500, detail="LIVEKIT_URL is not configured")
+        livekit_credentials()
+
+        payload = await get_voice_payload(courseId)
+        sessions = voice_sessions.issue(courseId, count)
+        return {
+            "serverUrl": livekit_url,
+            "courseTitle": payload["courseTitle"],
+            "steps": payload["steps"],
+            "metadata": {
+                "courseId": courseId,
+                "courseTitle": payload["courseTitle"],
+                "steps": payload["steps"],
+                "description": payload["description"],
+            },
+            "sessions": [
+                session_connection(session, names[i] if names else f"learner-{i + 1}", "teaching-assistant")
+                for i, session in enumerate(sessions)
+            ],
+        }
+
+    except HTTPException:
+        raise
+    except VoiceSessionLimitError as e:
+        raise voice_limit_exception(e)
+    except ValueError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to create course voice sessions: {str(e)}")
+
+def serialize_voice_session(session: dict) -> dict:
+    return {
+        "sessionId": session["sessionId"],
+        "courseId": session["courseId"],
+        "roomName": session["roomName"],
+        "state": session["state"],
+        "createdAt": iso_timestamp(session["createdAt"]),
+        "joinedAt": iso_timestamp(session["joinedAt"]),
+        "endedAt": iso_timestamp(session["endedAt"]),
+        "expiresAt": iso_timestamp(session["expiresAt"]),
+    }
+
+@app.get("/api/voice-sessions/{sessionId}")
+async def get_voice_session(sessionId: str):
+    session = voice_sessions.get(sessionId)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Voice session not found")
+    return serialize_voice_session(session)
+
+def bearer_token(request: Request) -> str:
+    authorization = request.headers.get("authorization", "")
+    return authorization[7:] if authorization.lower().startswith("bearer ") else authorization
+
+@app.post("/api/voice-sessions/{sessionId}/end")
+async def end_voice_session(sessionId: str, request: Request):
+    """
+    End a session on behalf of its learner, who proves it with the participant token
+    issued for it. A joined session outlives that token's exp (which only bounds
+    joining), so an expired but correctly signed token can still end its own session.
+    """
+    try:
+        api_key, api_secret = livekit_credentials()
+    except ValueError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    try:
+        claims = jwt.decode(
+            bearer_token(request), api_secret, algorithms=["HS256"],
+            options={"verify_exp": False, "verify_aud": False},
+        )
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Invalid session token")
+
+    session = voice_sessions.get(sessionId)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Voice session not found")
+    room = (claims.get("video") or {}).get("room")
+    if claims.get("iss") != api_key or claims.get("sub") != session["identity"] or room != session["roomName"]:
+        raise HTTPException(status_code=403, detail="Token is not for this voice session")
+
+    session = voice_sessions.end(sessionId)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Voice session not found")
+    return serialize_voice_session(session)
+
+@app.post("/api/livekit/webhook")
+async def livekit_webhook(request: Request):
+    """
+    LiveKit webhook receiver: the learner joining marks a session joined, and the learner
+    leaving or the room closing ends it. Requests are signed with the API secret, with
+    the body's SHA-256 in the token.
+    """
+    body = await request.body()
+    try:
+        api_key, api_secret = livekit_credentials()
+    except ValueError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    try:
+        claims = jwt.decode(bearer_token(request), api_secret, algorithms=["HS256"], options={"verify_aud": False})
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+    if claims.get("iss") != api_key or claims.get("sha256") != base64.b64encode(hashlib.sha256(body).digest()).decode():
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+
+    try:
+        event = json.loads(body)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid webhook body")
+
+    session_id = voice_sessions.session_for_room((event.get("room") or {}).get("name", ""))
+    if session_id is None:
+        return {"handled": False}
+    session = voice_sessions.get(session_id)
+    if session is None:
+        return {"handled": False}
+    identity = (event.get("participant") or {}).get("identity")
+    kind = event.get("event")
+    if kind == "participant_joined" and identity == session["identity"]:
+        voice_sessions.join(session_id)
+    elif (kind == "participant_left" and identity == session["identity"]) or kind == "room_finished":
+        voice_sessions.end(session_id)
+    else:
+        return {"handled": False}
+    return {"handled": True}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,342 @@
+import asyncio
+import bisect
+import logging
+import math
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidOutputError(ValueError):
+    """Every routed model answered, but none passed validation; carries the last answer."""
+
+    def __init__(self, operation: str, model: str, result):
+        super().__init__(f"{model} returned an invalid response for {operation}")
+        self.model = model
+        self.result = result
+
+
+# check(chunk, finished) -> True (commit to this model), False (invalid output), None (undecided)
+OutputCheck = Callable[[str, bool], Optional[bool]]
+
+# Log-spaced bucket bounds from 50ms to ~5 minutes
+HISTOGRAM_BOUNDS = [round(0.05 * (1.25 ** i), 3) for i in range(40)]
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram; percentiles are the upper bound of the matching bucket."""
+
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(HISTOGRAM_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return HISTOGRAM_BOUNDS[idx] if idx < len(HISTOGRAM_BOUNDS) else float("inf")
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 3) if self.count else None,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+class ModelRouter:
+    """
+    Routes a generation across an ordered list of text models. The first model is
+    tried first; if it hasn't produced output within the hedge delay (a percentile
+    of its observed time-to-first-output, or a default until enough samples exist),
+    a hedged request goes to the next model and the first to deliver wins while the
+    other is cancelled. A model that fails before producing output, or whose output
+    fails validation before anything was passed on, falls back to the next one.
+    Latency histograms are kept per operation and model.
+    """
+
+    def __init__(self, models: List[str], hedge_enabled: bool = True, hedge_percentile: float = 95,
+                 hedge_min_samples: int = 20, default_hedge_delay: float = 8.0,
+                 default_complete_delay: float = 30.0, min_hedge_delay: float = 0.5):
+        if not models:
+            raise ValueError("ModelRouter needs at least one model")
+        self.models = models
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.default_hedge_delay = default_hedge_delay
+        # A whole response takes far longer than a stream's first chunk
+        self.default_complete_delay = default_complete_delay
+        self.min_hedge_delay = min_hedge_delay
+
+        self._first_output: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self._total: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self.wins: Dict[str, int] = {}
+        self.hedges = 0
+        self.fallbacks = 0
+        self.failures: Dict[str, int] = {}
+
+    def _histogram(self, table: dict, operation: str, model: str) -> LatencyHistogram:
+        key = (operation, model)
+        if key not in table:
+            table[key] = LatencyHistogram()
+        return table[key]
+
+    def hedge_delay(self, operation: str, model: str, default: Optional[float] = None) -> float:
+        histogram = self._histogram(self._first_output, operation, model)
+        if histogram.count < self.hedge_min_samples:
+            return self.default_hedge_delay if default is None else default
+        return max(self.min_hedge_delay, histogram.percentile(self.hedge_percentile))
+
+    def _next_model(self, attempts: int) -> Optional[str]:
+        if attempts < len(self.models):
+            return self.models[attempts]
+        # With a single model, the hedge goes to that model again
+        if len(self.models) == 1 and attempts == 1:
+            return self.models[0]
+        return None
+
+    def _record_failure(self, model: str, error: BaseException):
+        self.failures[model] = self.failures.get(model, 0) + 1
+        logger.warning(f"Model {model} failed before producing output: {str(error)[:200]}")
+
+    async def stream(self, operation: str, open_stream: Callable[[str, dict], AsyncIterator[str]],
+                     usage: dict, make_check: Optional[Callable[[], OutputCheck]] = None) -> AsyncIterator[str]:
+        """
+        Yield text from whichever model first produces acceptable output. open_stream(model,
+        usage) returns that model's text stream and fills in its token usage; the winner's
+        usage is copied into usage.
+
+        With make_check, each attempt gets its own check(chunk, finished), fed every chunk
+        and then ("", True) at the end of the stream. Chunks are held back until it returns
+        True, which commits to that model; False rejects the attempt as invalid output (an
+        InvalidOutputError) and falls back; None means undecided. Without it, the first
+        chunk commits. Once committed, output is passed on and no longer checked. If every
+        model's output is rejected, the last one's held text is passed on after all, so
+        the caller's own parsing decides what to make of it.
+        """
+        events: asyncio.Queue = asyncio.Queue()
+        attempts: List[dict] = []
+
+        async def pump(attempt: dict):
+            model = attempt["model"]
+            started = time.monotonic()
+            first = True
+            try:
+                async for chunk in open_stream(model, attempt["usage"]):
+                    if first:
+                        self._histogram(self._first_output, operation, model).observe(time.monotonic() - started)
+                        first = False
+                    events.put_nowait((attempt, "text", chunk))
+                self._histogram(self._total, operation, model).observe(time.monotonic() - started)
+                events.put_nowait((attempt, "end", None))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                events.put_nowait((attempt, "error", e))
+
+        def launch(model: str):
+            attempt = {"model": model, "usage": {}, "failed": False, "held": [],
+                       "check": make_check() if make_check is not None else None}
+            attempt["task"] = asyncio.create_task(pump(attempt))
+            attempts.append(attempt)
+
+        def verdict(attempt: dict, chunk: str, finished: bool) -> Optional[bool]:
+            if attempt["check"] is None:
+                return True
+            try:
+                return attempt["check"](chunk, finished)
+            except Exception as e:
+                logger.warning(f"{operation}: output check failed for {attempt['model']}: {str(e)}")
+                return False
+
+        loop = asyncio.get_running_loop()
+        launch(self.models[0])
+        hedge_at = loop.time() + self.hedge_delay(operation, self.models[0])
+        hedged = not self.hedge_enabled
+        winner = None
+        last_error: Optional[BaseException] = None
+        rejected: Optional[dict] = None
+
+        # One outstanding get() at a time, kept across hedge timeouts so no chunk is dropped
+        getter: Optional[asyncio.Future] = None
+
+        try:
+            while True:
+                if winner is None and all(attempt["failed"] for attempt in attempts):
+                    model = self._next_model(len(attempts))
+                    if model is None and rejected is not None and last_error is rejected["error"]:
+                        winner = rejected
+                        for chunk in winner["held"]:
+                            yield chunk
+                        return
+                    if model is None:
+                        raise last_error
+                    self.fallbacks += 1
+                    launch(model)
+                    hedge_at = loop.time() + self.hedge_delay(operation, model)
+
+                if getter is None:
+                    getter = asyncio.ensure_future(events.get())
+                # Hedging covers a slow start; a model already producing output isn't hedged
+                producing = winner is not None or any(attempt["held"] and not attempt["failed"] for attempt in attempts)
+                timeout = None if producing or hedged else max(0.0, hedge_at - loop.time())
+                done, _ = await asyncio.wait({getter}, timeout=timeout)
+                if not done:
+                    hedged = True
+                    model = self._next_model(len(attempts))
+                    if model is not None:
+                        self.hedges += 1
+                        logger.info(f"{operation}: no output from {attempts[0]['model']} yet, hedging with {model}")
+                        launch(model)
+                    continue
+                attempt, kind, payload = getter.result()
+                getter = None
+
+                if winner is None:
+                    if attempt["failed"]:
+                        continue
+                    if kind == "error":
+                        attempt["failed"] = True
+                        last_error = payload
+                        self._record_failure(attempt["model"], payload)
+                        continue
+                    if kind == "text":
+                        attempt["held"].append(payload)
+                    accepted = verdict(attempt, payload if kind == "text" else "", kind == "end")
+                    if not accepted:
+                        if accepted is None and kind == "text":
+                            continue
+                        # Rejected, or ended without ever passing the check
+                        attempt["failed"] = True
+                        attempt["task"].cancel()
+                        last_error = attempt["error"] = InvalidOutputError(operation, attempt["model"], "".join(attempt["held"]))
+                        self._record_failure(attempt["model"], last_error)
+                        rejected = attempt
+                        continue
+                    winner = attempt
+                    self.wins[winner["model"]] = self.wins.get(winner["model"], 0) + 1
+                    for other in attempts:
+                        if other is not winner:
+                            other["task"].cancel()
+                    for chunk in winner["held"]:
+                        yield chunk
+                    if kind == "end":
+                        return
+                    continue
+
+                if attempt is not winner:
+                    continue
+                if kind == "text":
+                    yield payload
+                elif kind == "end":
+                    return
+                else:
+                    raise payload
+        finally:
+            if getter is not None:
+                getter.cancel()
+            for attempt in attempts:
+                attempt["task"].cancel()
+            if winner is not None:
+                usage.update(winner["usage"])
+
+    async def complete(self, operation: str, call: Callable[[str], Awaitable], validate: Callable[[object], bool]):
+        """
+        Run call(model) with hedging and fallback; returns (model, result) for the first
+        result that passes validate(). Losers are cancelled. If every model fails, the
+        last error is raised (InvalidOutputError when the last one answered invalidly).
+        """
+        loop = asyncio.get_running_loop()
+        tasks: Dict[asyncio.Task, str] = {}
+        launched = 0
+        last_error: Optional[BaseException] = None
+
+        async def timed(model: str):
+            started = time.monotonic()
+            result = await call(model)
+            elapsed = time.monotonic() - started
+            self._histogram(self._first_output, operation, model).observe(elapsed)
+            self._histogram(self._total, operation, model).observe(elapsed)
+            return result
+
+        def launch(model: str):
+            nonlocal launched
+            tasks[asyncio.create_task(timed(model))] = model
+            launched += 1
+
+        launch(self.models[0])
+        hedge_at = loop.time() + self.hedge_delay(operation, self.models[0], self.default_complete_delay)
+        hedged = not self.hedge_enabled
+
+        try:
+            while True:
+                if not tasks:
+                    model = self._next_model(launched)
+                    if model is None:
+                        raise last_error
+                    self.fallbacks += 1
+                    launch(model)
+                    hedge_at = loop.time() + self.hedge_delay(operation, model, self.default_complete_delay)
+
+                timeout = None if hedged else max(0.0, hedge_at - loop.time())
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    model = self._next_model(launched)
+                    if model is not None:
+                        self.hedges += 1
+                        logger.info(f"{operation}: no response from {self.models[0]} yet, hedging with {model}")
+                        launch(model)
+                    continue
+
+                for task in done:
+                    model = tasks.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        last_error = e
+                        self._record_failure(model, e)
+                        continue
+                    if validate(result):
+                        self.wins[model] = self.wins.get(model, 0) + 1
+                        return model, result
+                    last_error = InvalidOutputError(operation, model, result)
+                    self._record_failure(model, last_error)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> dict:
+        latency: Dict[str, dict] = {}
+        for (operation, model), histogram in self._first_output.items():
+            latency.setdefault(operation, {})[model] = {
+                "firstOutput": histogram.stats(),
+                "total": self._histogram(self._total, operation, model).stats(),
+                "hedgeDelay": round(self.hedge_delay(operation, model), 3),
+            }
+        return {
+            "models": self.models,
+            "hedgeEnabled": self.hedge_enabled,
+            "hedgePercentile": self.hedge_percentile,
+            "hedges": self.hedges,
+            "fallbacks": self.fallbacks,
+            "wins": self.wins,
+            "failures": self.failures,
+            "latency": latency,
+        }
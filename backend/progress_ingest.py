@@ -0,0 +1,336 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PASS_RATIO = 0.7
+
+
+class IngestBackpressure(Exception):
+    """Raised when the write-behind buffer is full; callers should retry later."""
+
+
+def is_uuid(value) -> bool:
+    try:
+        uuid.UUID(str(value))
+        return True
+    except ValueError:
+        return False
+
+
+class SubmoduleIndex:
+    """
+    In-memory index of per-submodule data by submodule ID (quiz answer keys, or just
+    that a submodule exists), so ingest can check events without a database read.
+    load(submodule_ids) fills misses in one batched query; unknown IDs are not cached.
+    """
+
+    def __init__(self, load: Callable[[List[str]], Dict[str, object]], max_entries: int):
+        self._load = load
+        self.max_entries = max_entries
+        self._entries: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def put(self, submodule_id: str, value):
+        with self._lock:
+            if len(self._entries) >= self.max_entries and submodule_id not in self._entries:
+                # Cheap bound: drop the oldest insertion rather than tracking recency
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[submodule_id] = value
+
+    def get_many(self, submodule_ids: List[str]) -> Dict[str, object]:
+        with self._lock:
+            found = {sid: self._entries[sid] for sid in submodule_ids if sid in self._entries}
+        missing = [sid for sid in set(submodule_ids) if sid not in found]
+        if missing:
+            for sid, value in self._load(missing).items():
+                self.put(sid, value)
+                found[sid] = value
+        return found
+
+
+def grade_attempt(answer_key: List[str], submitted: list) -> dict:
+    results = []
+    for idx, expected in enumerate(answer_key):
+        given = submitted[idx] if idx < len(submitted) else None
+        results.append(given is not None and str(given).strip() == str(expected).strip())
+    correct = sum(results)
+    total = len(answer_key)
+    return {
+        "correct": correct,
+        "total": total,
+        "results": results,
+        "passed": total > 0 and correct / total >= PASS_RATIO,
+    }
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class ProgressIngestor:
+    """
+    Write-behind buffer for question_progress upserts and question_attempts inserts.
+
+    Accepted records are appended to a local spill file before they are acknowledged,
+    then written to the database in bulk once flush_size records are pending or
+    flush_interval seconds pass. A segment's spill file is only deleted after its
+    records are written, and leftover segments are replayed on start, so a crash
+    loses nothing (delivery is at-least-once; both writes are idempotent).
+
+    When a bulk write fails because the database rejected rows (is_rejection(error)),
+    the batch is split in halves until the bad rows are isolated; the rest is written
+    and the bad rows are appended to quarantine.jsonl instead of being retried forever.
+    Any other failure (database unreachable, ...) keeps the whole batch for the next flush.
+    """
+
+    def __init__(self, spill_dir: str, write_batch: Callable[[list, list], None],
+                 flush_size: int, flush_interval: float, max_pending: int,
+                 is_rejection: Callable[[Exception], bool] = lambda error: False):
+        self.spill_dir = spill_dir
+        self.write_batch = write_batch
+        self.is_rejection = is_rejection
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._pending: list = []
+        self._unflushed: list = []  # [(segment_path, records)] from failed flushes
+        self._file_lock = threading.Lock()
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.accepted = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.quarantined = 0
+        self.last_flush_at: Optional[float] = None
+
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self._current_path = os.path.join(self.spill_dir, "current.jsonl")
+        self.quarantine_path = os.path.join(self.spill_dir, "quarantine.jsonl")
+
+    def _buffered(self) -> int:
+        return len(self._pending) + sum(len(records) for _, records in self._unflushed)
+
+    async def start(self):
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        await asyncio.to_thread(self._recover)
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Final progress flush failed, records stay in the spill file: {str(e)}")
+
+    def _recover(self):
+        """Re-queue records from segments a previous process never managed to write."""
+        for path in sorted(glob.glob(os.path.join(self.spill_dir, "segment-*.jsonl"))):
+            records = self._read_segment(path)
+            if records:
+                self._unflushed.append((path, records))
+            else:
+                os.remove(path)
+
+        if os.path.exists(self._current_path):
+            self._pending = self._read_segment(self._current_path)
+
+        recovered = self._buffered()
+        if recovered:
+            logger.info(f"Recovered {recovered} progress records from spill files")
+
+    @staticmethod
+    def _read_segment(path: str) -> list:
+        records = []
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A torn final line from a crash mid-write; it was never acknowledged
+                    logger.warning(f"Skipping unreadable line in {path}")
+        return records
+
+    def _append(self, records: list):
+        with self._file_lock:
+            if self._buffered() + len(records) > self.max_pending:
+                raise IngestBackpressure(f"Progress buffer is full ({self.max_pending} records)")
+            with open(self._current_path, "a") as f:
+                f.write("".join(json.dumps(record) + "\n" for record in records))
+                f.flush()
+                os.fsync(f.fileno())
+            self._pending.extend(records)
+
+    async def submit(self, progress_rows: list, attempt_rows: list):
+        records = ([{"kind": "progress", "row": row} for row in progress_rows]
+                   + [{"kind": "attempt", "row": row} for row in attempt_rows])
+        if not records:
+            return
+        await asyncio.to_thread(self._append, records)
+        self.accepted += len(records)
+        if len(self._pending) >= self.flush_size:
+            self._wakeup.set()
+
+    def _rotate(self) -> Optional[tuple]:
+        with self._file_lock:
+            if not self._pending:
+                return None
+            segment_path = os.path.join(self.spill_dir, f"segment-{time.time_ns()}-{uuid.uuid4().hex[:8]}.jsonl")
+            if os.path.exists(self._current_path):
+                os.replace(self._current_path, segment_path)
+            records, self._pending = self._pending, []
+            return segment_path, records
+
+    @staticmethod
+    def _coalesce(records: list) -> tuple:
+        """Collapse progress updates to one row per (user, submodule); keep every attempt."""
+        progress: Dict[tuple, dict] = {}
+        attempts: Dict[str, dict] = {}
+        for record in records:
+            row = record["row"]
+            if record["kind"] == "progress":
+                key = (row["user_id"], row["submodule_id"])
+                previous = progress.get(key)
+                if previous is not None:
+                    row = {
+                        **row,
+                        "is_completed": previous["is_completed"] or row["is_completed"],
+                        "tries": max(previous.get("tries", 0), row.get("tries", 0)),
+                    }
+                progress[key] = row
+            else:
+                attempts[row["id"]] = row
+        return list(progress.values()), list(attempts.values())
+
+    def _write_isolating(self, progress_rows: list, attempt_rows: list) -> list:
+        """Write the rows, bisecting around rejected ones; returns the rejected records."""
+        try:
+            self.write_batch(progress_rows, attempt_rows)
+            return []
+        except Exception as e:
+            if not self.is_rejection(e):
+                raise
+            records = ([{"kind": "progress", "row": row} for row in progress_rows]
+                       + [{"kind": "attempt", "row": row} for row in attempt_rows])
+            if len(records) == 1:
+                return [{**records[0], "error": str(e)[:500], "rejectedAt": _now_iso()}]
+
+        half = len(records) // 2
+        rejected = []
+        for part in (records[:half], records[half:]):
+            rejected += self._write_isolating(
+                [record["row"] for record in part if record["kind"] == "progress"],
+                [record["row"] for record in part if record["kind"] == "attempt"],
+            )
+        return rejected
+
+    def _quarantine(self, records: list):
+        with open(self.quarantine_path, "a") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def flush(self):
+        if self._flush_lock is None:
+            return
+        async with self._flush_lock:
+            segment = await asyncio.to_thread(self._rotate)
+            segments = self._unflushed + ([segment] if segment else [])
+            if not segments:
+                return
+
+            records = [record for _, records in segments for record in records]
+            progress_rows, attempt_rows = self._coalesce(records)
+            try:
+                rejected = await asyncio.to_thread(self._write_isolating, progress_rows, attempt_rows)
+                if rejected:
+                    await asyncio.to_thread(self._quarantine, rejected)
+            except Exception as e:
+                self.failed_flushes += 1
+                self._unflushed = segments
+                logger.error(f"Progress flush of {len(records)} records failed, will retry: {str(e)}")
+                return
+
+            if rejected:
+                self.quarantined += len(rejected)
+                logger.error(
+                    f"Database rejected {len(rejected)} progress records, moved them to {self.quarantine_path}: "
+                    f"{rejected[0]['error']}"
+                )
+
+            for path, _ in segments:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self._unflushed = []
+            self.flushes += 1
+            self.flushed += len(records)
+            self.last_flush_at = time.time()
+            logger.info(f"Flushed {len(progress_rows)} progress rows and {len(attempt_rows)} attempts")
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Progress flush loop error: {str(e)}")
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "unflushed": sum(len(records) for _, records in self._unflushed),
+            "maxPending": self.max_pending,
+            "accepted": self.accepted,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "failedFlushes": self.failed_flushes,
+            "quarantined": self.quarantined,
+            "lastFlushAt": self.last_flush_at,
+        }
+
+
+def progress_row(user_id: str, submodule_id: str, is_completed: bool, tries: int) -> dict:
+    return {
+        "user_id": user_id,
+        "submodule_id": submodule_id,
+        "is_completed": bool(is_completed),
+        "tries": tries,
+        "last_seen_at": _now_iso(),
+    }
+
+
+def attempt_row(user_id: str, submodule_id: str, answers: list, grade: dict) -> dict:
+    return {
+        # Client-side ID makes a retried insert a no-op
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "submodule_id": submodule_id,
+        "submitted_at": _now_iso(),
+        "answer_json": {"answers": answers, "results": grade["results"]},
+        "is_correct": grade["total"] > 0 and grade["correct"] == grade["total"],
+    }
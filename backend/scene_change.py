@@ -0,0 +1,82 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Grid the frame's luma is averaged down to before comparing
+THUMBNAIL_SIZE = (32, 18)
+HISTOGRAM_BINS = 16
+# Luma levels two neighbouring cells must differ by before the edge counts; keeps sensor noise
+# in flat areas (walls, ceilings) from flipping hash bits
+EDGE_MARGIN = 3.0
+
+
+def luma_thumbnail(luma, width: int, height: int, size: Tuple[int, int] = THUMBNAIL_SIZE) -> np.ndarray:
+    """Block-averaged grayscale thumbnail of a frame's Y (luma) plane, e.g. from an I420 frame."""
+    cols, rows = size
+    plane = np.frombuffer(luma, dtype=np.uint8, count=width * height).reshape(height, width)
+    block_h, block_w = max(1, height // rows), max(1, width // cols)
+    rows, cols = min(rows, height), min(cols, width)
+    plane = plane[:block_h * rows, :block_w * cols].reshape(rows, block_h, cols, block_w)
+    return plane.mean(axis=(1, 3), dtype=np.float32)
+
+
+def scene_distance(a: np.ndarray, b: np.ndarray) -> float:
+    """
+    0..1 difference between two thumbnails: the larger of the share of difference-hash
+    bits (left/right brightness edges) that flipped, which tracks framing and objects,
+    and the histogram distance, which tracks lighting and what fills the view.
+    """
+    edges_a = (a[:, 1:] - a[:, :-1]) > EDGE_MARGIN
+    edges_b = (b[:, 1:] - b[:, :-1]) > EDGE_MARGIN
+    structure = np.count_nonzero(edges_a != edges_b) / edges_a.size
+
+    hist_a = np.histogram(a, bins=HISTOGRAM_BINS, range=(0, 256))[0] / a.size
+    hist_b = np.histogram(b, bins=HISTOGRAM_BINS, range=(0, 256))[0] / b.size
+    tone = float(np.abs(hist_a - hist_b).sum()) / 2
+    return max(structure, tone)
+
+
+class SceneChangeDetector:
+    """
+    Decides when a step check is worth a model call. Sampled thumbnails are compared
+    with the one taken at the last check; once the view differs by threshold and has
+    then held still for debounce seconds (so the check sees the result, not the motion),
+    observe() says to check. Checks are at least min_interval apart; the caller covers
+    max_interval with a timer and calls mark_checked().
+    """
+
+    def __init__(self, threshold: float = 0.18, debounce: float = 1.5, min_interval: float = 4.0,
+                 now: float = 0.0):
+        self.threshold = threshold
+        self.debounce = debounce
+        self.min_interval = min_interval
+        self.reference: Optional[np.ndarray] = None
+        self.previous: Optional[np.ndarray] = None
+        self.still_since = now
+        self.last_check = now
+        self.samples = 0
+
+    def observe(self, thumbnail: np.ndarray, now: float) -> bool:
+        """Feed one sampled thumbnail; True if a check should run now (it is then marked as done)."""
+        self.samples += 1
+        if self.previous is None:
+            self.reference = self.previous = thumbnail
+            self.still_since = now
+            return False
+
+        if scene_distance(thumbnail, self.previous) >= self.threshold / 2:
+            self.still_since = now
+        self.previous = thumbnail
+
+        if now - self.last_check < self.min_interval or now - self.still_since < self.debounce:
+            return False
+        if self.reference is not None and scene_distance(thumbnail, self.reference) < self.threshold:
+            return False
+        self.mark_checked(now)
+        return True
+
+    def mark_checked(self, now: float):
+        """Record a check at now; the latest sample becomes the scene later frames are compared with."""
+        self.last_check = now
+        if self.previous is not None:
+            self.reference = self.previous
@@ -0,0 +1,319 @@
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from how in into is it its of on or that the this to with your you".split()
+)
+
+# Repeating a field's tokens is the usual cheap stand-in for BM25F field weights
+FIELD_WEIGHTS = {
+    "title": 3,
+    "summary": 2,
+    "objectives": 2,
+    "lessonTitles": 2,
+    "lessonBodies": 1,
+}
+
+PUBLISHED_COURSES_SELECT = "id, title, summary, meta, is_published, created_at, modules(submodules(kind, title, body))"
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_RE.findall((text or "").lower()) if token not in STOPWORDS]
+
+
+def course_document(course_row: dict, submodule_rows: list) -> dict:
+    """Searchable text and result fields for one course, from its DB rows."""
+    meta = course_row.get("meta") or {}
+    lessons = [row for row in submodule_rows if row.get("kind", "instruction") == "instruction"]
+    return {
+        "id": course_row["id"],
+        "title": course_row.get("title") or "",
+        "summary": course_row.get("summary"),
+        "createdAt": course_row.get("created_at"),
+        "published": bool(course_row.get("is_published")),
+        "fields": {
+            "title": course_row.get("title") or "",
+            "summary": course_row.get("summary") or "",
+            "objectives": " ".join(meta.get("learningObjectives") or []),
+            "lessonTitles": " ".join(row.get("title") or "" for row in lessons),
+            "lessonBodies": " ".join(row.get("body") or "" for row in lessons),
+        },
+    }
+
+
+def course_document_from_tree_row(row: dict) -> dict:
+    """course_document for a row with embedded modules(submodules(...))."""
+    submodules = [sm for module in row.get("modules") or [] for sm in module.get("submodules") or []]
+    return course_document(row, submodules)
+
+
+def fetch_published_documents(supabase, page_size: int = 100) -> List[dict]:
+    documents = []
+    start = 0
+    while True:
+        response = (
+            supabase.table("courses")
+            .select(PUBLISHED_COURSES_SELECT)
+            .eq("is_published", True)
+            .order("created_at")
+            .range(start, start + page_size - 1)
+            .execute()
+        )
+        rows = response.data or []
+        documents.extend(course_document_from_tree_row(row) for row in rows)
+        if len(rows) < page_size:
+            return documents
+        start += page_size
+
+
+def fetch_course_states(supabase, page_size: int = 1000) -> Dict[str, bool]:
+    """{course id: is_published} for every course; two narrow columns, so cheap to page through."""
+    states = {}
+    start = 0
+    while True:
+        response = (
+            supabase.table("courses")
+            .select("id, is_published")
+            .order("id")
+            .range(start, start + page_size - 1)
+            .execute()
+        )
+        rows = response.data or []
+        states.update((row["id"], bool(row.get("is_published"))) for row in rows)
+        if len(rows) < page_size:
+            return states
+        start += page_size
+
+
+def fetch_documents(supabase, course_ids: List[str], batch_size: int = 100) -> List[dict]:
+    documents = []
+    for start in range(0, len(course_ids), batch_size):
+        response = (
+            supabase.table("courses")
+            .select(PUBLISHED_COURSES_SELECT)
+            .in_("id", course_ids[start:start + batch_size])
+            .execute()
+        )
+        documents.extend(course_document_from_tree_row(row) for row in response.data or [])
+    return documents
+
+
+class SearchIndex:
+    """
+    In-memory BM25 inverted index over courses. Every course is indexed as soon as it
+    is stored; only published ones are returned. Thread-safe, updated one course at a
+    time, and snapshot to a JSON file so a restart doesn't rebuild from the database.
+    A loaded snapshot may be behind the database (other instances kept writing while
+    this one was down); reconcile() brings it up to date. Scoring holds the lock, so
+    async callers should run search() and the writers in a worker thread.
+    """
+
+    def __init__(self, snapshot_path: Optional[str] = None, k1: float = 1.2, b: float = 0.75):
+        self.snapshot_path = snapshot_path
+        self.k1 = k1
+        self.b = b
+        self._docs: Dict[str, dict] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+        # Courses restored from the snapshot and not updated since, which reconcile() checks
+        self._unverified: Set[str] = set()
+        self.dirty = False
+        self.queries = 0
+
+    @staticmethod
+    def _term_counts(document: dict) -> Dict[str, int]:
+        counts = Counter()
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(document["fields"].get(field, "")):
+                counts[token] += weight
+        return dict(counts)
+
+    def _add(self, entry: dict):
+        self._docs[entry["id"]] = entry
+        self._total_length += entry["length"]
+        for term, tf in entry["terms"].items():
+            self._postings.setdefault(term, {})[entry["id"]] = tf
+
+    def _remove(self, course_id: str):
+        entry = self._docs.pop(course_id, None)
+        if entry is None:
+            return
+        self._total_length -= entry["length"]
+        for term in entry["terms"]:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(course_id, None)
+                if not posting:
+                    del self._postings[term]
+
+    def upsert(self, document: dict):
+        terms = self._term_counts(document)
+        entry = {
+            "id": document["id"],
+            "title": document["title"],
+            "summary": document["summary"],
+            "createdAt": document["createdAt"],
+            "published": document["published"],
+            "terms": terms,
+            "length": sum(terms.values()),
+        }
+        with self._lock:
+            self._remove(document["id"])
+            self._add(entry)
+            self._unverified.discard(document["id"])
+            self.dirty = True
+
+    def set_published(self, course_id: str, published: bool) -> bool:
+        """Flip visibility without re-tokenizing; False if the course isn't indexed."""
+        with self._lock:
+            entry = self._docs.get(course_id)
+            if entry is None:
+                return False
+            entry["published"] = published
+            self._unverified.discard(course_id)
+            self.dirty = True
+            return True
+
+    def remove(self, course_id: str):
+        with self._lock:
+            self._remove(course_id)
+            self._unverified.discard(course_id)
+            self.dirty = True
+
+    def reconcile(self, states: Dict[str, bool]) -> List[str]:
+        """
+        Apply the database's {course id: is_published} to courses restored from the
+        snapshot: deleted ones are dropped, visibility is corrected. Courses written
+        here since the snapshot loaded are newer than states and left alone. Returns
+        the published courses the index lacks, for the caller to fetch and upsert.
+        """
+        with self._lock:
+            changed = 0
+            for course_id in self._unverified:
+                entry = self._docs.get(course_id)
+                if entry is None:
+                    continue
+                if course_id not in states:
+                    self._remove(course_id)
+                    changed += 1
+                elif entry["published"] != states[course_id]:
+                    entry["published"] = states[course_id]
+                    changed += 1
+            self._unverified.clear()
+            if changed:
+                self.dirty = True
+            return [course_id for course_id, published in states.items() if published and course_id not in self._docs]
+
+    def __contains__(self, course_id: str) -> bool:
+        return course_id in self._docs
+
+    @staticmethod
+    def _project(entry: dict, score: Optional[float] = None) -> dict:
+        result = {
+            "id": entry["id"],
+            "title": entry["title"],
+            "summary": entry["summary"],
+            "createdAt": entry["createdAt"],
+        }
+        if score is not None:
+            result["score"] = round(score, 4)
+        return result
+
+    def search(self, query: str, offset: int = 0, limit: int = 20) -> dict:
+        """
+        BM25-ranked published courses matching any query term. An empty query lists
+        published courses newest first, which is what the browse page shows by default.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            self.queries += 1
+            if not terms:
+                published = [entry for entry in self._docs.values() if entry["published"]]
+                published.sort(key=lambda entry: entry["createdAt"] or "", reverse=True)
+                return {
+                    "total": len(published),
+                    "results": [self._project(entry) for entry in published[offset:offset + limit]],
+                }
+
+            doc_count = len(self._docs)
+            average_length = self._total_length / doc_count if doc_count else 0.0
+            scores: Dict[str, float] = {}
+            for term in terms:
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (doc_count - len(posting) + 0.5) / (len(posting) + 0.5))
+                for course_id, tf in posting.items():
+                    entry = self._docs[course_id]
+                    if not entry["published"]:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * entry["length"] / average_length) if average_length else self.k1
+                    scores[course_id] = scores.get(course_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+            top = heapq.nlargest(offset + limit, scores.items(), key=lambda item: item[1])
+            return {
+                "total": len(scores),
+                "results": [self._project(self._docs[course_id], score) for course_id, score in top[offset:]],
+            }
+
+    def save(self):
+        """Write the snapshot atomically (temp file + rename)."""
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            payload = json.dumps({"version": SNAPSHOT_VERSION, "docs": list(self._docs.values())}, separators=(",", ":"))
+            self.dirty = False
+        directory = os.path.dirname(self.snapshot_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(payload)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def load(self) -> bool:
+        """Restore from the snapshot; postings are rebuilt from each document's term counts."""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Ignoring unreadable search snapshot {self.snapshot_path}: {str(e)}")
+            return False
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            return False
+
+        with self._lock:
+            self._docs, self._postings, self._total_length = {}, {}, 0
+            for entry in snapshot.get("docs", []):
+                self._add(entry)
+            self._unverified = set(self._docs)
+            self.dirty = False
+        logger.info(f"Loaded {len(self._docs)} courses from search snapshot")
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "courses": len(self._docs),
+                "published": sum(1 for entry in self._docs.values() if entry["published"]),
+                "terms": len(self._postings),
+                "queries": self.queries,
+                "dirty": self.dirty,
+                "snapshotPath": self.snapshot_path,
+            }
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+# The backend is a flat set of modules run from this directory (uvicorn main:app)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def main_module(tmp_path_factory):
+    """The app module, imported once with every on-disk store under a temporary directory."""
+    data = tmp_path_factory.mktemp("data")
+    os.environ.update({
+        "IMAGE_CACHE_DIR": str(data / "image-cache"),
+        "IMAGE_STORE_DIR": str(data / "images"),
+        "IMAGE_STORE_BACKEND": "local",
+        "JOB_STORE_PATH": str(data / "jobs.db"),
+        "BUNDLE_DIR": str(data / "bundles"),
+        "INGEST_SPILL_DIR": str(data / "ingest"),
+        "SEARCH_SNAPSHOT_PATH": str(data / "search-index.json"),
+    })
+    import main
+    return main
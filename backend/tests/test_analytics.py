@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+from analytics import build_course_analytics, fetch_course_stats
+
+SUBMODULES = [
+    {"submodule_id": "lesson", "learners": 4, "completed": 3, "total_tries": 6, "attempts": 0, "correct_attempts": 0},
+    {"submodule_id": "quiz", "learners": 2, "completed": 1, "total_tries": 5, "attempts": 5, "correct_attempts": 2},
+]
+QUESTIONS = [
+    {"submodule_id": "quiz", "idx": 1, "answered": 5, "correct": 1},
+    {"submodule_id": "quiz", "idx": 0, "answered": 5, "correct": 4},
+]
+
+
+def test_course_totals_and_ratios():
+    analytics = build_course_analytics("course-1", SUBMODULES, QUESTIONS)
+    assert analytics["courseId"] == "course-1"
+    assert analytics["peakLearners"] == 4
+    assert analytics["completionRate"] == round(4 / 6, 4)
+    assert analytics["averageTries"] == round(11 / 6, 4)
+    assert analytics["attempts"] == 5 and analytics["accuracy"] == 0.4
+
+
+def test_per_submodule_breakdown_with_ordered_questions():
+    lesson, quiz = build_course_analytics("course-1", SUBMODULES, QUESTIONS)["submodules"]
+    assert lesson["completionRate"] == 0.75 and lesson["averageTries"] == 1.5
+    # No attempts: no accuracy rather than a division by zero
+    assert lesson["accuracy"] is None and lesson["questions"] == []
+    assert [(q["idx"], q["accuracy"]) for q in quiz["questions"]] == [(0, 0.8), (1, 0.2)]
+
+
+def test_course_without_activity():
+    analytics = build_course_analytics("course-1", [], [])
+    assert analytics["peakLearners"] == 0 and analytics["submodules"] == []
+    assert analytics["completionRate"] is None and analytics["accuracy"] is None
+
+
+def test_fetch_reads_only_the_summary_tables():
+    tables = []
+
+    class FakeSupabase:
+        def table(self, name):
+            tables.append(name)
+            rows = {"submodule_stats": SUBMODULES, "question_stats": None}[name]
+            query = SimpleNamespace(execute=lambda: SimpleNamespace(data=rows))
+            query.eq = lambda column, value: query
+            query.select = lambda columns: query
+            return query
+
+    submodule_rows, question_rows = fetch_course_stats(FakeSupabase(), "course-1")
+    assert tables == ["submodule_stats", "question_stats"]
+    assert submodule_rows == SUBMODULES and question_rows == []
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from clients import ClientRegistry
+
+
+def test_start_builds_every_client_up_front():
+    async def run():
+        built = []
+        registry = ClientRegistry()
+        registry.override(supabase_factory=lambda: built.append("supabase") or "db",
+                          gemini_model_factory=lambda name: built.append(name) or f"model:{name}")
+        with pytest.raises(RuntimeError, match="lifespan"):
+            registry.supabase()
+
+        await registry.start(gemini_models=["image", "text", "image"])
+        try:
+            assert built == ["supabase", "image", "text"]
+            assert registry.supabase() == "db" and registry.gemini_model("text") == "model:text"
+            # Lookups only return what start() built
+            registry.supabase()
+            registry.gemini_model("image")
+            assert len(built) == 3
+            with pytest.raises(RuntimeError, match="not built"):
+                registry.gemini_model("other")
+            assert registry.stats()["gemini"]["models"] == ["image", "text"]
+        finally:
+            await registry.close()
+
+    asyncio.run(run())
+
+
+def test_missing_configuration_is_reported_at_use(monkeypatch):
+    monkeypatch.delenv("NEXT_PUBLIC_SUPABASE_URL", raising=False)
+    monkeypatch.delenv("GEMINI_API_KEY", raising=False)
+
+    async def run():
+        registry = ClientRegistry()
+        await registry.start(gemini_models=["image"])
+        try:
+            assert registry.gemini_model("image") is None
+            with pytest.raises(RuntimeError, match="SUPABASE"):
+                registry.supabase()
+        finally:
+            await registry.close()
+
+    asyncio.run(run())
+
+
+def test_override_after_start_rebuilds_right_away():
+    async def run():
+        registry = ClientRegistry()
+        await registry.start(gemini_models=["image"])
+        try:
+            registry.override(supabase_factory=lambda: "fake db", gemini_model_factory=lambda name: "fake model")
+            assert registry.supabase() == "fake db" and registry.gemini_model("image") == "fake model"
+        finally:
+            await registry.close()
+
+    asyncio.run(run())
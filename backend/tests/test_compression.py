@@ -0,0 +1,116 @@
+import asyncio
+import gzip
+import zlib
+
+import pytest
+
+import compression
+from compression import CompressionMiddleware, negotiate_encoding
+
+BODY = b'{"lesson": "' + b"weld " * 400 + b'"}'
+
+
+@pytest.fixture
+def without_brotli(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip", "gzip"),
+    ("gzip;q=0.5, deflate", "gzip"),
+    ("gzip;q=0", None),
+    ("GZIP ; q=1.0", "gzip"),
+    ("*", "gzip"),
+    ("*;q=0", None),
+    ("identity", None),
+    ("gzip;q=abc", None),
+    ("", None),
+])
+def test_negotiation_honours_q_values(without_brotli, header, expected):
+    assert negotiate_encoding(header) == expected
+
+
+def test_brotli_is_preferred_only_when_installed_and_accepted(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", object())
+    assert negotiate_encoding("gzip, br") == "br"
+    assert negotiate_encoding("gzip, br;q=0") == "gzip"
+    monkeypatch.setattr(compression, "brotli", None)
+    assert negotiate_encoding("br") is None
+
+
+def run_app(headers: list, chunks: list, status: int = 200, accept: str = "gzip", minimum_size: int = 100):
+    """Send one response through the middleware; returns (start message, joined body, body message count)."""
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        for i, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", accept.encode())]}
+    asyncio.run(CompressionMiddleware(app, minimum_size=minimum_size)(scope, receive, send))
+    start = sent[0]
+    assert start["type"] == "http.response.start"
+    return start, b"".join(message.get("body", b"") for message in sent[1:]), len(sent) - 1
+
+
+def header(start: dict, name: str):
+    values = [value.decode() for key, value in start["headers"] if key.decode().lower() == name]
+    return values[0] if values else None
+
+
+JSON = [(b"content-type", b"application/json"), (b"etag", b'"abc"')]
+
+
+def test_large_bodies_are_gzipped_with_vary_and_weak_etag(without_brotli):
+    start, body, _ = run_app(JSON + [(b"content-length", str(len(BODY)).encode())], [BODY])
+    assert header(start, "content-encoding") == "gzip"
+    assert header(start, "vary") == "Accept-Encoding"
+    assert header(start, "etag") == 'W/"abc"'
+    assert gzip.decompress(body) == BODY and int(header(start, "content-length")) == len(body)
+
+
+def test_small_bodies_and_304s_are_uncompressed_but_tagged_alike(without_brotli):
+    start, body, _ = run_app(JSON, [b"{}"])
+    assert body == b"{}" and header(start, "content-encoding") is None
+    assert header(start, "etag") == 'W/"abc"' and header(start, "vary") == "Accept-Encoding"
+
+    start, body, _ = run_app([(b"etag", b'"abc"')], [b""], status=304)
+    assert start["status"] == 304 and body == b""
+    assert header(start, "etag") == 'W/"abc"'
+
+
+def test_identity_requests_are_untouched(without_brotli):
+    start, body, _ = run_app(JSON, [BODY], accept="identity")
+    assert body == BODY and header(start, "etag") == '"abc"' and header(start, "vary") is None
+
+
+@pytest.mark.parametrize("headers", [
+    [(b"content-type", b"application/json"), (b"content-encoding", b"gzip")],
+    [(b"content-type", b"image/webp"), (b"etag", b'"img"')],
+    [(b"content-type", b"application/zip"), (b"etag", b'"zip"')],
+])
+def test_encoded_bodies_and_media_pass_through(without_brotli, headers):
+    start, body, _ = run_app(headers, [BODY])
+    # Strong ETags on media stay strong, so If-Range keeps working
+    assert body == BODY and start["headers"] == headers
+
+
+def test_event_streams_pass_through_chunk_by_chunk(without_brotli):
+    chunks = [b"event: course\ndata: {}\n\n", b"event: done\ndata: {}\n\n"]
+    start, body, messages = run_app([(b"content-type", b"text/event-stream")], chunks, minimum_size=1)
+    assert body == b"".join(chunks) and messages == 2
+    assert header(start, "content-encoding") is None
+
+
+def test_streamed_bodies_are_compressed_per_chunk(without_brotli):
+    chunks = [BODY[:500], BODY[500:1000], BODY[1000:]]
+    start, body, messages = run_app([(b"content-type", b"application/json"), (b"content-length", b"9")], chunks)
+    assert header(start, "content-encoding") == "gzip" and header(start, "content-length") is None
+    assert messages == 3 and zlib.decompress(body, 16 + zlib.MAX_WBITS) == BODY
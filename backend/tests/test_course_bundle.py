@@ -0,0 +1,66 @@
+import io
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from course_bundle import BundleError, BundleStore, bundle_image_name, image_urls, read_bundle
+
+PNG = b"\x89PNG" + b"\x00" * 64
+
+
+def make_course():
+    lesson = {"title": "Lesson", "content": {"text": "Text", "aiGeneratedImage": "https://img/a.png", "thumbnailUrl": "t"}}
+    shared = {"title": "Same picture", "content": {"text": "Text", "aiGeneratedImage": "https://img/a.png"}}
+    placeholder = {"title": "Placeholder", "content": {"text": "Text", "aiGeneratedImage": "https://placehold.co/x"}}
+    return {"name": "Course", "modules": [{"title": "Module", "subModules": [lesson, shared, placeholder]}]}
+
+
+def test_round_trip_stores_shared_images_once(tmp_path):
+    store = BundleStore(str(tmp_path))
+    course = make_course()
+    path = store.write("course-1", course, {"https://img/a.png": PNG})
+
+    with open(path, "rb") as f:
+        data = f.read()
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.getinfo(f"images/{bundle_image_name(PNG)}").compress_type == zipfile.ZIP_STORED
+
+    restored, images = read_bundle(data)
+    lessons = restored["modules"][0]["subModules"]
+    assert lessons[0]["content"]["aiGeneratedImage"] == f"images/{bundle_image_name(PNG)}"
+    assert "thumbnailUrl" not in lessons[0]["content"]
+    assert lessons[2]["content"]["aiGeneratedImage"] == "https://placehold.co/x"
+    assert list(images.values()) == [PNG]
+    # The caller's course is left untouched
+    assert image_urls(course) == {"https://img/a.png", "https://placehold.co/x"}
+
+
+def test_concurrent_writes_of_one_bundle(tmp_path):
+    store = BundleStore(str(tmp_path))
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda _: store.write("course-1", make_course(), {"https://img/a.png": PNG}), range(16)))
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["course-1.zip"]
+
+
+def test_store_refuses_path_like_ids(tmp_path):
+    store = BundleStore(str(tmp_path))
+    assert store.path_for("../etc") is None
+    assert store.path_for(".hidden") is None
+    assert not store.exists("../course-1")
+
+
+@pytest.mark.parametrize("data", [b"not a zip", b""])
+def test_read_bundle_rejects_non_zip(data):
+    with pytest.raises(BundleError):
+        read_bundle(data)
+
+
+def test_read_bundle_rejects_wrong_format_and_oversized():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("manifest.json", '{"format": 99, "course": {}}')
+    with pytest.raises(BundleError, match="Unsupported"):
+        read_bundle(buffer.getvalue())
+    with pytest.raises(BundleError, match="unpacks"):
+        read_bundle(buffer.getvalue(), max_unpacked=4)
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from course_document import CourseDocumentError, parse_course_document, parse_json_object, repair_json, validate_course
+
+COURSE = {
+    "name": "Welding Safety",
+    "learningObjectives": ["Wear PPE"],
+    "modules": [
+        {
+            "title": "Protective equipment",
+            "subModules": [{"title": "Helmets", "content": {"text": "Use a shade 10 lens."}}],
+            "quiz": {"questions": [{"question": "Lens shade?", "options": ["3", "10"], "correctAnswer": 1}]},
+        }
+    ],
+}
+
+
+def test_repair_json_drops_trailing_commas_and_trailing_text():
+    text = '```json\n{"a": [1, 2,], "b": {"c": "}",},}\n```\nHope this helps!'
+    repaired, truncated = repair_json(text, text.index("{"))
+    assert json.loads(repaired) == {"a": [1, 2], "b": {"c": "}"}} and not truncated
+
+
+@pytest.mark.parametrize("cut, expected", [
+    ('{"a": [1, 2], "b": "unfinished str', {"a": [1, 2]}),
+    ('{"a": [1, 2], "b":', {"a": [1, 2]}),
+    ('{"a": [1, 2], "b', {"a": [1, 2]}),
+    ('{"a": [{"x": 1}, {"x": 12', {"a": [{"x": 1}, {}]}),
+    ('{"a": [1, 2', {"a": [1]}),
+])
+def test_repair_json_cuts_back_to_the_last_complete_value(cut, expected):
+    repaired, truncated = repair_json(cut)
+    assert truncated and json.loads(repaired) == expected
+
+
+def test_repair_json_rejects_unbalanced_and_empty_input():
+    with pytest.raises(CourseDocumentError):
+        repair_json('{"a": [1}')
+    with pytest.raises(CourseDocumentError):
+        repair_json("   ")
+
+
+def test_parse_json_object():
+    assert parse_json_object('Sure: {"a": 1,}') == {"a": 1}
+    assert parse_json_object("no object here") is None
+    assert parse_json_object("[1, 2]") is None
+
+
+def test_validate_course_fills_defaults_and_keeps_unknown_fields():
+    course = validate_course({**COURSE, "audience": "apprentices"})
+    assert course["audience"] == "apprentices"
+    assert course["modules"][0]["isSafetyCheck"] is False
+    assert "finalAssessment" not in course
+
+
+def test_validate_course_prunes_invalid_items_only_when_asked():
+    data = json.loads(json.dumps(COURSE))
+    data["modules"][0]["quiz"]["questions"].append({"question": "Bad", "options": ["a", "b"], "correctAnswer": 5})
+    with pytest.raises(CourseDocumentError, match="correctAnswer"):
+        validate_course(json.loads(json.dumps(data)))
+    assert len(validate_course(data, prune=True)["modules"][0]["quiz"]["questions"]) == 1
+
+    with pytest.raises(CourseDocumentError):
+        validate_course({"name": "No modules", "modules": []}, prune=True)
+
+
+def test_parse_course_document():
+    course, repaired = parse_course_document("Here you go:\n" + json.dumps(COURSE) + "\nEnjoy")
+    assert course["name"] == "Welding Safety" and not repaired
+
+    # Output cut off mid-lesson keeps the complete modules and drops the unfinished part
+    text = json.dumps(COURSE)[:-3]
+    course, repaired = parse_course_document(text)
+    assert repaired and course["modules"][0]["subModules"][0]["title"] == "Helmets"
+
+    with pytest.raises(CourseDocumentError, match="No JSON object"):
+        parse_course_document("I can't help with that.")
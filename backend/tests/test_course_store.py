@@ -0,0 +1,129 @@
+from types import SimpleNamespace
+
+import pytest
+
+from course_store import build_course_rows, insert_course_rows
+
+COURSE = {
+    "name": "Welding Safety",
+    "learningObjectives": ["Wear PPE"],
+    "modules": [
+        {
+            "title": "Protective equipment",
+            "subModules": [
+                {"title": "Helmets", "content": {"text": "Shade 10.", "aiGeneratedImage": "/api/images/a.webp"}},
+                {"title": "Gloves", "content": {"text": "Leather."}},
+            ],
+            "quiz": {"questions": [
+                {"question": "Lens shade?", "options": ["3", "10"], "correctAnswer": 1},
+                {"question": "Glove material?", "options": ["Leather", "Cotton"], "correctAnswer": 0},
+            ]},
+        },
+        {"title": "Ventilation", "subModules": [{"title": "Fumes"}]},
+    ],
+}
+
+
+class FakeQuery:
+    def __init__(self, client, table: str):
+        self.client = client
+        self.table = table
+        self.call = None
+
+    def insert(self, rows):
+        self.call = ("insert", self.table, rows)
+        return self
+
+    def delete(self):
+        self.call = ("delete", self.table, None)
+        return self
+
+    def eq(self, column, value):
+        self.call = self.call + ((column, value),)
+        return self
+
+    def execute(self):
+        self.client.calls.append(self.call)
+        if self.call[:2] == self.client.fail_on:
+            raise RuntimeError(f"insert into {self.table} failed")
+        rows = self.call[2]
+        return SimpleNamespace(data=[rows] if isinstance(rows, dict) else rows)
+
+
+class FakeSupabase:
+    """Records every executed request; fail_on=("insert", table) makes that insert raise."""
+
+    def __init__(self, fail_on=None):
+        self.calls = []
+        self.fail_on = fail_on
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+
+def test_rows_link_every_level_with_client_side_ids():
+    rows = build_course_rows(COURSE)
+    course = rows["course"]
+    assert course["title"] == "Welding Safety" and not course["is_published"]
+    assert course["meta"]["learningObjectives"] == ["Wear PPE"]
+
+    assert [(m["idx"], m["title"]) for m in rows["modules"]] == [(0, "Protective equipment"), (1, "Ventilation")]
+    assert all(m["course_id"] == course["id"] for m in rows["modules"])
+
+    first, second = (m["id"] for m in rows["modules"])
+    assert [(s["module_id"], s["idx"], s["kind"]) for s in rows["submodules"]] == [
+        (first, 0, "instruction"), (first, 1, "instruction"), (first, 2, "quiz"), (second, 0, "instruction"),
+    ]
+    assert rows["submodules"][0]["image_url"] == "/api/images/a.webp"
+    assert rows["submodules"][3]["body"] == ""
+
+    quiz_id = rows["submodules"][2]["id"]
+    assert [(q["submodule_id"], q["idx"], q["answer"]) for q in rows["quiz_questions"]] == [
+        (quiz_id, 0, "1"), (quiz_id, 1, "0"),
+    ]
+    ids = [course["id"]] + [row["id"] for table in ("modules", "submodules", "quiz_questions") for row in rows[table]]
+    assert len(set(ids)) == len(ids)
+
+
+@pytest.mark.parametrize("course, message", [
+    ({"modules": [{"title": "M"}]}, "name"),
+    ({"name": "C", "modules": []}, "modules"),
+    ({"name": "C", "modules": [{"subModules": []}]}, "Module 0"),
+    ({"name": "C", "modules": [{"title": "M", "subModules": [{"title": ""}]}]}, "Submodule 0"),
+])
+def test_incomplete_courses_are_rejected(course, message):
+    with pytest.raises(ValueError, match=message):
+        build_course_rows(course)
+
+
+def test_one_insert_per_table():
+    supabase = FakeSupabase()
+    rows = build_course_rows(COURSE)
+    timed_names = []
+
+    class Timed:
+        def __init__(self, name):
+            timed_names.append(name)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+    course = insert_course_rows(supabase, rows, timed=Timed)
+    assert course == rows["course"]
+    assert [(kind, table) for kind, table, _ in supabase.calls] == [
+        ("insert", "courses"), ("insert", "modules"), ("insert", "submodules"), ("insert", "quiz_questions"),
+    ]
+    assert supabase.calls[2][2] == rows["submodules"]
+    assert timed_names == ["db.courses", "db.modules", "db.submodules", "db.quiz_questions"]
+
+
+def test_failed_insert_deletes_the_course_row():
+    supabase = FakeSupabase(fail_on=("insert", "submodules"))
+    rows = build_course_rows(COURSE)
+    with pytest.raises(RuntimeError, match="submodules"):
+        insert_course_rows(supabase, rows)
+    assert supabase.calls[-1] == ("delete", "courses", None, ("id", rows["course"]["id"]))
+    assert ("insert", "quiz_questions") not in [call[:2] for call in supabase.calls]
@@ -0,0 +1,69 @@
+import json
+
+from course_stream import CourseStreamParser, course_event
+
+COURSE = {
+    "name": "Welding \"Safety\" \\ basics",
+    "learningObjectives": ["Wear PPE", "Ventilate"],
+    "modules": [
+        {
+            "title": "Protective equipment",
+            "isSafetyCheck": True,
+            "subModules": [{"title": "Helmets", "content": {"text": "Shade {10} lens, [not] 3."}}],
+            "quiz": {"questions": [{"question": "Lens?", "options": ["3", "10"], "correctAnswer": 1}]},
+        }
+    ],
+    "finalAssessment": {"title": "Weld a bead", "arInstructions": []},
+}
+
+
+def feed_in_chunks(text: str, size: int):
+    parser = CourseStreamParser()
+    completed = []
+    for i in range(0, len(text), size):
+        completed.extend(parser.feed(text[i:i + size]))
+    return parser, completed
+
+
+def test_result_matches_json_loads_for_any_chunking():
+    text = "```json\n" + json.dumps(COURSE, indent=2) + "\n```"
+    for size in (1, 2, 7, 64, len(text)):
+        parser, _ = feed_in_chunks(text, size)
+        assert parser.done and parser.result() == COURSE
+        assert parser.text == text
+
+
+def test_completed_values_arrive_in_document_order():
+    parser, completed = feed_in_chunks(json.dumps(COURSE), 5)
+    paths = [path for path, _ in completed]
+    assert paths.index(("name",)) < paths.index(("learningObjectives",)) < paths.index(("modules", 0, "title"))
+    assert paths[-1] == ()
+    values = dict(completed)
+    assert values[("name",)] == COURSE["name"]
+    assert values[("modules", 0, "subModules", 0)] == COURSE["modules"][0]["subModules"][0]
+    # Emitted containers are the same objects as the ones in the result
+    assert values[("modules", 0, "quiz")] is parser.result()["modules"][0]["quiz"]
+
+
+def test_parser_stops_at_the_end_of_the_top_level_object():
+    parser = CourseStreamParser()
+    parser.feed('{"name": "A", "modules": []} trailing {"name": "B"}')
+    assert parser.done and parser.result() == {"name": "A", "modules": []}
+
+
+def test_unfinished_document_has_no_result():
+    parser = CourseStreamParser()
+    completed = parser.feed('{"name": "A", "modules": [{"title": "M1"')
+    assert not parser.done and parser.result() is None
+    assert [path for path, _ in completed] == [("name",), ("modules", 0, "title")]
+
+
+def test_course_event_maps_document_paths():
+    lesson = {"title": "Helmets"}
+    assert course_event(("name",), "A") == ("course", {"name": "A"})
+    assert course_event(("learningObjectives",), ["x"]) == ("objectives", {"learningObjectives": ["x"]})
+    assert course_event(("modules", 2, "title"), "M3") == ("module", {"moduleIndex": 2, "title": "M3"})
+    assert course_event(("modules", 0, "subModules", 1), lesson) == (
+        "lesson", {"moduleIndex": 0, "lessonIndex": 1, "lesson": lesson})
+    assert course_event(("modules", 0, "subModules", 1, "title"), "Helmets") is None
+    assert course_event((), {}) is None
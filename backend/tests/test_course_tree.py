@@ -0,0 +1,154 @@
+import copy
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+from course_tree import COURSE_TREE_SELECT, build_course_tree, etag_matches, serialize_course_tree
+from memory_cache import MemoryCache
+
+ROW = {
+    "id": "course-1",
+    "title": "Welding Safety",
+    "summary": "Generated course: Welding Safety",
+    "meta": {"learningObjectives": ["Wear PPE"]},
+    "is_published": False,
+    "created_at": "2025-01-01T00:00:00Z",
+    "modules": [
+        {"id": "m2", "idx": 1, "title": "Ventilation", "submodules": [
+            {"id": "s3", "idx": 0, "kind": "instruction", "title": "Fumes", "body": None, "image_url": None},
+        ]},
+        {"id": "m1", "idx": 0, "title": "Protective equipment", "submodules": [
+            {"id": "q1", "idx": 2, "kind": "quiz", "title": "Quiz", "quiz_questions": [
+                {"id": "qq2", "idx": 1, "prompt": "Gloves?", "options": ["Leather", "Cotton"], "answer": "0"},
+                {"id": "qq1", "idx": 0, "prompt": "Lens?", "options": ["3", "10"], "answer": "bad"},
+            ]},
+            {"id": "s2", "idx": 1, "kind": "instruction", "title": "Gloves", "body": "Leather.", "image_url": None},
+            {"id": "s1", "idx": 0, "kind": "instruction", "title": "Helmets", "body": "Shade 10.",
+             "image_url": "/api/images/a.webp"},
+        ]},
+    ],
+}
+
+
+class FakeCourses:
+    """The courses table as the tree endpoint and publishing use it: nested select and update by id."""
+
+    def __init__(self, row: dict):
+        self.rows = {row["id"]: copy.deepcopy(row)}
+        self.selects = []
+        self._query = None
+
+    def table(self, name: str):
+        assert name == "courses"
+        return self
+
+    def select(self, columns: str):
+        self.selects.append(columns)
+        self._query = ("select", None)
+        return self
+
+    def update(self, values: dict):
+        self._query = ("update", values)
+        return self
+
+    def eq(self, column: str, value):
+        kind, values = self._query
+        self._query = (kind, values, value)
+        return self
+
+    def execute(self):
+        kind, values, course_id = self._query
+        row = self.rows.get(course_id)
+        if row is not None and kind == "update":
+            row.update(values)
+        return SimpleNamespace(data=[copy.deepcopy(row)] if row is not None else [])
+
+
+def placeholder(title: str) -> str:
+    return f"placeholder:{title}"
+
+
+def test_nested_row_maps_to_the_course_shape():
+    tree = build_course_tree(copy.deepcopy(ROW), placeholder)
+    assert tree["name"] == "Welding Safety" and tree["isPublished"] is False
+    assert [module["title"] for module in tree["modules"]] == ["Protective equipment", "Ventilation"]
+
+    first = tree["modules"][0]
+    assert [lesson["id"] for lesson in first["subModules"]] == ["s1", "s2"]
+    assert first["subModules"][0]["content"] == {"text": "Shade 10.", "aiGeneratedImage": "/api/images/a.webp"}
+    assert first["subModules"][1]["content"]["aiGeneratedImage"] == "placeholder:Gloves"
+    assert [(q["id"], q["correctAnswer"]) for q in first["quiz"]["questions"]] == [("qq1", None), ("qq2", 0)]
+    assert first["quiz"]["id"] == "q1" and tree["modules"][1]["quiz"] is None
+    assert tree["modules"][1]["subModules"][0]["content"]["text"] == ""
+    assert tree["finalAssessment"]["title"] == "Final Assessment"
+
+
+def test_etag_matching():
+    entry = serialize_course_tree({"id": "course-1"})
+    etag = entry["etag"]
+    assert etag.startswith('"') and etag == serialize_course_tree({"id": "course-1"})["etag"]
+    assert etag != serialize_course_tree({"id": "course-2"})["etag"]
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag) and not etag_matches('"other"', etag)
+
+
+def test_memory_cache_lru_ttl_and_invalidation(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("memory_cache.time.monotonic", lambda: now[0])
+    cache = MemoryCache(max_entries=2, ttl_seconds=10)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1
+
+    now[0] = 11
+    assert cache.get("a") is None
+    cache.put("d", 4)
+    cache.invalidate("d")
+    cache.invalidate("missing")
+    assert cache.get("d") is None and cache.stats()["invalidations"] == 1
+
+
+@pytest.fixture
+def tree_app(main_module, monkeypatch):
+    db = FakeCourses(ROW)
+    monkeypatch.setattr(main_module.clients, "_supabase", db)
+    monkeypatch.setattr(main_module, "course_bundle_task", lambda course_id: None)
+    main_module.invalidate_course_caches(ROW["id"])
+    return main_module, db, TestClient(main_module.app)
+
+
+def test_tree_is_one_query_then_cached_and_revalidated(tree_app):
+    main, db, client = tree_app
+    response = client.get("/api/course/course-1/tree")
+    assert response.status_code == 200 and response.json()["name"] == "Welding Safety"
+    etag = response.headers["etag"]
+    assert db.selects == [COURSE_TREE_SELECT]
+
+    revalidated = client.get("/api/course/course-1/tree", headers={"if-none-match": etag})
+    assert revalidated.status_code == 304 and revalidated.headers["etag"] == etag
+    assert revalidated.content == b""
+    assert db.selects == [COURSE_TREE_SELECT]
+
+    assert client.get("/api/course/missing/tree").status_code == 404
+
+
+def test_publish_and_store_change_the_etag(tree_app):
+    main, db, client = tree_app
+    etag = client.get("/api/course/course-1/tree").headers["etag"]
+
+    response = client.post("/api/course/publish", json={"courseId": "course-1"})
+    assert response.status_code == 200
+    published = client.get("/api/course/course-1/tree", headers={"if-none-match": etag})
+    assert published.status_code == 200 and published.json()["isPublished"] is True
+    assert published.headers["etag"] != etag
+
+    # Storing writes through invalidate_course_caches, as every course write does
+    db.rows["course-1"]["title"] = "Welding Safety, revised"
+    main.invalidate_course_caches("course-1")
+    stored = client.get("/api/course/course-1/tree", headers={"if-none-match": published.headers["etag"]})
+    assert stored.status_code == 200 and stored.json()["name"] == "Welding Safety, revised"
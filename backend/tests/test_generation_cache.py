@@ -0,0 +1,177 @@
+import asyncio
+
+import pytest
+
+from generation_cache import GenerationCache
+
+
+def make_value(name: str = "course"):
+    return {"name": name, "modules": []}, "raw", {"input_tokens": 10, "output_tokens": 20}
+
+
+def test_make_key_normalizes_prompt_and_tracks_template():
+    key = GenerationCache.make_key("Intro  to Python", "claude", "template")
+    assert key == GenerationCache.make_key("intro to python ", "claude", "template")
+    assert key != GenerationCache.make_key("intro to python", "claude", "template v2")
+
+
+def test_hits_return_copies_and_count_saved_tokens():
+    async def run():
+        cache = GenerationCache(ttl_seconds=60, max_entries=4)
+
+        async def generate():
+            return make_value()
+
+        first, source = await cache.get_or_generate("key", generate)
+        assert source == "miss"
+        first[0]["name"] = "changed by the caller"
+
+        second, source = await cache.get_or_generate("key", generate)
+        assert source == "hit" and second[0]["name"] == "course"
+        assert cache.stats()["savedOutputTokens"] == 20
+
+    asyncio.run(run())
+
+
+def test_should_cache_false_is_not_stored():
+    async def run():
+        cache = GenerationCache(ttl_seconds=60, max_entries=4)
+
+        async def generate():
+            return None, "incomplete", {}
+
+        await cache.get_or_generate("key", generate, should_cache=lambda value: value[0] is not None)
+        assert cache.get("key") is None
+
+    asyncio.run(run())
+
+
+def test_first_caller_leaving_does_not_fail_coalesced_callers():
+    async def run():
+        cache = GenerationCache(ttl_seconds=60, max_entries=4)
+        release = asyncio.Event()
+        runs = []
+
+        async def generate():
+            runs.append(1)
+            await release.wait()
+            return make_value()
+
+        first = asyncio.create_task(cache.get_or_generate("key", generate))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(cache.get_or_generate("key", generate))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+        release.set()
+        value, source = await second
+        assert source == "coalesced" and value[0]["name"] == "course"
+        assert len(runs) == 1 and cache.get("key") is not None
+
+    asyncio.run(run())
+
+
+def test_generation_is_cancelled_when_every_caller_leaves():
+    async def run():
+        cache = GenerationCache(ttl_seconds=60, max_entries=4)
+        cancelled = asyncio.Event()
+
+        async def generate():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        caller = asyncio.create_task(cache.get_or_generate("key", generate))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert cache.stats()["inflight"] == 0
+
+        # A later request starts a fresh generation instead of joining the cancelled one
+        async def quick():
+            return make_value()
+
+        assert (await cache.get_or_generate("key", quick))[1] == "miss"
+
+    asyncio.run(run())
+
+
+def test_failure_reaches_every_caller():
+    async def run():
+        cache = GenerationCache(ttl_seconds=60, max_entries=4)
+
+        async def generate():
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream failed")
+
+        results = await asyncio.gather(
+            cache.get_or_generate("key", generate), cache.get_or_generate("key", generate), return_exceptions=True
+        )
+        assert all(isinstance(result, ValueError) for result in results)
+        assert cache.stats()["inflight"] == 0
+
+    asyncio.run(run())
+
+
+def test_events_reach_every_caller_and_late_joiners_catch_up():
+    async def run():
+        cache = GenerationCache(ttl_seconds=60, max_entries=4)
+        step = asyncio.Event()
+        first_events, second_events, hit_events = [], [], []
+
+        async def generate():
+            await cache.publish("key", "course", {"name": "course"})
+            await step.wait()
+            await cache.publish("key", "module", {"moduleIndex": 0})
+            return make_value()
+
+        async def slow_listener(event, data):
+            await asyncio.sleep(0)
+            second_events.append(event)
+
+        first = asyncio.create_task(cache.get_or_generate("key", generate, on_event=lambda e, d: first_events.append(e)))
+        await asyncio.sleep(0.01)
+        assert first_events == ["course"]
+
+        # Joins after "course" was published: gets it first, then the live "module"
+        second = asyncio.create_task(cache.get_or_generate("key", generate, on_event=slow_listener))
+        await asyncio.sleep(0.01)
+        assert second_events == ["course"]
+        step.set()
+        assert (await first)[1] == "miss" and (await second)[1] == "coalesced"
+        assert first_events == second_events == ["course", "module"]
+
+        assert (await cache.get_or_generate("key", generate, on_event=lambda e, d: hit_events.append(e)))[1] == "hit"
+        assert hit_events == []
+        # Publishing with nothing in flight is a no-op
+        await cache.publish("key", "late", {})
+
+    asyncio.run(run())
+
+
+def test_failing_listener_is_dropped_without_failing_the_generation():
+    async def run():
+        cache = GenerationCache(ttl_seconds=60, max_entries=4)
+        received = []
+
+        async def generate():
+            await asyncio.sleep(0)
+            await cache.publish("key", "course", {})
+            await cache.publish("key", "module", {})
+            return make_value()
+
+        def broken(event, data):
+            raise RuntimeError("client went away")
+
+        results = await asyncio.gather(
+            cache.get_or_generate("key", generate, on_event=broken),
+            cache.get_or_generate("key", generate, on_event=lambda e, d: received.append(e)),
+        )
+        assert [source for _, source in results] == ["miss", "coalesced"]
+        assert received == ["course", "module"]
+
+    asyncio.run(run())
@@ -0,0 +1,233 @@
+import asyncio
+import copy
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from model_router import ModelRouter
+
+LESSONS = [{"title": f"Lesson {i}", "content": {"text": f"Text {i}", "aiGeneratedImage": "placeholder"}} for i in range(3)]
+COURSE = {
+    "name": "Welding",
+    "learningObjectives": ["Weld safely"],
+    "modules": [{"title": "Basics", "subModules": LESSONS}],
+    "finalAssessment": {"title": "Weld a bead"},
+}
+
+
+class FakeImageModel:
+    """Stands in for the Gemini image model: records concurrency and returns a PNG payload."""
+
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+        self.calls = 0
+        self.started = threading.Event()
+
+    def generate_content(self, prompt):
+        with self.lock:
+            self.calls += 1
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        self.started.set()
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+        part = SimpleNamespace(inline_data=SimpleNamespace(data=b"png"))
+        return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+
+
+@pytest.fixture
+def pipeline(main_module, monkeypatch):
+    """The app module with images stored inline and no image cache or lesson reuse."""
+    model = FakeImageModel()
+    monkeypatch.setattr(main_module, "image_pipeline", None)
+    monkeypatch.setattr(main_module, "image_cache", None)
+    monkeypatch.setattr(main_module, "lesson_index", None)
+    monkeypatch.setattr(main_module.clients, "gemini_model", lambda name: model)
+    return main_module, model
+
+
+def lesson(i: int) -> dict:
+    return {"title": f"Lesson {i}", "content": {"text": f"Text {i}", "aiGeneratedImage": "placeholder"}}
+
+
+def test_image_batch_respects_the_concurrency_bound(pipeline, monkeypatch):
+    main, model = pipeline
+    monkeypatch.setattr(main, "IMAGE_GEN_CONCURRENCY", 2)
+
+    async def run():
+        notified = []
+        batch = main.LessonImageBatch(model, on_image=lambda m, l, content: notified.append((m, l)))
+        lessons = [lesson(i) for i in range(6)]
+        assert all(batch.add(0, i, item) for i, item in enumerate(lessons))
+        # Lessons that already have an image aren't generated again
+        assert not batch.add(1, 0, {"content": {"aiGeneratedImage": "/api/images/x.webp"}})
+        await batch.wait()
+        return lessons, notified
+
+    lessons, notified = asyncio.run(run())
+    assert model.calls == 6 and model.peak == 2
+    assert sorted(notified) == [(0, i) for i in range(6)]
+    assert all(item["content"]["aiGeneratedImage"].startswith("data:image/png;base64,") for item in lessons)
+
+
+def test_image_batch_deadline_falls_back_to_the_failure_image(pipeline, monkeypatch):
+    main, model = pipeline
+    model.delay = 0.5
+    monkeypatch.setattr(main, "IMAGE_GEN_TOTAL_TIMEOUT", 0.05)
+
+    async def run():
+        batch = main.LessonImageBatch(model)
+        item = lesson(0)
+        batch.add(0, 0, item)
+        await batch.wait()
+        return item
+
+    assert asyncio.run(run())["content"]["aiGeneratedImage"] == main.FAILED_IMAGE_URL
+
+
+def test_images_start_while_the_text_is_still_streaming(pipeline, monkeypatch):
+    main, model = pipeline
+    text = json.dumps(COURSE)
+    first_lesson_end = text.index('"Lesson 1"')
+    image_started_mid_stream = []
+
+    async def fake_stream(prompt, usage):
+        yield text[:first_lesson_end]
+        # Hold the rest of the text back until the first lesson's image is under way
+        image_started_mid_stream.append(await asyncio.to_thread(model.started.wait, 5))
+        yield text[first_lesson_end:]
+        usage["output_tokens"] = 100
+
+    monkeypatch.setattr(main, "stream_course_text", fake_stream)
+    events = []
+
+    async def run():
+        return await main.generate_course_single("welding", on_event=lambda event, data: events.append(event))
+
+    course, raw, usage = asyncio.run(run())
+    assert image_started_mid_stream == [True]
+    assert raw == text and usage == {"output_tokens": 100}
+    names = events
+    assert names.index("image") > names.index("lesson") and names.count("image") == 3
+    assert all(item["content"]["aiGeneratedImage"].startswith("data:image/png") for item in course["modules"][0]["subModules"])
+
+
+OUTLINE = {
+    "name": "Welding",
+    "learningObjectives": ["Weld safely"],
+    "modules": [{"title": f"Module {i}", "lessons": [f"Lesson {i}"]} for i in range(3)],
+    "finalAssessment": {"title": "Weld a bead"},
+}
+
+
+def fake_completions(outline_failures: dict = None, delays: dict = None):
+    """complete_model_text stand-in: the outline, then each module (later ones finish first)."""
+    outline_failures = outline_failures or {}
+    delays = delays or {"Module 0": 0.06, "Module 1": 0.03, "Module 2": 0.0}
+    calls = []
+
+    async def complete(model, text, max_tokens=4000):
+        calls.append(model)
+        if "course outline" in text:
+            if model in outline_failures:
+                raise outline_failures[model]
+            return json.dumps(OUTLINE), {"input_tokens": 10, "output_tokens": 20}
+        title = next(m["title"] for m in OUTLINE["modules"] if f'"{m["title"]}"' in text)
+        await asyncio.sleep(delays[title])
+        body = {
+            "subModules": [{"title": f"{title} lesson", "content": {"text": "Body", "aiGeneratedImage": "placeholder"}}],
+            "quiz": {"questions": [{"question": "Q?", "options": ["a", "b"], "correctAnswer": 0}]},
+        }
+        return json.dumps(body), {"input_tokens": 1, "output_tokens": 2}
+
+    return complete, calls
+
+
+def test_fanout_merges_modules_in_outline_order(pipeline, monkeypatch):
+    main, model = pipeline
+    complete, calls = fake_completions()
+    monkeypatch.setattr(main, "complete_model_text", complete)
+    monkeypatch.setattr(main, "text_router", ModelRouter(["text-a"], hedge_enabled=False))
+    events = []
+
+    course, raw, usage = asyncio.run(main.generate_course_fanout(
+        "welding", on_event=lambda event, data: events.append((event, data)), module_count=3, lessons_per_module=1,
+    ))
+    assert [module["title"] for module in course["modules"]] == ["Module 0", "Module 1", "Module 2"]
+    assert [module["subModules"][0]["title"] for module in course["modules"]] == [
+        "Module 0 lesson", "Module 1 lesson", "Module 2 lesson"]
+    assert all(module["quiz"]["questions"] for module in course["modules"])
+    assert usage == {"input_tokens": 13, "output_tokens": 26} and calls.count("text-a") == 4
+    # Module lessons were announced as they landed: the fastest module first
+    lesson_modules = [data["moduleIndex"] for event, data in events if event == "lesson"]
+    assert lesson_modules == [2, 1, 0]
+    assert [event for event, _ in events].count("image") == 3
+
+
+def test_fanout_outline_falls_back_to_the_next_model(pipeline, monkeypatch):
+    main, model = pipeline
+    complete, calls = fake_completions(outline_failures={"text-a": RuntimeError("overloaded")})
+    monkeypatch.setattr(main, "complete_model_text", complete)
+    router = ModelRouter(["text-a", "text-b"], hedge_enabled=False)
+    monkeypatch.setattr(main, "text_router", router)
+
+    course, _, _ = asyncio.run(main.generate_course_fanout("welding", module_count=3, lessons_per_module=1))
+    assert len(course["modules"]) == 3
+    assert calls[:2] == ["text-a", "text-b"] and router.fallbacks >= 1
+
+
+def test_fanout_gives_up_on_an_unusable_outline(pipeline, monkeypatch):
+    main, model = pipeline
+
+    async def complete(model_name, text, max_tokens=4000):
+        return "I can't outline that.", {"output_tokens": 5}
+
+    monkeypatch.setattr(main, "complete_model_text", complete)
+    monkeypatch.setattr(main, "text_router", ModelRouter(["text-a"], hedge_enabled=False))
+    course, raw, usage = asyncio.run(main.generate_course_fanout("welding"))
+    assert course is None and raw == "I can't outline that." and usage == {"output_tokens": 5}
+    assert model.calls == 0
+
+
+def test_coalesced_streaming_callers_both_get_live_events(main_module, monkeypatch):
+    main = main_module
+    release = asyncio.Event()
+    runs = []
+
+    async def fake_generate(prompt, on_event=None, **options):
+        runs.append(prompt)
+        await main.emit_event(on_event, "course", {"name": "Welding"})
+        await release.wait()
+        await main.emit_event(on_event, "module", {"moduleIndex": 0, "title": "Basics"})
+        return copy.deepcopy(COURSE), json.dumps(COURSE), {"output_tokens": 50}
+
+    monkeypatch.setattr(main, "generate_course", fake_generate)
+    main.generation_cache.invalidate(main.generation_cache_key("coalesced streams", {"mode": None}))
+
+    async def read(stream, seen: list):
+        async for chunk in stream:
+            seen.append(chunk.split("\n", 1)[0])
+        return seen
+
+    async def run():
+        options = {"mode": None}
+        first_seen, second_seen = [], []
+        first = asyncio.create_task(read(main.stream_course_events("coalesced streams", dict(options)), first_seen))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(read(main.stream_course_events("coalesced streams", dict(options)), second_seen))
+        await asyncio.sleep(0.01)
+        # The second stream isn't silent while the shared generation runs
+        assert first_seen == second_seen == ["event: course"]
+        release.set()
+        return await first, await second
+
+    first_seen, second_seen = asyncio.run(run())
+    assert first_seen == second_seen == ["event: course", "event: module", "event: done"]
+    assert runs == ["coalesced streams"]
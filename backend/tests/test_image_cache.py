@@ -0,0 +1,107 @@
+import asyncio
+import itertools
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import image_cache
+from image_cache import ImageCache
+
+
+@pytest.fixture(autouse=True)
+def ticking_clock(monkeypatch):
+    """Every access gets a distinct, increasing time, so LRU order is deterministic."""
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(image_cache, "time", SimpleNamespace(time=lambda: float(next(ticks))))
+
+
+def cached_files(cache: ImageCache) -> set:
+    return {
+        name for _, _, names in os.walk(cache.directory) for name in names
+        if name != "index.db" and not name.startswith("index.db")
+    }
+
+
+def test_make_key_normalizes_prompt_and_tracks_model():
+    key = ImageCache.make_key("A  Welding Helmet", "image-model")
+    assert key == ImageCache.make_key("a welding helmet ", "image-model")
+    assert key != ImageCache.make_key("a welding helmet", "other-model")
+
+
+def test_evicts_least_recently_used_by_byte_budget(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=300)
+    for key in ("a", "b", "c"):
+        cache.put(key, key.encode() * 100)
+    assert cache.get("a") == b"a" * 100
+
+    cache.put("d", b"d" * 100)
+    assert cache.get("b") is None
+    assert {key: cache.get(key) is not None for key in "acd"} == {"a": True, "c": True, "d": True}
+
+    stats = cache.stats()
+    assert stats["entries"] == 3 and stats["bytes"] == 300 and stats["evictions"] == 1
+    # The index and the files on disk agree after eviction
+    assert cached_files(cache) == {"a", "c", "d"}
+
+
+def test_oversized_images_are_not_cached(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=10)
+    cache.put("big", b"x" * 11)
+    assert cache.get("big") is None and cached_files(cache) == set()
+
+
+def test_missing_file_is_a_miss_and_drops_the_index_entry(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=1000)
+    cache.put("a", b"image")
+    os.remove(cache._path("a"))
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_concurrent_identical_keys_share_one_generation(tmp_path):
+    async def run():
+        cache = ImageCache(str(tmp_path), max_bytes=1000)
+        calls = 0
+        release = asyncio.Event()
+
+        async def generate():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return b"png"
+
+        waiters = [asyncio.create_task(cache.get_or_generate("key", generate)) for _ in range(5)]
+        await asyncio.sleep(0.05)
+        assert cache.stats()["inflight"] == 1
+        release.set()
+        results = await asyncio.gather(*waiters)
+
+        assert results == [b"png"] * 5 and calls == 1
+        assert await cache.get_or_generate("key", generate) == b"png" and calls == 1
+        assert cache.stats()["inflight"] == 0
+
+    asyncio.run(run())
+
+
+def test_failed_generation_reaches_every_waiter_and_is_not_cached(tmp_path):
+    async def run():
+        cache = ImageCache(str(tmp_path), max_bytes=1000)
+        release = asyncio.Event()
+
+        async def failing():
+            await release.wait()
+            raise RuntimeError("quota")
+
+        waiters = [asyncio.create_task(cache.get_or_generate("key", failing)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        release.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+        async def working():
+            return b"png"
+
+        assert await cache.get_or_generate("key", working) == b"png"
+
+    asyncio.run(run())
@@ -0,0 +1,43 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from image_store import ImageStore, LocalImageStore, SupabaseImageStore
+
+KEY = hashlib.sha256(b"image").hexdigest()
+
+
+def test_local_store_recognises_only_its_own_urls(tmp_path):
+    store = LocalImageStore(str(tmp_path), "http://api.example/api/images/")
+    store.put(f"{KEY}.webp", b"RIFF....WEBP", "image/webp")
+
+    assert store.name_for(store.url_for(f"{KEY}.webp")) == f"{KEY}.webp"
+    assert store.read(f"{KEY}.webp") == b"RIFF....WEBP"
+    assert store.name_for(f"http://169.254.169.254/latest/{KEY}.webp") is None
+    assert store.name_for("http://api.example/api/images/../secrets.webp") is None
+    assert store.name_for("http://api.example/api/images/notes.txt") is None
+    assert store.name_for(None) is None
+
+
+def test_supabase_store_recognises_its_public_urls():
+    store = SupabaseImageStore(None, "course-images", "https://db.example/storage/v1/object/public/course-images/")
+    assert store.name_for(f"https://db.example/storage/v1/object/public/course-images/{KEY}_thumb.webp") == f"{KEY}_thumb.webp"
+    assert store.name_for(f"https://db.example/storage/v1/object/public/other-bucket/{KEY}.webp") is None
+
+
+def test_concurrent_puts_of_the_same_image_all_succeed(tmp_path):
+    store = LocalImageStore(str(tmp_path), "http://api.example/api/images")
+    data = b"\x89PNG" + b"x" * 200_000
+    name = f"{hashlib.sha256(data).hexdigest()}.png"
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda _: store.put(name, data, "image/png"), range(32)))
+
+    assert store.read(name) == data
+    assert sorted(path.name for path in tmp_path.iterdir()) == [name]
+
+
+def test_image_store_is_abstract():
+    with pytest.raises(TypeError):
+        ImageStore()
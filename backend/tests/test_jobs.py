@@ -0,0 +1,64 @@
+import asyncio
+
+from jobs import JobManager, JobStore
+
+
+def test_restart_reruns_generating_jobs_but_not_interrupted_stores(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    queued = store.create("queued prompt")
+    generating = store.create("generating prompt")
+    store.update(generating["id"], status="running", stage="generating_images", progress=0.5)
+    storing = store.create("storing prompt")
+    store.update(storing["id"], status="running", stage="storing", progress=0.9)
+
+    async def run():
+        ran = []
+
+        async def run_job(job, report_stage):
+            ran.append(job["prompt"])
+            await report_stage("storing")
+            return f"course-{len(ran)}"
+
+        manager = JobManager(store, run_job, concurrency=1)
+        await manager.start()
+        try:
+            await manager._queue.join()
+        finally:
+            await manager.stop()
+        return ran, manager.stats()
+
+    ran, stats = asyncio.run(run())
+    assert sorted(ran) == ["generating prompt", "queued prompt"]
+    assert stats["resumed"] == 2 and stats["interrupted"] == 1 and stats["running"] == 0
+    assert store.get(queued["id"])["status"] == "completed"
+    assert store.get(generating["id"])["status"] == "completed"
+    interrupted = store.get(storing["id"])
+    assert interrupted["status"] == "failed" and interrupted["course_id"] is None
+
+
+def test_submit_deduplicates_active_prompts(tmp_path):
+    async def run():
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def run_job(job, report_stage):
+            started.set()
+            await release.wait()
+            return "course"
+
+        manager = JobManager(JobStore(str(tmp_path / "jobs.db")), run_job, concurrency=1)
+        await manager.start()
+        try:
+            first = await manager.submit("Intro to Python")
+            await started.wait()
+            second = await manager.submit("intro to  python")
+            assert manager.stats()["running"] == 1
+            release.set()
+            await manager._queue.join()
+        finally:
+            await manager.stop()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert not first["deduplicated"] and second["deduplicated"]
+    assert second["id"] == first["id"]
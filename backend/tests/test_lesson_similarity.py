@@ -0,0 +1,46 @@
+from lesson_similarity import LessonSimilarityIndex, choose_bands
+
+TEXT = (
+    "Before welding, inspect the work area for flammable materials, check that the ground clamp "
+    "is attached to clean metal, and put on a helmet with the correct shade lens and dry leather gloves."
+)
+
+
+def test_choose_bands_fits_num_perm():
+    bands, rows = choose_bands(128, 0.8)
+    assert bands * rows <= 128
+    assert abs((1 / bands) ** (1 / rows) - 0.8) < 0.1
+
+
+def test_finds_near_duplicate_and_ignores_unrelated_text():
+    index = LessonSimilarityIndex(threshold=0.8)
+    assert index.add("Welding safety", TEXT, "https://img/weld.webp", "https://img/weld_thumb.webp")
+
+    match = index.find("Welding safety", TEXT + " Always.")
+    assert match["imageUrl"] == "https://img/weld.webp" and match["similarity"] >= 0.8
+    assert index.find("Baking bread", "Knead the dough for ten minutes until it is smooth and elastic.") is None
+
+
+def test_add_reports_whether_it_indexed():
+    index = LessonSimilarityIndex()
+    assert index.add("Title", TEXT, "https://img/a.webp")
+    assert not index.add("Other title", TEXT + " more", "https://img/a.webp")  # image already indexed
+    assert not index.add("", "", "https://img/b.webp")  # no words to sign
+    assert index.stats()["entries"] == 1
+
+
+def test_build_counts_only_real_additions():
+    rows = [
+        {"title": "A", "body": TEXT, "image_url": "https://img/a.webp"},
+        {"title": "A again", "body": TEXT, "image_url": "https://img/a.webp"},
+        {"title": "", "body": "", "image_url": "https://img/empty.webp"},
+        {"title": "External", "body": TEXT, "image_url": "https://elsewhere/x.png"},
+    ]
+    pages = [rows[:3], rows[3:]]
+
+    def fetch_page(start, end):
+        return pages.pop(0) if pages else []
+
+    index = LessonSimilarityIndex()
+    added = index.build(fetch_page, lambda url: url.startswith("https://img/"), page_size=3)
+    assert added == 1 and index.stats()["entries"] == 1
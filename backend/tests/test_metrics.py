@@ -0,0 +1,93 @@
+import asyncio
+import re
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from fastapi.testclient import TestClient
+
+from metrics import MetricsMiddleware, MetricsRegistry, server_timing, span
+
+SERVER_TIMING_RE = re.compile(r'^[\w.]+;dur=\d+\.\d(;desc="x\d+")?$')
+
+
+def make_app(timing_header: bool = True):
+    registry = MetricsRegistry()
+    requests = registry.histogram("http_request_seconds", "Request latency", ("method", "route", "status"))
+    stages = registry.histogram("stage_seconds", "Stage latency", ("stage",), buckets=(0.1, 1.0))
+    tokens = registry.counter("llm_tokens_total", "Tokens", ("model", "type"))
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware, histogram=requests, timing_header=timing_header)
+
+    @app.get("/work")
+    async def work():
+        with span(stages, "db.read", stage="db.read"):
+            pass
+
+        def in_thread():
+            # Worker threads inherit the request's timing context
+            with span(stages, "image", stage="image"):
+                pass
+
+        await asyncio.gather(asyncio.to_thread(in_thread), asyncio.to_thread(in_thread))
+        tokens.inc(120, model="claude", type="output")
+        return {"ok": True}
+
+    @app.get("/metrics")
+    async def render():
+        return PlainTextResponse(registry.render())
+
+    return app
+
+
+def test_metrics_render_after_a_span_with_server_timing():
+    client = TestClient(make_app())
+    response = client.get("/work")
+    assert response.status_code == 200
+
+    parts = response.headers["server-timing"].split(", ")
+    assert all(SERVER_TIMING_RE.match(part) for part in parts), parts
+    names = [part.split(";")[0] for part in parts]
+    assert names == ["db.read", "image", "total"]
+    assert parts[1].endswith(';desc="x2"')
+
+    lines = client.get("/metrics").text.splitlines()
+    assert "# TYPE stage_seconds histogram" in lines
+    assert 'stage_seconds_bucket{stage="db.read",le="0.1"} 1' in lines
+    assert 'stage_seconds_bucket{stage="image",le="+Inf"} 2' in lines
+    assert 'stage_seconds_count{stage="image"} 2' in lines
+    assert any(line.startswith('stage_seconds_sum{stage="db.read"} ') for line in lines)
+    assert "# TYPE llm_tokens_total counter" in lines
+    assert 'llm_tokens_total{model="claude",type="output"} 120' in lines
+    assert 'http_request_seconds_count{method="GET",route="/work",status="200"} 1' in lines
+
+
+def test_no_timing_header_unless_enabled():
+    response = TestClient(make_app(timing_header=False)).get("/work")
+    assert "server-timing" not in response.headers
+
+
+def test_histogram_buckets_are_cumulative_and_labels_escaped():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency", "Latency", ("path",), buckets=(1.0, 2.0))
+    for value in (0.5, 1.5, 1.5, 5):
+        histogram.observe(value, path='a"b\\c')
+    gauge = registry.gauge("live", "Live sessions")
+    registry.on_collect(lambda: gauge.set(3))
+
+    lines = registry.render().splitlines()
+    labels = 'path="a\\"b\\\\c"'
+    assert f'latency_bucket{{{labels},le="1"}} 1' in lines
+    assert f'latency_bucket{{{labels},le="2"}} 3' in lines
+    assert f'latency_bucket{{{labels},le="+Inf"}} 4' in lines
+    assert f"latency_sum{{{labels}}} 8.5" in lines
+    assert "live 3" in lines
+
+    with pytest.raises(ValueError):
+        histogram.observe(1, route="/")
+
+
+def test_server_timing_format():
+    assert server_timing({"db": [0.0123, 1], "image": [1.5, 3]}, 2.0) == (
+        'db;dur=12.3, image;dur=1500.0;desc="x3", total;dur=2000.0'
+    )
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from course_stream import course_output_check
+from model_router import ModelRouter
+
+COURSE = '{"name": "Welding", "modules": [{"title": "Safety", "subModules": [{"title": "PPE"}]}]}'
+
+
+def fake_streams(outputs: dict, delays: dict = None):
+    """open_stream for a router: each model streams its chunks (or raises) after its delay."""
+    delays = delays or {}
+    opened = []
+
+    async def open_stream(model: str, usage: dict):
+        opened.append(model)
+        await asyncio.sleep(delays.get(model, 0))
+        output = outputs[model]
+        if isinstance(output, Exception):
+            raise output
+        for chunk in output:
+            yield chunk
+            await asyncio.sleep(0)
+        usage["output_tokens"] = len(output)
+
+    return open_stream, opened
+
+
+async def collect(router: ModelRouter, open_stream, make_check=None):
+    usage = {}
+    text = "".join([chunk async for chunk in router.stream("course", open_stream, usage, make_check=make_check)])
+    return text, usage
+
+
+def test_first_model_wins_and_reports_usage():
+    async def run():
+        router = ModelRouter(["a", "b"], default_hedge_delay=5)
+        open_stream, opened = fake_streams({"a": ["x", "y"], "b": ["z"]})
+        text, usage = await collect(router, open_stream)
+        assert text == "xy" and usage == {"output_tokens": 2}
+        assert opened == ["a"] and router.wins == {"a": 1}
+
+    asyncio.run(run())
+
+
+def test_error_before_output_falls_back():
+    async def run():
+        router = ModelRouter(["a", "b"], default_hedge_delay=5)
+        open_stream, opened = fake_streams({"a": RuntimeError("overloaded"), "b": ["ok"]})
+        text, _ = await collect(router, open_stream)
+        assert text == "ok" and opened == ["a", "b"]
+        assert router.fallbacks == 1 and router.wins == {"b": 1}
+
+    asyncio.run(run())
+
+
+def test_slow_start_is_hedged():
+    async def run():
+        router = ModelRouter(["a", "b"], default_hedge_delay=0.05)
+        open_stream, opened = fake_streams({"a": ["slow"], "b": ["fast"]}, delays={"a": 1})
+        text, _ = await collect(router, open_stream)
+        assert text == "fast" and opened == ["a", "b"]
+        assert router.hedges == 1 and router.wins == {"b": 1}
+
+    asyncio.run(run())
+
+
+def test_all_failing_raises_last_error():
+    async def run():
+        router = ModelRouter(["a", "b"], default_hedge_delay=5)
+        open_stream, _ = fake_streams({"a": RuntimeError("a down"), "b": RuntimeError("b down")})
+        with pytest.raises(RuntimeError, match="b down"):
+            await collect(router, open_stream)
+
+    asyncio.run(run())
+
+
+def test_invalid_course_output_falls_back_before_anything_is_sent():
+    async def run():
+        router = ModelRouter(["a", "b"], default_hedge_delay=5)
+        open_stream, opened = fake_streams({"a": ["I can't help with that."], "b": [COURSE[:20], COURSE[20:]]})
+        text, usage = await collect(router, open_stream, make_check=course_output_check)
+        assert text == COURSE and usage == {"output_tokens": 2}
+        assert opened == ["a", "b"] and router.wins == {"b": 1}
+
+    asyncio.run(run())
+
+
+def test_course_check_commits_once_the_name_arrives():
+    check = course_output_check()
+    assert check('```json\n{"na', False) is None
+    assert check('me": "Welding", "mod', False) is True
+
+    assert course_output_check(prefix_limit=10)("no json here at all", False) is False
+    truncated = course_output_check()
+    assert truncated('{"modules": [', False) is None
+    assert truncated("", True) is False
+
+
+def test_every_model_rejected_passes_the_last_output_through():
+    async def run():
+        router = ModelRouter(["a", "b"], default_hedge_delay=5)
+        open_stream, _ = fake_streams({"a": ["nope"], "b": ["still nope"]})
+        text, usage = await collect(router, open_stream, make_check=course_output_check)
+        assert text == "still nope" and usage == {"output_tokens": 1}
+
+    asyncio.run(run())
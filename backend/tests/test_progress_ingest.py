@@ -0,0 +1,132 @@
+import asyncio
+import json
+import os
+import uuid
+
+from progress_ingest import ProgressIngestor, SubmoduleIndex, attempt_row, grade_attempt, is_uuid, progress_row
+
+BAD_ID = str(uuid.uuid4())
+
+
+class RejectedRow(Exception):
+    code = "23503"
+
+
+class FakeTable:
+    """Bulk writes that fail whole when any row refers to BAD_ID, like a foreign key violation."""
+
+    def __init__(self):
+        self.progress = {}
+        self.attempts = {}
+        self.writes = 0
+        self.down = False
+
+    def write(self, progress_rows: list, attempt_rows: list):
+        self.writes += 1
+        if self.down:
+            raise ConnectionError("database unreachable")
+        if any(row["submodule_id"] == BAD_ID for row in progress_rows + attempt_rows):
+            raise RejectedRow("violates foreign key constraint")
+        for row in progress_rows:
+            self.progress[(row["user_id"], row["submodule_id"])] = row
+        for row in attempt_rows:
+            self.attempts[row["id"]] = row
+
+
+def make_ingestor(tmp_path, table: FakeTable) -> ProgressIngestor:
+    return ProgressIngestor(
+        str(tmp_path), table.write, flush_size=1000, flush_interval=60, max_pending=100,
+        is_rejection=lambda error: getattr(error, "code", "").startswith("23"),
+    )
+
+
+def test_grade_attempt():
+    grade = grade_attempt(["a", "b", "c"], ["a", " b ", "x"])
+    assert grade == {"correct": 2, "total": 3, "results": [True, True, False], "passed": False}
+    assert grade_attempt(["1"], ["1"])["passed"]
+    assert not grade_attempt([], [])["passed"]
+
+
+def test_is_uuid():
+    assert is_uuid(str(uuid.uuid4()))
+    assert not is_uuid("lesson-1")
+    assert not is_uuid(None)
+
+
+def test_submodule_index_loads_misses_once():
+    loads = []
+
+    def load(ids):
+        loads.append(sorted(ids))
+        return {sid: True for sid in ids if sid != "missing"}
+
+    index = SubmoduleIndex(load, max_entries=10)
+    index.put("a", True)
+    assert index.get_many(["a", "b", "missing"]) == {"a": True, "b": True}
+    assert index.get_many(["a", "b"]) == {"a": True, "b": True}
+    assert loads == [["b", "missing"]]
+
+
+def test_rejected_rows_are_quarantined_and_the_rest_written(tmp_path):
+    async def run():
+        table = FakeTable()
+        ingestor = make_ingestor(tmp_path, table)
+        await ingestor.start()
+        good = [progress_row(f"user-{i}", str(uuid.uuid4()), True, 1) for i in range(6)]
+        bad = progress_row("user-x", BAD_ID, False, 0)
+        attempt = attempt_row("user-0", str(uuid.uuid4()), ["1"], grade_attempt(["1"], ["1"]))
+        await ingestor.submit(good[:3] + [bad] + good[3:], [attempt])
+        await ingestor.flush()
+
+        assert len(table.progress) == 6 and list(table.attempts) == [attempt["id"]]
+        assert ingestor.stats()["quarantined"] == 1 and ingestor.stats()["unflushed"] == 0
+        with open(ingestor.quarantine_path) as f:
+            quarantined = [json.loads(line) for line in f]
+        assert [record["row"]["submodule_id"] for record in quarantined] == [BAD_ID]
+
+        # Later writes are not held up by the bad row
+        await ingestor.submit([progress_row("user-y", str(uuid.uuid4()), True, 1)], [])
+        writes = table.writes
+        await ingestor.flush()
+        assert table.writes == writes + 1 and len(table.progress) == 7
+        await ingestor.stop()
+
+    asyncio.run(run())
+
+
+def test_unreachable_database_keeps_the_batch_for_retry(tmp_path):
+    async def run():
+        table = FakeTable()
+        ingestor = make_ingestor(tmp_path, table)
+        await ingestor.start()
+        await ingestor.submit([progress_row("user-1", str(uuid.uuid4()), True, 1)], [])
+        table.down = True
+        await ingestor.flush()
+        assert ingestor.stats()["unflushed"] == 1 and ingestor.stats()["quarantined"] == 0
+        assert not os.path.exists(ingestor.quarantine_path)
+
+        table.down = False
+        await ingestor.flush()
+        assert len(table.progress) == 1 and ingestor.stats()["unflushed"] == 0
+        await ingestor.stop()
+
+    asyncio.run(run())
+
+
+def test_unwritten_records_are_recovered_after_restart(tmp_path):
+    async def run():
+        table = FakeTable()
+        table.down = True
+        first = make_ingestor(tmp_path, table)
+        await first.start()
+        await first.submit([progress_row("user-1", str(uuid.uuid4()), True, 1)], [])
+        await first.stop()
+
+        table.down = False
+        second = make_ingestor(tmp_path, table)
+        await second.start()
+        await second.flush()
+        assert len(table.progress) == 1
+        await second.stop()
+
+    asyncio.run(run())
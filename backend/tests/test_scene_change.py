@@ -0,0 +1,66 @@
+import numpy as np
+
+from scene_change import SceneChangeDetector, luma_thumbnail, scene_distance
+
+
+def gradient_frame(width: int = 64, height: int = 36, reverse: bool = False) -> bytes:
+    row = np.linspace(0, 255, width, dtype=np.float32)
+    if reverse:
+        row = row[::-1]
+    return np.tile(row, (height, 1)).astype(np.uint8).tobytes()
+
+
+def flat_frame(level: int, width: int = 64, height: int = 36) -> bytes:
+    return bytes([level]) * (width * height)
+
+
+def test_thumbnail_block_averages_the_luma_plane():
+    thumbnail = luma_thumbnail(flat_frame(100), 64, 36)
+    assert thumbnail.shape == (18, 32)
+    assert np.allclose(thumbnail, 100)
+
+    # A frame smaller than the grid keeps its own resolution
+    assert luma_thumbnail(flat_frame(7, 8, 4), 8, 4).shape == (4, 8)
+
+
+def test_distance_ignores_noise_and_sees_new_scenes():
+    base = luma_thumbnail(gradient_frame(), 64, 36)
+    noisy = base + np.random.default_rng(0).uniform(-1, 1, base.shape).astype(np.float32)
+    assert scene_distance(base, base) == 0
+    assert scene_distance(base, noisy) < 0.05
+    assert scene_distance(base, luma_thumbnail(gradient_frame(reverse=True), 64, 36)) > 0.9
+    assert scene_distance(luma_thumbnail(flat_frame(20), 64, 36), luma_thumbnail(flat_frame(220), 64, 36)) == 1
+
+
+def test_detector_checks_once_a_change_settles():
+    first = luma_thumbnail(gradient_frame(), 64, 36)
+    second = luma_thumbnail(gradient_frame(reverse=True), 64, 36)
+    detector = SceneChangeDetector(threshold=0.18, debounce=1.5, min_interval=4.0)
+
+    assert not detector.observe(first, 0.0)
+    # An unchanged view never triggers a check
+    assert not detector.observe(first, 5.0)
+
+    # The view changes, but a check waits until it has held still for the debounce
+    assert not detector.observe(second, 6.0)
+    assert not detector.observe(second, 7.0)
+    assert detector.observe(second, 7.5)
+
+    # The new view is now the reference; holding it doesn't check again
+    assert not detector.observe(second, 20.0)
+
+
+def test_detector_respects_min_interval_and_manual_checks():
+    first = luma_thumbnail(gradient_frame(), 64, 36)
+    second = luma_thumbnail(gradient_frame(reverse=True), 64, 36)
+    detector = SceneChangeDetector(threshold=0.18, debounce=0.0, min_interval=4.0)
+
+    detector.observe(first, 0.0)
+    assert not detector.observe(second, 1.0)
+    assert detector.observe(second, 4.0)
+
+    # A timer-driven check moves the reference to the latest sample
+    detector.observe(first, 10.0)
+    detector.mark_checked(10.0)
+    assert not detector.observe(first, 20.0)
+    assert detector.samples == 5
@@ -0,0 +1,64 @@
+from search_index import SearchIndex, course_document, tokenize
+
+
+def document(course_id: str, title: str, published: bool = True, created_at: str = "2025-01-01") -> dict:
+    row = {"id": course_id, "title": title, "summary": f"About {title}", "is_published": published, "created_at": created_at}
+    return course_document(row, [{"kind": "instruction", "title": "Lesson", "body": f"{title} in practice"}])
+
+
+def test_tokenize_drops_stopwords():
+    assert tokenize("The Basics of Welding, and MIG") == ["basics", "welding", "mig"]
+
+
+def test_ranks_title_matches_and_hides_unpublished():
+    index = SearchIndex()
+    index.upsert(document("weld", "Welding safety"))
+    index.upsert(document("bread", "Baking bread"))
+    index.upsert(document("draft", "Welding drafts", published=False))
+
+    page = index.search("welding")
+    assert [result["id"] for result in page["results"]] == ["weld"] and page["total"] == 1
+
+    assert index.set_published("draft", True)
+    assert {result["id"] for result in index.search("welding")["results"]} == {"weld", "draft"}
+
+
+def test_empty_query_lists_newest_first_with_paging():
+    index = SearchIndex()
+    for day in range(1, 4):
+        index.upsert(document(f"c{day}", f"Course {day}", created_at=f"2025-01-0{day}"))
+    page = index.search("", offset=1, limit=1)
+    assert page["total"] == 3 and [result["id"] for result in page["results"]] == ["c2"]
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "index.json")
+    index = SearchIndex(path)
+    index.upsert(document("weld", "Welding safety"))
+    index.save()
+
+    restored = SearchIndex(path)
+    assert restored.load()
+    assert restored.search("welding")["results"][0]["id"] == "weld"
+    assert not SearchIndex(str(tmp_path / "missing.json")).load()
+
+
+def test_reconcile_catches_a_stale_snapshot_up(tmp_path):
+    path = str(tmp_path / "index.json")
+    index = SearchIndex(path)
+    for course_id, title in (("kept", "Welding"), ("deleted", "Soldering"), ("hidden", "Brazing")):
+        index.upsert(document(course_id, title))
+    index.save()
+
+    restored = SearchIndex(path)
+    restored.load()
+    # Written by this instance after the load; newer than the states below
+    restored.upsert(document("fresh", "Grinding"))
+
+    states = {"kept": True, "hidden": False, "elsewhere": True, "draft": False}
+    missing = restored.reconcile(states)
+
+    assert missing == ["elsewhere"]
+    assert "deleted" not in restored and "fresh" in restored
+    assert [result["id"] for result in restored.search("brazing")["results"]] == []
+    assert restored.dirty
@@ -0,0 +1,231 @@
+import asyncio
+
+import pytest
+
+from upstream_governor import (
+    AdaptiveLimiter,
+    CircuitBreaker,
+    CircuitOpenError,
+    UpstreamError,
+    UpstreamGovernor,
+    classify_exception,
+    parse_retry_after,
+)
+
+
+def make_governor(**overrides) -> UpstreamGovernor:
+    options = dict(max_retries=0, base_delay=0, breaker_threshold=2, breaker_reset=30)
+    options.update(overrides)
+    return UpstreamGovernor("test", **options)
+
+
+def trip(governor: UpstreamGovernor):
+    """Open the breaker, then age it past reset_timeout so the next call is the probe."""
+    for _ in range(governor.breaker.failure_threshold):
+        governor.breaker.on_failure()
+    governor.breaker.opened_at -= governor.breaker.reset_timeout
+    assert governor.breaker.state == "half_open"
+
+
+async def succeed():
+    return "ok"
+
+
+def test_classify_exception():
+    assert classify_exception(UpstreamError("x", 429, "slow down", 2.0)) == ("throttle", 2.0)
+    assert classify_exception(UpstreamError("x", 502, "bad gateway")) == ("transient", None)
+    assert classify_exception(UpstreamError("x", 400, "bad request")) == ("fatal", None)
+    # A caller's own deadline is not retried
+    assert classify_exception(asyncio.TimeoutError()) == ("fatal", None)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+
+
+def test_breaker_opens_and_half_open_probe_closes_it():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.on_failure()
+    assert breaker.check() is None
+    breaker.on_failure()
+    assert breaker.state == "open"
+    assert breaker.check() > 0
+
+    breaker.opened_at -= 30
+    assert breaker.check() is None  # the probe
+    assert breaker.check() == 1.0  # everyone else waits for it
+    breaker.on_success()
+    assert breaker.state == "closed" and not breaker.probing
+
+
+def test_failed_probe_reopens_breaker():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.on_failure()
+    breaker.on_failure()
+    breaker.opened_at -= 30
+    breaker.check()
+    breaker.on_failure()
+    assert breaker.state == "open" and not breaker.probing
+    assert breaker.trips == 2
+
+
+def test_limiter_aimd():
+    limiter = AdaptiveLimiter(initial=4, minimum=1, maximum=8, cooldown=60)
+    limiter.on_throttle()
+    assert limiter.limit == 2
+    limiter.on_throttle()  # within the cooldown: one burst counts once
+    assert limiter.limit == 2
+    for _ in range(4):
+        limiter.on_success()
+    assert 2 < limiter.limit <= 4
+
+
+def test_limiter_blocks_at_limit():
+    async def run():
+        limiter = AdaptiveLimiter(initial=1, minimum=1, maximum=1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        await limiter.release()
+        await asyncio.wait_for(waiter, 1)
+        assert limiter.in_flight == 1
+
+    asyncio.run(run())
+
+
+def test_retries_transient_errors():
+    async def run():
+        governor = make_governor(max_retries=2, breaker_threshold=10)
+        attempts = []
+
+        async def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise UpstreamError("test", 502, "bad gateway")
+            return "ok"
+
+        assert await governor.call(flaky) == "ok"
+        assert governor.retries == 2 and governor.limiter.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_does_not_retry_caller_timeout():
+    async def run():
+        governor = make_governor(max_retries=3)
+        attempts = []
+
+        async def slow():
+            attempts.append(1)
+            await asyncio.sleep(10)
+
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(governor.call(slow), 0.05)
+        assert len(attempts) == 1 and governor.limiter.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_open_breaker_rejects_without_calling():
+    async def run():
+        governor = make_governor()
+        for _ in range(2):
+            governor.breaker.on_failure()
+        called = []
+
+        async def call():
+            called.append(1)
+
+        with pytest.raises(CircuitOpenError):
+            await governor.call(call)
+        assert not called and governor.rejected == 1
+
+    asyncio.run(run())
+
+
+def test_probe_cancelled_while_waiting_for_admission_frees_probe():
+    async def run():
+        governor = make_governor(initial_concurrency=1, max_concurrency=1)
+        trip(governor)
+        await governor.limiter.acquire()  # the only slot is busy, so the probe waits
+        probe = asyncio.create_task(governor.call(succeed))
+        await asyncio.sleep(0.01)
+        assert governor.breaker.probing
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        await governor.limiter.release()
+
+        assert not governor.breaker.probing
+        assert await governor.call(succeed) == "ok"
+        assert governor.breaker.state == "closed"
+
+    asyncio.run(run())
+
+
+def test_probe_cancelled_while_running_frees_probe():
+    async def run():
+        governor = make_governor()
+        trip(governor)
+
+        async def hang():
+            await asyncio.sleep(10)
+
+        probe = asyncio.create_task(governor.call(hang))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        assert not governor.breaker.probing and governor.limiter.in_flight == 0
+        assert await governor.call(succeed) == "ok"
+
+    asyncio.run(run())
+
+
+def test_probe_closed_early_through_generator_exit_frees_probe():
+    async def run():
+        governor = make_governor()
+        trip(governor)
+
+        async def stream():
+            async with governor.hold(succeed):
+                yield "chunk"
+                yield "never read"
+
+        chunks = stream()
+        assert await chunks.__anext__() == "chunk"
+        await chunks.aclose()
+
+        assert not governor.breaker.probing and governor.limiter.in_flight == 0
+        assert await governor.call(succeed) == "ok"
+
+    asyncio.run(run())
+
+
+def test_cancelled_non_probe_leaves_probe_alone():
+    async def run():
+        governor = make_governor(initial_concurrency=1, max_concurrency=1)
+        trip(governor)
+        entered = asyncio.Event()
+        release = asyncio.Event()
+
+        async def probe_call():
+            entered.set()
+            await release.wait()
+            return "ok"
+
+        probe = asyncio.create_task(governor.call(probe_call))
+        await entered.wait()
+        # Other callers are refused while the probe runs; none of them may free its slot
+        with pytest.raises(CircuitOpenError):
+            await governor.call(succeed)
+        assert governor.breaker.probing
+        release.set()
+        assert await probe == "ok"
+        assert governor.breaker.state == "closed"
+
+    asyncio.run(run())
@@ -0,0 +1,105 @@
+import asyncio
+import copy
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from voice_payload import build_voice_payload
+
+META = {"finalAssessment": {"description": "Weld a bead", "arInstructions": ["Clamp the plates", "Strike an arc"]}}
+
+
+def test_steps_come_from_ar_instructions():
+    payload = build_voice_payload("course-1", "Welding", META)
+    assert payload["courseTitle"] == "Welding" and payload["description"] == "Weld a bead"
+    assert payload["steps"] == [
+        {"title": "Step 1", "description": "Clamp the plates"},
+        {"title": "Step 2", "description": "Strike an arc"},
+    ]
+    assert '"Welding"' in payload["voicePrompt"] and "2. Strike an arc" in payload["voicePrompt"]
+
+
+def test_missing_assessment_falls_back_to_one_step():
+    payload = build_voice_payload("course-1", None, {"finalAssessment": None})
+    assert payload["courseTitle"] == "Unknown Course"
+    assert payload["steps"] == [{"title": "Complete Project", "description": "Complete the final project"}]
+    assert "AR Instructions" not in payload["voicePrompt"]
+    assert build_voice_payload("course-1", "T", None)["steps"][0]["title"] == "Complete Project"
+
+
+class FakeCourses:
+    """select/update by id on the courses table, counting selects."""
+
+    def __init__(self):
+        self.rows = {"course-1": {"id": "course-1", "title": "Welding", "meta": META, "is_published": False}}
+        self.selects = 0
+        self._query = None
+
+    def table(self, name: str):
+        return self
+
+    def select(self, columns: str):
+        self.selects += 1
+        self._query = ["select", None]
+        return self
+
+    def update(self, values: dict):
+        self._query = ["update", values]
+        return self
+
+    def eq(self, column: str, value):
+        self._query.append(value)
+        return self
+
+    def execute(self):
+        kind, values, course_id = self._query
+        row = self.rows.get(course_id)
+        if row is not None and kind == "update":
+            row.update(values)
+        return SimpleNamespace(data=[copy.deepcopy(row)] if row is not None else [])
+
+
+@pytest.fixture
+def voice_app(main_module, monkeypatch):
+    db = FakeCourses()
+    monkeypatch.setattr(main_module.clients, "_supabase", db)
+    monkeypatch.setattr(main_module, "course_bundle_task", lambda course_id: None)
+    main_module.invalidate_course_caches("course-1")
+    return main_module, db
+
+
+def test_payload_is_read_through_once(voice_app):
+    main, db = voice_app
+
+    async def run():
+        first = await main.get_voice_payload("course-1")
+        second = await main.get_voice_payload("course-1")
+        assert first == second and first["steps"][0]["description"] == "Clamp the plates"
+        assert db.selects == 1
+        with pytest.raises(HTTPException) as excinfo:
+            await main.get_voice_payload("missing")
+        assert excinfo.value.status_code == 404
+
+    asyncio.run(run())
+
+
+def test_publish_replaces_the_cached_payload(voice_app):
+    main, db = voice_app
+
+    async def run():
+        await main.get_voice_payload("course-1")
+        db.rows["course-1"]["meta"] = {"finalAssessment": {"description": "Grind the weld", "arInstructions": []}}
+        assert (await main.get_voice_payload("course-1"))["description"] == "Weld a bead"
+
+        assert await main.mark_course_published("course-1")
+        selects = db.selects
+        payload = await main.get_voice_payload("course-1")
+        assert payload["description"] == "Grind the weld" and db.selects == selects
+
+        # Any other course write drops the entry, and the next read goes back to the table
+        main.invalidate_course_caches("course-1")
+        await main.get_voice_payload("course-1")
+        assert db.selects == selects + 1
+
+    asyncio.run(run())
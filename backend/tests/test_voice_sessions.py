@@ -0,0 +1,114 @@
+import base64
+import hashlib
+import hmac
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from voice_sessions import TokenSigner, VoiceSessionLimitError, VoiceSessionRegistry
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_registry(**kwargs):
+    clock = FakeClock()
+    return VoiceSessionRegistry(clock=clock, **kwargs), clock
+
+
+def test_sessions_get_unique_rooms_and_identities():
+    registry, _ = make_registry()
+    sessions = registry.issue("course-1", count=3)
+    assert len({session["roomName"] for session in sessions}) == 3
+    assert len({session["identity"] for session in sessions}) == 3
+    assert all(session["roomName"].startswith("course_course-1_room_") for session in sessions)
+    assert registry.session_for_room(sessions[0]["roomName"]) == sessions[0]["sessionId"]
+
+
+def test_caps_are_all_or_none_with_retry_after():
+    registry, clock = make_registry(token_ttl=60, max_sessions=3, max_per_course=2)
+    registry.issue("course-1")
+    clock.now += 10
+
+    with pytest.raises(VoiceSessionLimitError) as excinfo:
+        registry.issue("course-1", count=2)
+    assert excinfo.value.scope == "course" and excinfo.value.available == 1
+    assert excinfo.value.retry_after == 50
+
+    registry.issue("course-2", count=2)
+    with pytest.raises(VoiceSessionLimitError) as excinfo:
+        registry.issue(None)
+    assert excinfo.value.scope == "global" and excinfo.value.available == 0
+    assert registry.live_count() == 3 and registry.stats()["rejected"] == 3
+
+
+def test_unjoined_sessions_expire_with_their_token():
+    registry, clock = make_registry(token_ttl=60, max_sessions=1, retention=100)
+    session = registry.issue("course-1")[0]
+    clock.now += 60
+    assert registry.live_count() == 0
+    assert registry.get(session["sessionId"])["state"] == "expired"
+    assert registry.join(session["sessionId"]) is None
+    registry.issue("course-1")
+
+    clock.now += 100
+    assert registry.get(session["sessionId"]) is None
+    assert registry.session_for_room(session["roomName"]) is None
+
+
+def test_joining_extends_to_max_duration_and_end_frees_capacity():
+    registry, clock = make_registry(token_ttl=60, max_duration=600, max_sessions=1)
+    session = registry.issue()[0]
+    clock.now += 30
+    joined = registry.join(session["sessionId"])
+    assert joined["state"] == "joined" and joined["expiresAt"] == clock.now + 600
+
+    # The stale token deadline no longer expires it
+    clock.now += 60
+    assert registry.live_count() == 1
+
+    assert registry.end(session["sessionId"])["state"] == "ended"
+    assert registry.end(session["sessionId"])["state"] == "ended"
+    assert registry.live_count() == 0 and registry.stats()["ended"] == 1
+    registry.issue()
+
+
+def test_token_signer_produces_a_valid_hs256_jwt():
+    token = TokenSigner("key", "secret").sign({"sub": "learner", "exp": 123})
+    header, payload, signature = token.split(".")
+    expected = hmac.new(b"secret", f"{header}.{payload}".encode(), hashlib.sha256).digest()
+    assert base64.urlsafe_b64decode(signature + "=" * (-len(signature) % 4)) == expected
+    assert json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))) == {"sub": "learner", "exp": 123}
+
+
+def test_ending_a_session_requires_its_own_token(main_module, monkeypatch):
+    main = main_module
+    monkeypatch.setenv("LIVEKIT_API_KEY", "key")
+    monkeypatch.setenv("LIVEKIT_API_SECRET", "secret")
+    client = TestClient(main.app)
+    session, other = main.voice_sessions.issue("course-1", count=2)
+
+    def token_for(session: dict, **kwargs) -> str:
+        return main.create_participant_token(session["identity"], "user", session["roomName"], **kwargs)
+
+    def end(token: str = None):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        return client.post(f"/api/voice-sessions/{session['sessionId']}/end", headers=headers)
+
+    assert end().status_code == 401
+    forged = TokenSigner("key", "not-the-secret").sign({"sub": session["identity"], "iss": "key"})
+    assert end(forged).status_code == 401
+    assert end(token_for(other)).status_code == 403
+    assert main.voice_sessions.get(session["sessionId"])["state"] == "created"
+
+    # Expired but genuine: a joined session outlives its token
+    expired = token_for(session, expires_at=main.voice_sessions.clock() - 10)
+    response = end(expired)
+    assert response.status_code == 200 and response.json()["state"] == "ended"
+    assert client.post("/api/voice-sessions/missing/end", headers={"Authorization": f"Bearer {expired}"}).status_code == 404
@@ -0,0 +1,367 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Status codes that mean "slow down" (drive AIMD) vs "try again" (count toward the breaker)
+THROTTLE_STATUSES = {429, 503, 529}
+TRANSIENT_STATUSES = {500, 502, 504}
+
+# Google API exceptions carry their HTTP status in .code; these names cover the SDK's classes
+THROTTLE_EXCEPTIONS = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable"}
+TRANSIENT_EXCEPTIONS = {"InternalServerError", "BadGateway", "GatewayTimeout", "DeadlineExceeded"}
+
+
+class UpstreamError(Exception):
+    """A non-success response from a provider, with its status and any retry-after hint."""
+
+    def __init__(self, provider: str, status: int, detail: str, retry_after: Optional[float] = None):
+        super().__init__(f"{provider} API error: {status} - {detail}")
+        self.provider = provider
+        self.status = status
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the provider while its circuit breaker is open."""
+
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(f"{provider} is unavailable (circuit open), retry in {retry_after:.0f}s")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_exception(error: BaseException) -> Tuple[str, Optional[float]]:
+    """
+    ("throttle" | "transient" | "fatal", retry_after). Throttles and transient errors
+    are retried; fatal ones (bad requests, parse errors, ...) are raised immediately.
+    """
+    if isinstance(error, UpstreamError):
+        status = error.status
+        retry_after = error.retry_after
+    elif isinstance(error, httpx.TransportError):
+        # A caller's own deadline (asyncio.TimeoutError) is deliberately not here: it is
+        # the caller giving up, so it must not turn into another paid attempt
+        return "transient", None
+    else:
+        status = getattr(error, "code", None)
+        retry_after = None
+        name = type(error).__name__
+        if name in THROTTLE_EXCEPTIONS:
+            return "throttle", None
+        if name in TRANSIENT_EXCEPTIONS:
+            return "transient", None
+
+    if status in THROTTLE_STATUSES:
+        return "throttle", retry_after
+    if status in TRANSIENT_STATUSES:
+        return "transient", retry_after
+    return "fatal", None
+
+
+class TokenBucket:
+    """Refills continuously at per_minute / 60 per second, bursting up to per_minute."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self.waited_seconds = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            delay = (amount - self.tokens) / self.rate
+            self.waited_seconds += delay
+            await asyncio.sleep(delay)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit: +1/limit per success (about +1 per round of requests),
+    halved on a throttle response, at most once per cooldown so one burst of 429s
+    counts as a single signal.
+    """
+
+    def __init__(self, initial: float, minimum: float, maximum: float,
+                 decrease_factor: float = 0.5, cooldown: float = 1.0):
+        self.limit = float(initial)
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition: Optional[asyncio.Condition] = None
+
+    def _cond(self) -> asyncio.Condition:
+        # Created on first use so it binds to the running loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self):
+        condition = self._cond()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < max(1, int(self.limit)))
+            self.in_flight += 1
+
+    async def release(self):
+        condition = self._cond()
+        async with condition:
+            self.in_flight -= 1
+            condition.notify_all()
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def on_throttle(self):
+        now = time.monotonic()
+        if now - self._last_decrease >= self.cooldown:
+            self.limit = max(self.minimum, self.limit * self.decrease_factor)
+            self._last_decrease = now
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures and fails fast for reset_timeout
+    seconds; then lets a single probe through (half-open) and closes if it succeeds.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def check(self) -> Optional[float]:
+        """None if a call may proceed, otherwise seconds until it may."""
+        state = self.state
+        if state == "closed":
+            return None
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return None
+        if state == "half_open":
+            return 1.0
+        return self.reset_timeout - (time.monotonic() - self.opened_at)
+
+    def on_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def on_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self.probing:
+                self.trips += 1
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+    def on_abandoned(self):
+        # A probe that ended without a verdict (cancelled, fatal error) frees the slot
+        self.probing = False
+
+
+class UpstreamGovernor:
+    """
+    Shared gate for every call to one provider: request and token budgets (token
+    buckets), an adaptive concurrency limit, retries with jittered exponential
+    backoff that honor retry-after, and a circuit breaker.
+    """
+
+    def __init__(self, name: str, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 initial_concurrency: int = 8, min_concurrency: int = 1, max_concurrency: int = 32,
+                 max_retries: int = 3, base_delay: float = 0.5, max_delay: float = 20.0,
+                 breaker_threshold: int = 5, breaker_reset: float = 30.0):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.limiter = AdaptiveLimiter(initial_concurrency, min_concurrency, max_concurrency)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.calls = 0
+        self.successes = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls, name: str, prefix: str, **defaults) -> "UpstreamGovernor":
+        """Build from <PREFIX>_RPM, _TPM, _CONCURRENCY, _MIN_CONCURRENCY, _MAX_CONCURRENCY, _MAX_RETRIES."""
+        def env(key: str, default, cast):
+            return cast(os.getenv(f"{prefix}_{key}", str(default)))
+
+        return cls(
+            name,
+            requests_per_minute=env("RPM", defaults.get("requests_per_minute", 0), float),
+            tokens_per_minute=env("TPM", defaults.get("tokens_per_minute", 0), float),
+            initial_concurrency=env("CONCURRENCY", defaults.get("initial_concurrency", 8), int),
+            min_concurrency=env("MIN_CONCURRENCY", defaults.get("min_concurrency", 1), int),
+            max_concurrency=env("MAX_CONCURRENCY", defaults.get("max_concurrency", 32), int),
+            max_retries=env("MAX_RETRIES", defaults.get("max_retries", 3), int),
+            base_delay=float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", "0.5")),
+            max_delay=float(os.getenv("UPSTREAM_RETRY_MAX_DELAY", "20")),
+            breaker_threshold=int(os.getenv("UPSTREAM_BREAKER_THRESHOLD", "5")),
+            breaker_reset=float(os.getenv("UPSTREAM_BREAKER_RESET", "30")),
+        )
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        # A server-provided retry-after is a floor, with jitter on top to spread the retries
+        if retry_after is not None:
+            return min(retry_after, self.max_delay * 3) + random.uniform(0, self.base_delay)
+        # Otherwise full jitter over an exponentially growing window
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _check_breaker(self) -> bool:
+        """Raise CircuitOpenError if calls are refused; True if this call is the half-open probe."""
+        was_probing = self.breaker.probing
+        wait = self.breaker.check()
+        if wait is not None:
+            self.rejected += 1
+            raise CircuitOpenError(self.name, wait)
+        return self.breaker.probing and not was_probing
+
+    async def _admit(self, estimated_tokens: int):
+        if self.requests is not None:
+            await self.requests.acquire(1)
+        if self.tokens is not None and estimated_tokens:
+            await self.tokens.acquire(estimated_tokens)
+        await self.limiter.acquire()
+
+    def _record_failure(self, kind: str, probe: bool):
+        if kind == "throttle":
+            self.throttled += 1
+            self.limiter.on_throttle()
+            if probe:
+                # A throttled probe still proves the provider is up
+                self.breaker.on_success()
+        elif kind == "transient":
+            self.failures += 1
+            self.breaker.on_failure()
+        elif probe:
+            self.breaker.on_abandoned()
+
+    @asynccontextmanager
+    async def hold(self, open_call: Callable[[], Awaitable], estimated_tokens: int = 0):
+        """
+        Retry open_call() until it succeeds, then keep the concurrency slot for the
+        body of the with-block (e.g. while a streamed response is read). Only opening
+        is retried; an error inside the block is recorded and re-raised. A half-open
+        probe that ends without a verdict (cancelled while waiting or running, or the
+        block left through GeneratorExit) gives the probe slot back.
+        """
+        self.calls += 1
+        attempt = 0
+        while True:
+            probe = self._check_breaker()
+            try:
+                await self._admit(estimated_tokens)
+            except BaseException:
+                if probe:
+                    self.breaker.on_abandoned()
+                raise
+            try:
+                opened = await open_call()
+                break
+            except Exception as e:
+                await self.limiter.release()
+                kind, retry_after = classify_exception(e)
+                self._record_failure(kind, probe)
+                if kind == "fatal" or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, retry_after)
+                attempt += 1
+                self.retries += 1
+                logger.warning(f"{self.name} {kind} error ({str(e)[:120]}), retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            except BaseException:
+                if probe:
+                    self.breaker.on_abandoned()
+                await self.limiter.release()
+                raise
+
+        try:
+            yield opened
+        except Exception as e:
+            self._record_failure(classify_exception(e)[0], probe)
+            raise
+        except BaseException:
+            if probe:
+                self.breaker.on_abandoned()
+            raise
+        else:
+            self.successes += 1
+            self.limiter.on_success()
+            self.breaker.on_success()
+        finally:
+            await self.limiter.release()
+
+    async def call(self, make_call: Callable[[], Awaitable], estimated_tokens: int = 0):
+        """Run make_call() under the governor, retrying throttled and transient failures."""
+        async with self.hold(make_call, estimated_tokens) as result:
+            return result
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "successes": self.successes,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "concurrencyLimit": round(self.limiter.limit, 2),
+            "inFlight": self.limiter.in_flight,
+            "circuit": self.breaker.state,
+            "circuitTrips": self.breaker.trips,
+            "requestBucketWaitSeconds": round(self.requests.waited_seconds, 2) if self.requests else None,
+            "tokenBucketWaitSeconds": round(self.tokens.waited_seconds, 2) if self.tokens else None,
+        }
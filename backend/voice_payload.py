@@ -0,0 +1,42 @@
+def build_voice_payload(course_id: str, title: str, meta: dict) -> dict:
+    """
+    Everything the voice endpoints derive from a course's final assessment: the
+    agent's step list, the description, and the voice assistant prompt.
+    """
+    meta = meta or {}
+    title = title or "Unknown Course"
+    final_assessment = meta.get("finalAssessment", {}) or {}
+
+    description = final_assessment.get("description", "Complete the final project")
+    ar_instructions = final_assessment.get("arInstructions", [])
+
+    # Convert to agent step format
+    if ar_instructions:
+        steps = [
+            {"title": f"Step {i+1}", "description": instruction}
+            for i, instruction in enumerate(ar_instructions)
+        ]
+    else:
+        # Fallback if no AR instructions
+        steps = [{"title": "Complete Project", "description": description}]
+
+    ar_text = ""
+    if ar_instructions:
+        ar_text = "AR Instructions:\n" + "\n".join([f"{i+1}. {instruction}" for i, instruction in enumerate(ar_instructions)])
+
+    voice_prompt = (
+        f'You are a helpful voice assistant with live video input from your user. The user said the prompt was "{title}", \n'
+        "        and then supply the metadata that shows the instructions, and description for this final project.\n"
+        "\n"
+        f"        Final project description: {description}\n"
+        "\n"
+        f"        {ar_text}"
+    )
+
+    return {
+        "courseId": course_id,
+        "courseTitle": title,
+        "steps": steps,
+        "description": description,
+        "voicePrompt": voice_prompt,
+    }
@@ -0,0 +1,221 @@
+import base64
+import hashlib
+import heapq
+import hmac
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+LIVE_STATES = ("created", "joined")
+
+
+def _b64url(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+class TokenSigner:
+    """
+    HS256 JWT signer for LiveKit access tokens. The header segment and the HMAC key
+    schedule (the padded inner/outer key states) are computed once, so issuing a token
+    is one payload encode and one copied HMAC.
+    """
+
+    HEADER = _b64url(b'{"alg":"HS256","typ":"JWT"}')
+
+    def __init__(self, api_key: str, api_secret: str):
+        self.api_key = api_key
+        self._mac = hmac.new(api_secret.encode(), digestmod=hashlib.sha256)
+
+    def sign(self, claims: dict) -> str:
+        signing_input = self.HEADER + b"." + _b64url(json.dumps(claims, separators=(",", ":")).encode())
+        mac = self._mac.copy()
+        mac.update(signing_input)
+        return (signing_input + b"." + _b64url(mac.digest())).decode()
+
+
+class VoiceSessionLimitError(Exception):
+    """No capacity for the requested sessions; retry_after is when the first live one expires."""
+
+    def __init__(self, scope: str, limit: int, available: int, retry_after: Optional[float]):
+        super().__init__(f"Voice session limit reached ({scope} limit {limit}, {available} available)")
+        self.scope = scope
+        self.limit = limit
+        self.available = available
+        self.retry_after = retry_after
+
+
+class VoiceSessionRegistry:
+    """
+    Voice sessions by ID, each with its own room and participant identity (UUID based,
+    so concurrent learners never share a room). A session is "created" when its token
+    is issued and expires with that token unless the learner joins; a "joined" session
+    lasts up to max_duration or until it is "ended". Live (created or joined) sessions
+    count against the global and per-course caps (0 means no cap). Finished sessions
+    are kept for retention seconds so late lookups and webhooks still find them.
+    """
+
+    def __init__(self, token_ttl: float = 900, max_duration: float = 3600, max_sessions: int = 0,
+                 max_per_course: int = 0, retention: float = 3600, clock: Callable[[], float] = time.time):
+        self.token_ttl = token_ttl
+        self.max_duration = max_duration
+        self.max_sessions = max_sessions
+        self.max_per_course = max_per_course
+        self.retention = retention
+        self.clock = clock
+        self._sessions: Dict[str, dict] = {}
+        self._by_room: Dict[str, str] = {}
+        self._live_by_course: Dict[Optional[str], int] = {}
+        self._live = 0
+        # (expiresAt, sessionId); entries go stale when a session is joined or ended
+        self._deadlines: list = []
+        self._finished = deque()
+        self._lock = threading.Lock()
+        self.issued = 0
+        self.joined = 0
+        self.ended = 0
+        self.expired = 0
+        self.rejected = 0
+
+    def _finish(self, session: dict, state: str, now: float):
+        session["state"] = state
+        session["endedAt"] = now
+        self._live -= 1
+        course_id = session["courseId"]
+        self._live_by_course[course_id] -= 1
+        if not self._live_by_course[course_id]:
+            del self._live_by_course[course_id]
+        self._finished.append((now, session["sessionId"]))
+
+    def _expire(self, now: float):
+        while self._deadlines and self._deadlines[0][0] <= now:
+            expires_at, session_id = heapq.heappop(self._deadlines)
+            session = self._sessions.get(session_id)
+            if session is not None and session["state"] in LIVE_STATES and session["expiresAt"] == expires_at:
+                self._finish(session, "expired", now)
+                self.expired += 1
+        while self._finished and self._finished[0][0] <= now - self.retention:
+            _, session_id = self._finished.popleft()
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._by_room.pop(session["roomName"], None)
+
+    def _retry_after(self, course_id: Optional[str], now: float, scoped: bool) -> Optional[float]:
+        deadlines = [
+            session["expiresAt"] for session in self._sessions.values()
+            if session["state"] in LIVE_STATES and (not scoped or session["courseId"] == course_id)
+        ]
+        return max(1.0, min(deadlines) - now) if deadlines else None
+
+    def issue(self, course_id: Optional[str] = None, count: int = 1) -> List[dict]:
+        """
+        Create count sessions for a course (or None for the generic assistant), all or
+        none; raises VoiceSessionLimitError if that would exceed a cap.
+        """
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+
+            if self.max_sessions and self._live + count > self.max_sessions:
+                self.rejected += count
+                available = max(0, self.max_sessions - self._live)
+                raise VoiceSessionLimitError("global", self.max_sessions, available, self._retry_after(None, now, False))
+            live_for_course = self._live_by_course.get(course_id, 0)
+            if course_id is not None and self.max_per_course and live_for_course + count > self.max_per_course:
+                self.rejected += count
+                available = max(0, self.max_per_course - live_for_course)
+                raise VoiceSessionLimitError("course", self.max_per_course, available, self._retry_after(course_id, now, True))
+
+            prefix = f"course_{course_id}" if course_id is not None else "voice_assistant"
+            sessions = []
+            for _ in range(count):
+                session_id = uuid.uuid4().hex
+                session = {
+                    "sessionId": session_id,
+                    "courseId": course_id,
+                    "roomName": f"{prefix}_room_{session_id}",
+                    "identity": f"{prefix}_user_{session_id}",
+                    "state": "created",
+                    "createdAt": now,
+                    "expiresAt": now + self.token_ttl,
+                    "joinedAt": None,
+                    "endedAt": None,
+                }
+                self._sessions[session_id] = session
+                self._by_room[session["roomName"]] = session_id
+                heapq.heappush(self._deadlines, (session["expiresAt"], session_id))
+                sessions.append(dict(session))
+
+            self._live += count
+            self._live_by_course[course_id] = live_for_course + count
+            self.issued += count
+            return sessions
+
+    def get(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            self._expire(self.clock())
+            session = self._sessions.get(session_id)
+            return dict(session) if session is not None else None
+
+    def session_for_room(self, room_name: str) -> Optional[str]:
+        with self._lock:
+            return self._by_room.get(room_name)
+
+    def join(self, session_id: str) -> Optional[dict]:
+        """Mark a created session joined, extending it to max_duration; None if it isn't live."""
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is None or session["state"] not in LIVE_STATES:
+                return None
+            if session["state"] == "created":
+                session["state"] = "joined"
+                session["joinedAt"] = now
+                session["expiresAt"] = now + self.max_duration
+                heapq.heappush(self._deadlines, (session["expiresAt"], session_id))
+                self.joined += 1
+            return dict(session)
+
+    def end(self, session_id: str) -> Optional[dict]:
+        """End a live session, freeing its capacity; None if unknown. Ending twice is harmless."""
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if session["state"] in LIVE_STATES:
+                self._finish(session, "ended", now)
+                self.ended += 1
+            return dict(session)
+
+    def live_count(self) -> int:
+        with self._lock:
+            self._expire(self.clock())
+            return self._live
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._expire(self.clock())
+            joined_live = sum(1 for session in self._sessions.values() if session["state"] == "joined")
+            busiest = sorted(
+                ((course, live) for course, live in self._live_by_course.items() if course is not None),
+                key=lambda item: -item[1],
+            )[:10]
+            return {
+                "live": self._live,
+                "liveJoined": joined_live,
+                "tracked": len(self._sessions),
+                "maxSessions": self.max_sessions,
+                "maxSessionsPerCourse": self.max_per_course,
+                "tokenTtlSeconds": self.token_ttl,
+                "busiestCourses": [{"courseId": course, "live": live} for course, live in busiest],
+                "issued": self.issued,
+                "joined": self.joined,
+                "ended": self.ended,
+                "expired": self.expired,
+                "rejected": self.rejected,
+            }
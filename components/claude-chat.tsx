@@ -24,18 +24,18 @@ export function ClaudeChat() {
       const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'}/api/claude`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ prompt })
+        body: JSON.stringify({ prompt, format: 'object' })
       })
       
       const data = await res.json()
       
-      setResponse(data.content)
+      setResponse(data.content ?? '')
 
       try {
         const storeRes = await fetch(`${process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'}/api/course`, {
           method: 'POST',
           headers: {'Content-Type': 'application/json'},
-          body: JSON.stringify({ courseJson: data.content })
+          body: JSON.stringify(data.course ? { course: data.course } : { courseJson: data.content })
         })
         
         const storeData = await storeRes.json()
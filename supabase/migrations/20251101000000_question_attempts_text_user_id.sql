@@ -0,0 +1,4 @@
+-- Quiz attempts are recorded for the same anonymous browser IDs as question_progress,
+-- which have no profiles row, so user_id becomes free-form TEXT here too.
+ALTER TABLE question_attempts DROP CONSTRAINT IF EXISTS question_attempts_user_id_fkey;
+ALTER TABLE question_attempts ALTER COLUMN user_id TYPE TEXT USING user_id::text;
@@ -0,0 +1,152 @@
+-- Per-submodule and per-question learning aggregates, kept current by statement-level
+-- triggers on question_progress and question_attempts so dashboards read a handful of
+-- precomputed rows per course instead of scanning the progress and attempt tables.
+
+CREATE TABLE submodule_stats (
+  submodule_id UUID PRIMARY KEY REFERENCES submodules(id) ON DELETE CASCADE,
+  course_id UUID NOT NULL REFERENCES courses(id) ON DELETE CASCADE,
+  learners INTEGER NOT NULL DEFAULT 0,      -- question_progress rows
+  completed INTEGER NOT NULL DEFAULT 0,     -- ...of which is_completed
+  total_tries BIGINT NOT NULL DEFAULT 0,
+  attempts INTEGER NOT NULL DEFAULT 0,      -- question_attempts rows
+  correct_attempts INTEGER NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+
+CREATE TABLE question_stats (
+  submodule_id UUID REFERENCES submodules(id) ON DELETE CASCADE,
+  idx INTEGER NOT NULL, -- Matches quiz_questions.idx
+  course_id UUID NOT NULL REFERENCES courses(id) ON DELETE CASCADE,
+  answered INTEGER NOT NULL DEFAULT 0,
+  correct INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (submodule_id, idx)
+);
+
+
+CREATE INDEX idx_submodule_stats_course_id ON submodule_stats(course_id);
+CREATE INDEX idx_question_stats_course_id ON question_stats(course_id);
+
+ALTER TABLE submodule_stats ENABLE ROW LEVEL SECURITY;
+ALTER TABLE question_stats ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Allow reading submodule_stats" ON submodule_stats FOR SELECT USING (true);
+CREATE POLICY "Allow reading question_stats" ON question_stats FOR SELECT USING (true);
+
+
+CREATE OR REPLACE FUNCTION bump_submodule_stats(
+  p_submodule_id UUID, p_learners INTEGER, p_completed INTEGER, p_tries BIGINT,
+  p_attempts INTEGER, p_correct_attempts INTEGER
+) RETURNS void LANGUAGE sql AS $$
+  INSERT INTO submodule_stats AS s (submodule_id, course_id, learners, completed, total_tries, attempts, correct_attempts)
+  SELECT sm.id, m.course_id, p_learners, p_completed, p_tries, p_attempts, p_correct_attempts
+  FROM submodules sm JOIN modules m ON m.id = sm.module_id
+  WHERE sm.id = p_submodule_id
+  ON CONFLICT (submodule_id) DO UPDATE SET
+    learners = s.learners + EXCLUDED.learners,
+    completed = s.completed + EXCLUDED.completed,
+    total_tries = s.total_tries + EXCLUDED.total_tries,
+    attempts = s.attempts + EXCLUDED.attempts,
+    correct_attempts = s.correct_attempts + EXCLUDED.correct_attempts,
+    updated_at = NOW();
+$$;
+
+
+-- One bump per submodule per statement, so a bulk upsert costs one stats write per submodule
+CREATE OR REPLACE FUNCTION analytics_question_progress() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    PERFORM bump_submodule_stats(submodule_id, COUNT(*)::int,
+      COUNT(*) FILTER (WHERE is_completed)::int, COALESCE(SUM(tries), 0), 0, 0)
+    FROM new_rows GROUP BY submodule_id;
+  ELSIF TG_OP = 'UPDATE' THEN
+    PERFORM bump_submodule_stats(d.submodule_id, SUM(d.learners)::int, SUM(d.completed)::int, SUM(d.tries), 0, 0)
+    FROM (
+      SELECT submodule_id, 1 AS learners, COALESCE(is_completed, FALSE)::int AS completed, COALESCE(tries, 0) AS tries FROM new_rows
+      UNION ALL
+      SELECT submodule_id, -1, -COALESCE(is_completed, FALSE)::int, -COALESCE(tries, 0) FROM old_rows
+    ) d
+    GROUP BY d.submodule_id
+    HAVING SUM(d.learners) <> 0 OR SUM(d.completed) <> 0 OR SUM(d.tries) <> 0;
+  ELSE
+    PERFORM bump_submodule_stats(submodule_id, -COUNT(*)::int,
+      -COUNT(*) FILTER (WHERE is_completed)::int, -COALESCE(SUM(tries), 0), 0, 0)
+    FROM old_rows GROUP BY submodule_id;
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION analytics_question_attempts() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+  sign INTEGER := CASE WHEN TG_OP = 'INSERT' THEN 1 ELSE -1 END;
+  changed TEXT := CASE WHEN TG_OP = 'INSERT' THEN 'new_rows' ELSE 'old_rows' END;
+BEGIN
+  EXECUTE format($q$
+    SELECT bump_submodule_stats(submodule_id, 0, 0, 0, $1 * COUNT(*)::int, $1 * COUNT(*) FILTER (WHERE is_correct)::int)
+    FROM %I GROUP BY submodule_id
+  $q$, changed) USING sign;
+
+  -- answer_json.results holds one boolean per question, in question order
+  EXECUTE format($q$
+    INSERT INTO question_stats AS q (submodule_id, idx, course_id, answered, correct)
+    SELECT a.submodule_id, r.ord - 1, m.course_id,
+      $1 * COUNT(*)::int, $1 * COUNT(*) FILTER (WHERE r.value = 'true'::jsonb)::int
+    FROM %I a
+    JOIN submodules sm ON sm.id = a.submodule_id
+    JOIN modules m ON m.id = sm.module_id
+    CROSS JOIN LATERAL jsonb_array_elements(
+      CASE WHEN jsonb_typeof(a.answer_json -> 'results') = 'array' THEN a.answer_json -> 'results' ELSE '[]'::jsonb END
+    ) WITH ORDINALITY AS r(value, ord)
+    GROUP BY a.submodule_id, r.ord, m.course_id
+    ON CONFLICT (submodule_id, idx) DO UPDATE SET
+      answered = q.answered + EXCLUDED.answered,
+      correct = q.correct + EXCLUDED.correct
+  $q$, changed) USING sign;
+
+  RETURN NULL;
+END;
+$$;
+
+
+-- Transition tables allow one event per trigger, hence a trigger per event
+CREATE TRIGGER question_progress_analytics_insert AFTER INSERT ON question_progress
+  REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION analytics_question_progress();
+CREATE TRIGGER question_progress_analytics_update AFTER UPDATE ON question_progress
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION analytics_question_progress();
+CREATE TRIGGER question_progress_analytics_delete AFTER DELETE ON question_progress
+  REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION analytics_question_progress();
+
+CREATE TRIGGER question_attempts_analytics_insert AFTER INSERT ON question_attempts
+  REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION analytics_question_attempts();
+CREATE TRIGGER question_attempts_analytics_delete AFTER DELETE ON question_attempts
+  REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION analytics_question_attempts();
+
+
+-- Backfill from existing rows
+INSERT INTO submodule_stats (submodule_id, course_id, learners, completed, total_tries)
+SELECT p.submodule_id, m.course_id, COUNT(*), COUNT(*) FILTER (WHERE p.is_completed), COALESCE(SUM(p.tries), 0)
+FROM question_progress p
+JOIN submodules sm ON sm.id = p.submodule_id
+JOIN modules m ON m.id = sm.module_id
+GROUP BY p.submodule_id, m.course_id;
+
+INSERT INTO submodule_stats AS s (submodule_id, course_id, attempts, correct_attempts)
+SELECT a.submodule_id, m.course_id, COUNT(*), COUNT(*) FILTER (WHERE a.is_correct)
+FROM question_attempts a
+JOIN submodules sm ON sm.id = a.submodule_id
+JOIN modules m ON m.id = sm.module_id
+GROUP BY a.submodule_id, m.course_id
+ON CONFLICT (submodule_id) DO UPDATE SET
+  attempts = EXCLUDED.attempts,
+  correct_attempts = EXCLUDED.correct_attempts;
+
+INSERT INTO question_stats (submodule_id, idx, course_id, answered, correct)
+SELECT a.submodule_id, r.ord - 1, m.course_id, COUNT(*), COUNT(*) FILTER (WHERE r.value = 'true'::jsonb)
+FROM question_attempts a
+JOIN submodules sm ON sm.id = a.submodule_id
+JOIN modules m ON m.id = sm.module_id
+CROSS JOIN LATERAL jsonb_array_elements(
+  CASE WHEN jsonb_typeof(a.answer_json -> 'results') = 'array' THEN a.answer_json -> 'results' ELSE '[]'::jsonb END
+) WITH ORDINALITY AS r(value, ord)
+GROUP BY a.submodule_id, r.ord, m.course_id;